@@ -0,0 +1,258 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class LRUCache:
+    """
+    A thread-safe least-recently-used cache whose entries can expire after a time to live.
+
+    Attributes:
+    - max_entries: The maximum number of entries kept before the least recently used is evicted.
+    - ttl: The default time (in seconds) an entry is kept, or None to keep entries until evicted.
+    - hits: The number of lookups that found an entry.
+    - misses: The number of lookups that found no entry.
+    """
+
+    def __init__(self, max_entries, ttl=None, clock=time.monotonic):
+        """
+        Initializes a new instance of the LRUCache class.
+
+        Args:
+        - max_entries: The maximum number of entries kept before the least recently used is evicted.
+        - ttl: The default time (in seconds) an entry is kept, or None to keep entries until evicted.
+        - clock: A callable returning the current time in seconds.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Returns the value cached for a key, or default if there is none or it has expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > self._clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value, ttl=None):
+        """
+        Caches a value for a key.
+
+        Args:
+        - key: The key to cache the value for.
+        - value: The value to cache.
+        - ttl: The time (in seconds) to keep the value, overriding the default of the cache.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._entries[key] = (value, None if ttl is None else self._clock() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        """
+        Removes the value cached for a key, if any.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """
+        Removes all cached values.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class _FrequencySketch:
+    # a count-min sketch of how often keys were accessed recently, with every counter halved
+    # once enough accesses were counted so that keys that stopped being popular are forgotten
+
+    _DEPTH = 4
+    _MAX_COUNT = 15
+
+    def __init__(self, width):
+        self._width = width
+        self._rows = [[0] * width for _ in range(self._DEPTH)]
+        self._additions = 0
+        self._sample_size = 10 * width
+
+    def increment(self, key):
+        for row, counters in enumerate(self._rows):
+            index = hash((row, key)) % self._width
+            if counters[index] < self._MAX_COUNT:
+                counters[index] += 1
+        self._additions += 1
+        if self._additions >= self._sample_size:
+            for counters in self._rows:
+                counters[:] = [count >> 1 for count in counters]
+            self._additions //= 2
+
+    def frequency(self, key):
+        return min(counters[hash((row, key)) % self._width] for row, counters in enumerate(self._rows))
+
+
+class ObjectCache:
+    """
+    A thread-safe cache of whole decoded objects, bounded by the total size of the cached values.
+
+    Values are evicted least recently used first, but a value is only admitted in place of the
+    values it would evict if its key was accessed more often recently than theirs (TinyLFU), so
+    a scan over many objects read once cannot flush out the popular ones. Every value is cached
+    with a version, such as the hash of the object data, and is only returned for that version,
+    so a value decoded from an object that was overwritten meanwhile is never served. Concurrent
+    misses for the same key and version are coalesced, so only one of them loads the value.
+
+    Attributes:
+    - max_bytes: The most bytes of values cached.
+    - max_value_size: The largest value cached.
+    - size: The number of bytes of values cached.
+    - hits: The number of lookups that found a value.
+    - misses: The number of lookups that loaded a value.
+    - coalesced: The number of misses that waited for a value another lookup was loading.
+    - evictions: The number of values evicted to make room for others.
+    - rejections: The number of loaded values not admitted because they were accessed too rarely.
+    """
+
+    def __init__(self, max_bytes, max_value_size=None, sketch_width=4096):
+        """
+        Initializes a new instance of the ObjectCache class.
+
+        Args:
+        - max_bytes: The most bytes of values cached.
+        - max_value_size: The largest value cached; defaults to an eighth of max_bytes.
+        - sketch_width: The number of counters per row of the sketch estimating access frequencies.
+        """
+        self.max_bytes = max_bytes
+        self.max_value_size = max_value_size if max_value_size is not None else max_bytes // 8
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.rejections = 0
+        self._entries = OrderedDict()
+        self._sketch = _FrequencySketch(sketch_width)
+        self._loads = {}
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key, version, load):
+        """
+        Returns the value cached for a key and version, loading and caching it if there is none.
+
+        Args:
+        - key: The key of the value.
+        - version: The version of the value.
+        - load: A callable returning the value; exceptions it raises are raised to every
+          lookup waiting for it, and nothing is cached.
+        """
+        with self._lock:
+            self._sketch.increment(key)
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            future = self._loads.get((key, version))
+            if future is None:
+                future = self._loads[(key, version)] = Future()
+                loading = True
+            else:
+                self.coalesced += 1
+                loading = False
+        if not loading:
+            return future.result()
+
+        try:
+            value = load()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(value)
+            self._put(key, version, value)
+            return value
+        finally:
+            with self._lock:
+                del self._loads[(key, version)]
+
+    def invalidate(self, key):
+        """
+        Removes the value cached for a key, if any.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.size -= len(entry[1])
+
+    def clear(self):
+        """
+        Removes all cached values.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        """
+        Returns the counters of the cache as a dict.
+        """
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'size': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'rejections': self.rejections,
+            }
+
+    def _put(self, key, version, value):
+        if len(value) > self.max_value_size:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous[1])
+            # find the least recently used values that have to go to make room
+            victims = []
+            freed = 0
+            for victim_key, (_, victim_value) in self._entries.items():
+                if self.size - freed + len(value) <= self.max_bytes:
+                    break
+                victims.append(victim_key)
+                freed += len(victim_value)
+            frequency = self._sketch.frequency(key)
+            if any(self._sketch.frequency(victim_key) > frequency for victim_key in victims):
+                self.rejections += 1
+                return
+            for victim_key in victims:
+                self.size -= len(self._entries.pop(victim_key)[1])
+                self.evictions += 1
+            self._entries[key] = (version, value)
+            self.size += len(value)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
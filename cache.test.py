@@ -0,0 +1,129 @@
+import threading
+import unittest
+
+from cache import LRUCache, ObjectCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLRUCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = LRUCache(2, ttl=10, clock=self.clock)
+
+    def test_get_and_put(self):
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.put('a', 1)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_cached_none_differs_from_default(self):
+        self.cache.put('a', None)
+        self.assertIsNone(self.cache.get('a', False))
+        self.assertIs(self.cache.get('b', False), False)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.put('a', 1)
+        self.cache.put('b', 2)
+        self.cache.get('a')
+        self.cache.put('c', 3)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(len(self.cache), 2)
+
+    def test_entries_expire(self):
+        self.cache.put('a', 1)
+        self.cache.put('b', 2, ttl=20)
+        self.clock.now = 15
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.get('b'), 2)
+
+    def test_invalidate_and_clear(self):
+        self.cache.put('a', 1)
+        self.cache.put('b', 2)
+        self.cache.invalidate('a')
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
+
+
+class TestObjectCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = ObjectCache(10, max_value_size=6)
+
+    def test_loads_once_per_version(self):
+        loads = []
+
+        def load(value):
+            loads.append(value)
+            return value
+
+        self.assertEqual(self.cache.get_or_load('a', 1, lambda: load(b'old')), b'old')
+        self.assertEqual(self.cache.get_or_load('a', 1, lambda: load(b'other')), b'old')
+        self.assertEqual(self.cache.get_or_load('a', 2, lambda: load(b'new')), b'new')
+        self.assertEqual(loads, [b'old', b'new'])
+        self.assertEqual((self.cache.hits, self.cache.misses, self.cache.size), (1, 2, 3))
+
+    def test_size_bound(self):
+        self.cache.get_or_load('a', 1, lambda: b'1234')
+        self.cache.get_or_load('b', 1, lambda: b'1234')
+        self.cache.get_or_load('c', 1, lambda: b'1234')
+        self.cache.get_or_load('large', 1, lambda: b'1234567')
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+        self.assertEqual(len(self.cache), 2)
+        self.assertLessEqual(self.cache.size, 10)
+
+    def test_rarely_used_values_do_not_evict_popular_ones(self):
+        for _ in range(5):
+            self.cache.get_or_load('popular', 1, lambda: b'123456')
+        self.cache.get_or_load('scanned', 1, lambda: b'123456')
+        self.assertEqual(self.cache.get_or_load('popular', 1, lambda: b'reload'), b'123456')
+        self.assertEqual(self.cache.rejections, 1)
+
+    def test_concurrent_misses_load_once(self):
+        release = threading.Event()
+        loads = []
+
+        def load():
+            loads.append(None)
+            release.wait(5)
+            return b'value'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.cache.get_or_load('a', 1, load)))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        while self.cache.stats()['coalesced'] < 3:
+            threading.Event().wait(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [b'value'] * 4)
+        self.assertEqual(len(loads), 1)
+
+    def test_failed_load_is_not_cached(self):
+        def load():
+            raise ValueError('corrupted')
+
+        with self.assertRaises(ValueError):
+            self.cache.get_or_load('a', 1, load)
+        self.assertEqual(self.cache.get_or_load('a', 1, lambda: b'value'), b'value')
+
+    def test_invalidate_and_clear(self):
+        self.cache.get_or_load('a', 1, lambda: b'1')
+        self.cache.get_or_load('b', 1, lambda: b'2')
+        self.cache.invalidate('a')
+        self.assertEqual((len(self.cache), self.cache.size), (1, 1))
+        self.cache.clear()
+        self.assertEqual((len(self.cache), self.cache.size), (0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
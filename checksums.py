@@ -0,0 +1,123 @@
+import base64
+import hashlib
+import zlib
+
+try:
+    import crc32c
+except ImportError:
+    crc32c = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+class ChecksumAlgorithm:
+    """
+    An algorithm the blocks of object data can be checksummed with.
+
+    Every algorithm yields a 32-bit checksum, the size the block index stores.
+
+    Attributes:
+    - algorithm_id: The identifier stored in the metadata record; must never be reused.
+    - name: The name the algorithm is configured by.
+    """
+
+    def __init__(self, algorithm_id, name, compute):
+        self.algorithm_id = algorithm_id
+        self.name = name
+        self._compute = compute
+
+    def compute(self, data: bytes) -> int:
+        return self._compute(data)
+
+
+CHECKSUMS = {}
+CHECKSUMS_BY_ID = {}
+
+
+def register_checksum(algorithm):
+    """
+    Makes a checksum algorithm available by name and by identifier.
+    """
+    CHECKSUMS[algorithm.name] = algorithm
+    CHECKSUMS_BY_ID[algorithm.algorithm_id] = algorithm
+
+
+register_checksum(ChecksumAlgorithm(0, 'crc32', zlib.crc32))
+if crc32c is not None:
+    # uses the CRC32 instruction of SSE 4.2 or ARMv8 where the CPU has one
+    register_checksum(ChecksumAlgorithm(1, 'crc32c', crc32c.crc32c))
+if xxhash is not None:
+    register_checksum(ChecksumAlgorithm(2, 'xxh3', lambda data: xxhash.xxh3_64_intdigest(data) & 0xffffffff))
+
+# the algorithm of blocks written before the algorithm was recorded
+DEFAULT_CHECKSUM_ID = 0
+
+
+class BadDigestError(Exception):
+    pass
+
+
+class ObjectChecksum:
+    """
+    One of the whole-object checksums S3 clients can send in an x-amz-checksum-* header, computed
+    over a stream of object data. SHA-256 is not computed at all, as the object hash already is.
+
+    Attributes:
+    - algorithm: The name of the algorithm as used in the header, such as 'crc32c'.
+    """
+
+    def __init__(self, algorithm):
+        """
+        Initializes a new instance of the ObjectChecksum class.
+
+        Raises:
+        - ValueError: If the algorithm is not available.
+        """
+        if algorithm not in OBJECT_CHECKSUMS:
+            raise ValueError(f"Checksum algorithm {algorithm} is not available.")
+        self.algorithm = algorithm
+        self._state = OBJECT_CHECKSUMS[algorithm]()
+
+    def update(self, data: bytes):
+        self._state.update(data)
+
+    def value(self, object_hash: str) -> str:
+        """
+        Returns the base64-encoded checksum as sent in the header, given the hex SHA-256 hash of the object.
+        """
+        if self.algorithm == 'sha256':
+            return sha256_checksum(object_hash)
+        return base64.b64encode(self._state.digest()).decode('ascii')
+
+
+class _Crc32:
+    def __init__(self, compute=zlib.crc32):
+        self._compute = compute
+        self._value = 0
+
+    def update(self, data):
+        self._value = self._compute(data, self._value)
+
+    def digest(self):
+        return self._value.to_bytes(4, 'big')
+
+
+class _Nothing:
+    def update(self, data):
+        pass
+
+
+# the state of every algorithm of the x-amz-checksum-* headers, by name
+OBJECT_CHECKSUMS = {'crc32': _Crc32, 'sha1': hashlib.sha1, 'sha256': _Nothing}
+if crc32c is not None:
+    OBJECT_CHECKSUMS['crc32c'] = lambda: _Crc32(crc32c.crc32c)
+
+
+def sha256_checksum(object_hash: str) -> str:
+    """
+    Returns the x-amz-checksum-sha256 value of an object from its hex SHA-256 hash.
+    """
+    return base64.b64encode(bytes.fromhex(object_hash)).decode('ascii')
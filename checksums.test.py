@@ -0,0 +1,39 @@
+import base64
+import hashlib
+import unittest
+import zlib
+
+from checksums import CHECKSUMS, CHECKSUMS_BY_ID, DEFAULT_CHECKSUM_ID, ObjectChecksum, sha256_checksum
+
+
+class TestChecksums(unittest.TestCase):
+    def test_crc32_is_the_default(self):
+        self.assertIs(CHECKSUMS_BY_ID[DEFAULT_CHECKSUM_ID], CHECKSUMS['crc32'])
+        self.assertEqual(CHECKSUMS['crc32'].compute(b'data'), zlib.crc32(b'data'))
+
+    def test_checksums_fit_the_block_index(self):
+        for algorithm in CHECKSUMS.values():
+            self.assertLess(algorithm.compute(b'data' * 1000), 2 ** 32)
+
+    def test_object_checksums(self):
+        data = [b'object ', b'data']
+        object_hash = hashlib.sha256(b''.join(data)).hexdigest()
+        expected_values = {
+            'crc32': base64.b64encode(zlib.crc32(b'object data').to_bytes(4, 'big')).decode(),
+            'sha1': base64.b64encode(hashlib.sha1(b'object data').digest()).decode(),
+            'sha256': base64.b64encode(hashlib.sha256(b'object data').digest()).decode(),
+        }
+        for algorithm, expected_value in expected_values.items():
+            object_checksum = ObjectChecksum(algorithm)
+            for chunk in data:
+                object_checksum.update(chunk)
+            self.assertEqual(object_checksum.value(object_hash), expected_value)
+        self.assertEqual(sha256_checksum(object_hash), expected_values['sha256'])
+
+    def test_unknown_object_checksum(self):
+        with self.assertRaises(ValueError):
+            ObjectChecksum('crc64nvme')
+
+
+if __name__ == '__main__':
+    unittest.main()
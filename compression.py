@@ -0,0 +1,153 @@
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+
+class Codec:
+    """
+    A compression codec blocks of object data can be stored with.
+
+    Attributes:
+    - codec_id: The identifier stored in the block index; must never be reused.
+    - name: The name the codec is configured by.
+    """
+
+    def __init__(self, codec_id, name, compress, decompress):
+        self.codec_id = codec_id
+        self.name = name
+        self._compress = compress
+        self._decompress = decompress
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compress(data)
+
+    def decompress(self, data: bytes, max_length: int) -> bytes:
+        """
+        Decompresses a block without producing more than max_length + 1 bytes, so that a
+        corrupted block cannot expand without bound. A block that would decompress to more
+        than max_length bytes either raises or returns more than max_length bytes.
+        """
+        return self._decompress(data, max_length)
+
+
+def _zlib_decompress(data, max_length):
+    decompressor = zlib.decompressobj()
+    block = decompressor.decompress(data, max_length + 1)
+    if not decompressor.eof:
+        raise ValueError("Block is truncated.")
+    return block
+
+
+# zstd compressors and decompressors must not be used by several threads at once, and blocks are
+# compressed on the threads of the block executor, so every thread keeps its own
+_zstd_contexts = threading.local()
+
+
+def _zstd_compress(data):
+    compressor = getattr(_zstd_contexts, 'compressor', None)
+    if compressor is None:
+        compressor = _zstd_contexts.compressor = zstandard.ZstdCompressor()
+    return compressor.compress(data)
+
+
+def _zstd_decompress(data, max_length):
+    decompressor = getattr(_zstd_contexts, 'decompressor', None)
+    if decompressor is None:
+        decompressor = _zstd_contexts.decompressor = zstandard.ZstdDecompressor()
+    return decompressor.decompress(data, max_output_size=max_length + 1)
+
+
+def _lz4_decompress(data, max_length):
+    decompressor = lz4.frame.LZ4FrameDecompressor()
+    return decompressor.decompress(data, max_length + 1)
+
+
+CODECS = {}
+CODECS_BY_ID = {}
+
+
+def register_codec(codec):
+    """
+    Makes a codec available by name and by identifier.
+    """
+    CODECS[codec.name] = codec
+    CODECS_BY_ID[codec.codec_id] = codec
+
+
+register_codec(Codec(0, 'none', bytes, lambda data, max_length: data[:max_length + 1]))
+register_codec(Codec(1, 'zlib', zlib.compress, _zlib_decompress))
+if zstandard is not None:
+    register_codec(Codec(2, 'zstd', _zstd_compress, _zstd_decompress))
+if lz4 is not None:
+    register_codec(Codec(3, 'lz4', lz4.frame.compress, _lz4_decompress))
+
+# the codec of blocks written before the codec of each block was recorded
+DEFAULT_CODEC_ID = 1
+
+# the leading bytes of formats that are already compressed and would not shrink any further
+COMPRESSED_SIGNATURES = (
+    b'\x1f\x8b',  # gzip
+    b'\x28\xb5\x2f\xfd',  # zstd
+    b'\x04\x22\x4d\x18',  # lz4
+    b'BZh',  # bzip2
+    b'\xfd7zXZ\x00',  # xz
+    b'PK\x03\x04',  # zip, and formats built on it such as docx, jar and npz
+    b'7z\xbc\xaf\x27\x1c',  # 7z
+    b'\x89PNG',  # png
+    b'\xff\xd8\xff',  # jpeg
+    b'GIF8',  # gif
+    b'RIFF',  # webp, wav, avi
+    b'OggS',  # ogg
+    b'fLaC',  # flac
+    b'ID3',  # mp3
+    b'%PDF',  # pdf
+)
+
+
+def is_compressed(data: bytes) -> bool:
+    """
+    Returns whether data looks like it is already compressed, judging by its leading bytes.
+    """
+    return data.startswith(COMPRESSED_SIGNATURES) or data[4:8] in (b'ftyp', b'moov')
+
+
+class CompressionPolicy:
+    """
+    Chooses the codec objects are stored with.
+
+    Attributes:
+    - default_codec: The name of the codec used for buckets without a codec of their own.
+    - bucket_codecs: A dict mapping bucket names to the names of their codecs.
+    - min_ratio: The compressed size, as a fraction of the original size, above which a block
+      is stored uncompressed instead.
+    """
+
+    def __init__(self, default_codec='zlib', bucket_codecs=None, min_ratio=0.9):
+        """
+        Initializes a new instance of the CompressionPolicy class.
+
+        Raises:
+        - ValueError: If a codec is not available.
+        """
+        self.default_codec = default_codec
+        self.bucket_codecs = dict(bucket_codecs or {})
+        self.min_ratio = min_ratio
+        for codec_name in [default_codec, *self.bucket_codecs.values()]:
+            if codec_name not in CODECS:
+                raise ValueError(f"Codec {codec_name} is not available.")
+
+    def codec_for(self, object_key: str) -> Codec:
+        """
+        Returns the codec an object is stored with, chosen by the bucket it is in.
+        """
+        bucket = object_key.partition('/')[0]
+        return CODECS[self.bucket_codecs.get(bucket, self.default_codec)]
@@ -0,0 +1,52 @@
+import os
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from compression import CODECS, CODECS_BY_ID, CompressionPolicy, is_compressed
+
+
+class TestCompression(unittest.TestCase):
+    def test_codecs_round_trip(self):
+        data = b'abc' * 10000 + os.urandom(100)
+        for codec in CODECS.values():
+            with self.subTest(codec=codec.name):
+                self.assertIs(CODECS_BY_ID[codec.codec_id], codec)
+                self.assertEqual(codec.decompress(codec.compress(data), len(data)), data)
+
+    def test_codecs_are_thread_safe(self):
+        blocks = [bytes([i]) * 50000 + os.urandom(1000) for i in range(64)]
+        for codec in CODECS.values():
+            with self.subTest(codec=codec.name), ThreadPoolExecutor(max_workers=8) as executor:
+                compressed_blocks = list(executor.map(codec.compress, blocks))
+                self.assertEqual(list(executor.map(codec.decompress, compressed_blocks, [50000 + 1000] * 64)),
+                                 blocks)
+
+    def test_decompress_is_bounded(self):
+        data = b'a' * 100000
+        for codec in CODECS.values():
+            with self.subTest(codec=codec.name):
+                try:
+                    self.assertEqual(len(codec.decompress(codec.compress(data), 1000)), 1001)
+                except ValueError:
+                    pass
+
+    def test_is_compressed(self):
+        self.assertTrue(is_compressed(b'\x1f\x8b\x08\x00'))
+        self.assertTrue(is_compressed(b'\x89PNG\r\n\x1a\n'))
+        self.assertTrue(is_compressed(b'\x00\x00\x00\x20ftypisom'))
+        self.assertFalse(is_compressed(b'PAR1'))
+        self.assertFalse(is_compressed(b'{"key": "value"}'))
+
+    def test_policy_chooses_codec_by_bucket(self):
+        policy = CompressionPolicy(default_codec='zlib', bucket_codecs={'images': 'none'})
+
+        self.assertIs(policy.codec_for('images/cat.png'), CODECS['none'])
+        self.assertIs(policy.codec_for('logs/2026/10/17.log'), CODECS['zlib'])
+
+    def test_policy_with_unavailable_codec(self):
+        with self.assertRaises(ValueError):
+            CompressionPolicy(default_codec='brotli')
+
+
+if __name__ == '__main__':
+    unittest.main()
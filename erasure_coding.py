@@ -0,0 +1,169 @@
+import numpy as np
+
+# the prefix of the keys shards of erasure-coded objects are stored under
+SHARD_PREFIX = '.shards/'
+
+# the primitive polynomial x^8 + x^4 + x^3 + x^2 + 1 generating GF(256)
+_POLYNOMIAL = 0x11d
+
+_EXP = np.zeros(512, dtype=np.uint8)
+_LOG = np.zeros(256, dtype=np.int64)
+_value = 1
+for _power in range(255):
+    _EXP[_power] = _value
+    _LOG[_value] = _power
+    _value <<= 1
+    if _value & 0x100:
+        _value ^= _POLYNOMIAL
+_EXP[255:510] = _EXP[:255]
+
+# the product of every pair of field elements, so that multiplying a whole shard by a constant
+# is a single table lookup per byte
+_MUL = np.zeros((256, 256), dtype=np.uint8)
+_MUL[1:, 1:] = _EXP[_LOG[1:, None] + _LOG[None, 1:]]
+
+
+def _gf_mul(a, b):
+    return int(_MUL[a, b])
+
+
+def _gf_inv(a):
+    return int(_EXP[255 - _LOG[a]])
+
+
+def _gf_invert_matrix(matrix):
+    # Gauss-Jordan elimination over GF(256), in which addition and subtraction are XOR
+    size = len(matrix)
+    rows = [list(row) + [int(i == j) for j in range(size)] for i, row in enumerate(matrix)]
+    for column in range(size):
+        pivot = next((row for row in range(column, size) if rows[row][column]), None)
+        if pivot is None:
+            raise ValueError("Matrix is singular.")
+        rows[column], rows[pivot] = rows[pivot], rows[column]
+        inverse = _gf_inv(rows[column][column])
+        rows[column] = [_gf_mul(inverse, value) for value in rows[column]]
+        for row in range(size):
+            factor = rows[row][column]
+            if row != column and factor:
+                rows[row] = [value ^ _gf_mul(factor, pivot_value)
+                             for value, pivot_value in zip(rows[row], rows[column])]
+    return [row[size:] for row in rows]
+
+
+def shard_key(object_key: str, shard_index: int) -> str:
+    """
+    Returns the key one shard of an erasure-coded object is stored under.
+    """
+    return f'{SHARD_PREFIX}{object_key}.{shard_index}'
+
+
+class NotEnoughShardsError(Exception):
+    pass
+
+
+class ErasureCoder:
+    """
+    A systematic Reed-Solomon code over GF(256) splitting data into data shards and parity shards.
+
+    The data shards hold the data itself, split into equal pieces, and every parity shard holds a
+    different linear combination of them, so the data can be rebuilt from any data_shards of the
+    shards. The parity rows form a Cauchy matrix, every square submatrix of which is invertible.
+    Shards are encoded and decoded with NumPy, a whole shard per table lookup.
+
+    Attributes:
+    - data_shards: The number of shards holding the data.
+    - parity_shards: The number of shards holding parity.
+    """
+
+    def __init__(self, data_shards: int = 4, parity_shards: int = 2):
+        """
+        Initializes a new instance of the ErasureCoder class.
+
+        Raises:
+        - ValueError: If there are no data shards or more than 256 shards.
+        """
+        if data_shards < 1 or parity_shards < 0 or data_shards + parity_shards > 256:
+            raise ValueError("Invalid number of shards.")
+        self.data_shards = data_shards
+        self.parity_shards = parity_shards
+        self._parity_matrix = [[_gf_inv((data_shards + i) ^ j) for j in range(data_shards)]
+                               for i in range(parity_shards)]
+        self._decode_matrices = {}
+
+    @property
+    def num_shards(self) -> int:
+        return self.data_shards + self.parity_shards
+
+    def shard_size(self, size: int) -> int:
+        """
+        Returns the size of every shard of data of the given size.
+        """
+        return -(-size // self.data_shards)
+
+    def encode(self, data: bytes):
+        """
+        Splits data into shards.
+
+        Returns:
+        - A list of num_shards shards of equal size, the data shards first.
+        """
+        pieces = self._split(data)
+        return [self._encode_shard(pieces, shard_index) for shard_index in range(self.num_shards)]
+
+    def encode_shard(self, data: bytes, shard_index: int) -> bytes:
+        """
+        Returns one of the shards data is split into, computing only that shard.
+        """
+        return self._encode_shard(self._split(data), shard_index)
+
+    def _encode_shard(self, pieces, shard_index):
+        if shard_index < self.data_shards:
+            return pieces[shard_index].tobytes()
+        shard = np.zeros(pieces.shape[1], dtype=np.uint8)
+        for coefficient, piece in zip(self._parity_matrix[shard_index - self.data_shards], pieces):
+            shard ^= _MUL[coefficient][piece]
+        return shard.tobytes()
+
+    def decode(self, shards, size: int) -> bytes:
+        """
+        Rebuilds data from its shards.
+
+        Args:
+        - shards: A dict mapping shard indexes to shards; at least data_shards are needed.
+        - size: The size of the data.
+
+        Raises:
+        - NotEnoughShardsError: If fewer than data_shards shards are given.
+        """
+        if len(shards) < self.data_shards:
+            raise NotEnoughShardsError(f"{len(shards)} of {self.data_shards} shards are available.")
+        if all(shard_index in shards for shard_index in range(self.data_shards)):
+            return b''.join(shards[shard_index] for shard_index in range(self.data_shards))[:size]
+
+        # prefer data shards, which need no decoding
+        shard_indexes = tuple(sorted(shards)[:self.data_shards])
+        decode_matrix = self._decode_matrix(shard_indexes)
+        pieces = np.stack([np.frombuffer(shards[shard_index], dtype=np.uint8) for shard_index in shard_indexes])
+        data = np.zeros((self.data_shards, pieces.shape[1]), dtype=np.uint8)
+        for data_index in range(self.data_shards):
+            if data_index in shards:
+                data[data_index] = pieces[shard_indexes.index(data_index)]
+                continue
+            for coefficient, piece in zip(decode_matrix[data_index], pieces):
+                data[data_index] ^= _MUL[coefficient][piece]
+        return data.tobytes()[:size]
+
+    def _split(self, data):
+        shard_size = self.shard_size(len(data))
+        pieces = np.zeros(self.data_shards * shard_size, dtype=np.uint8)
+        pieces[:len(data)] = np.frombuffer(data, dtype=np.uint8)
+        return pieces.reshape(self.data_shards, shard_size)
+
+    def _decode_matrix(self, shard_indexes):
+        decode_matrix = self._decode_matrices.get(shard_indexes)
+        if decode_matrix is None:
+            encode_rows = [[int(shard_index == j) for j in range(self.data_shards)] if shard_index < self.data_shards
+                           else self._parity_matrix[shard_index - self.data_shards]
+                           for shard_index in shard_indexes]
+            decode_matrix = self._decode_matrices[shard_indexes] = _gf_invert_matrix(encode_rows)
+        return decode_matrix
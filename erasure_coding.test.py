@@ -0,0 +1,48 @@
+import itertools
+import os
+import unittest
+
+from erasure_coding import ErasureCoder, NotEnoughShardsError, shard_key
+
+
+class TestErasureCoder(unittest.TestCase):
+    def setUp(self):
+        self.erasure_coder = ErasureCoder(data_shards=4, parity_shards=2)
+        self.data = os.urandom(100003)
+        self.shards = self.erasure_coder.encode(self.data)
+
+    def test_shards_are_equal_sized(self):
+        self.assertEqual(len(self.shards), 6)
+        self.assertEqual({len(shard) for shard in self.shards}, {self.erasure_coder.shard_size(len(self.data))})
+        self.assertEqual(b''.join(self.shards[:4])[:len(self.data)], self.data)
+
+    def test_decode_from_any_data_shards(self):
+        for shard_indexes in itertools.combinations(range(6), 4):
+            shards = {shard_index: self.shards[shard_index] for shard_index in shard_indexes}
+            self.assertEqual(self.erasure_coder.decode(shards, len(self.data)), self.data)
+
+    def test_encode_shard(self):
+        for shard_index, shard in enumerate(self.shards):
+            self.assertEqual(self.erasure_coder.encode_shard(self.data, shard_index), shard)
+
+    def test_not_enough_shards(self):
+        with self.assertRaises(NotEnoughShardsError):
+            self.erasure_coder.decode({0: self.shards[0], 5: self.shards[5], 3: self.shards[3]}, len(self.data))
+
+    def test_empty_and_small_data(self):
+        for data in [b'', b'x', b'abcde']:
+            shards = self.erasure_coder.encode(data)
+            self.assertEqual(self.erasure_coder.decode(dict(enumerate(shards[2:], 2)), len(data)), data)
+
+    def test_invalid_number_of_shards(self):
+        with self.assertRaises(ValueError):
+            ErasureCoder(data_shards=0)
+        with self.assertRaises(ValueError):
+            ErasureCoder(data_shards=200, parity_shards=100)
+
+    def test_shard_key(self):
+        self.assertEqual(shard_key('bucket/object', 3), '.shards/bucket/object.3')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,25 +1,120 @@
 import hashlib
 import hmac
 import sqlite3
+import threading
+
+from cache import LRUCache
 
 
 class IdentityLayer:
-    def __init__(self, db_file):
+    """
+    Verifies access keys against the access_keys table of a SQLite database.
+
+    Every thread keeps its own open connection to the database, and the expected signature of
+    every access key looked up is cached, so most verifications cost a single HMAC. Unknown
+    access keys are cached as well, for a shorter time. Keys changed through set_access_key
+    and delete_access_key are invalidated right away; keys changed directly in the database
+    are picked up once their cache entry expires, or after invalidate is called.
+
+    Attributes:
+    - db_file: The SQLite database holding access keys.
+    """
+
+    def __init__(self, db_file, cache_size=10000, cache_ttl=60, negative_cache_ttl=5):
+        """
+        Initializes a new instance of the IdentityLayer class.
+
+        Args:
+        - db_file: The SQLite database holding access keys.
+        - cache_size: The maximum number of access keys cached.
+        - cache_ttl: The time (in seconds) a known access key is cached.
+        - negative_cache_ttl: The time (in seconds) an unknown access key is cached.
+        """
         self.db_file = db_file
+        self.negative_cache_ttl = negative_cache_ttl
+        self._signatures = LRUCache(cache_size, cache_ttl)
+        self._generation = 0
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
 
     def verify_access_key(self, access_key, secret_key):
-        conn = sqlite3.connect(self.db_file)
-        c = conn.cursor()
+        if access_key is None or secret_key is None:
+            return False
+
+        expected_signature = self._signatures.get(access_key, False)
+        if expected_signature is False:
+            expected_signature = self._lookup_signature(access_key)
+
+        if expected_signature is None:
+            return False
+
+        actual_signature = hmac.new(secret_key.encode('utf-8'), access_key.encode('utf-8'), hashlib.sha256).hexdigest()
+
+        return hmac.compare_digest(expected_signature, actual_signature)
+
+    def set_access_key(self, access_key, secret_key):
+        """
+        Adds an access key, or replaces its secret key if it already exists.
+        """
+        conn = self._get_connection()
+        with conn:
+            conn.execute('DELETE FROM access_keys WHERE access_key = ?', (access_key,))
+            conn.execute('INSERT INTO access_keys (access_key, secret_key) VALUES (?, ?)', (access_key, secret_key))
+        self.invalidate(access_key)
+
+    def delete_access_key(self, access_key):
+        """
+        Deletes an access key.
+        """
+        conn = self._get_connection()
+        with conn:
+            conn.execute('DELETE FROM access_keys WHERE access_key = ?', (access_key,))
+        self.invalidate(access_key)
+
+    def invalidate(self, access_key=None):
+        """
+        Drops an access key, or all access keys if none is given, from the cache.
+        """
+        # lookups that started before the invalidation must not cache what they read
+        self._generation += 1
+        if access_key is None:
+            self._signatures.clear()
+        else:
+            self._signatures.invalidate(access_key)
+
+    def close(self):
+        """
+        Closes the database connections of all threads.
+        """
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    def _lookup_signature(self, access_key):
+        generation = self._generation
+        c = self._get_connection().cursor()
 
         c.execute('SELECT secret_key FROM access_keys WHERE access_key = ?', (access_key,))
         row = c.fetchone()
 
         if row is None:
-            return False
+            if generation == self._generation:
+                self._signatures.put(access_key, None, ttl=self.negative_cache_ttl)
+            return None
 
         expected_signature = hmac.new(row[0].encode('utf-8'), access_key.encode('utf-8'), hashlib.sha256).hexdigest()
-        actual_signature = hmac.new(secret_key.encode('utf-8'), access_key.encode('utf-8'), hashlib.sha256).hexdigest()
+        if generation == self._generation:
+            self._signatures.put(access_key, expected_signature)
+        return expected_signature
 
-        conn.close()
-
-        return hmac.compare_digest(expected_signature, actual_signature)
+    def _get_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, check_same_thread=False)
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
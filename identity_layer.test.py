@@ -1,6 +1,7 @@
 import os
 import sqlite3
 import tempfile
+import threading
 import unittest
 
 from identity_layer import IdentityLayer
@@ -17,6 +18,7 @@ class TestIdentityLayer(unittest.TestCase):
         conn.close()
 
     def tearDown(self):
+        self.identity_layer.close()
         os.close(self.db_fd)
         os.unlink(self.db_file)
 
@@ -46,6 +48,68 @@ class TestIdentityLayer(unittest.TestCase):
         conn.close()
         self.assertFalse(self.identity_layer.verify_access_key(access_key, secret_key))
 
+    def delete_access_key_directly(self, access_key):
+        conn = sqlite3.connect(self.db_file)
+        conn.execute('DELETE FROM access_keys WHERE access_key = ?', (access_key,))
+        conn.commit()
+        conn.close()
+
+    def test_verified_access_key_is_cached(self):
+        self.identity_layer.set_access_key('access_key_1', 'secret_key_1')
+        self.assertTrue(self.identity_layer.verify_access_key('access_key_1', 'secret_key_1'))
+
+        self.delete_access_key_directly('access_key_1')
+
+        self.assertTrue(self.identity_layer.verify_access_key('access_key_1', 'secret_key_1'))
+        self.assertFalse(self.identity_layer.verify_access_key('access_key_1', 'wrong_secret_key'))
+        self.identity_layer.invalidate('access_key_1')
+        self.assertFalse(self.identity_layer.verify_access_key('access_key_1', 'secret_key_1'))
+
+    def test_unknown_access_key_is_cached(self):
+        self.identity_layer.negative_cache_ttl = 60
+        self.assertFalse(self.identity_layer.verify_access_key('access_key_1', 'secret_key_1'))
+
+        conn = sqlite3.connect(self.db_file)
+        conn.execute("INSERT INTO access_keys VALUES ('access_key_1', 'secret_key_1')")
+        conn.commit()
+        conn.close()
+
+        self.assertFalse(self.identity_layer.verify_access_key('access_key_1', 'secret_key_1'))
+        self.identity_layer.invalidate()
+        self.assertTrue(self.identity_layer.verify_access_key('access_key_1', 'secret_key_1'))
+
+    def test_changing_access_keys_invalidates_cache(self):
+        self.identity_layer.set_access_key('access_key_1', 'secret_key_1')
+        self.assertTrue(self.identity_layer.verify_access_key('access_key_1', 'secret_key_1'))
+
+        self.identity_layer.set_access_key('access_key_1', 'secret_key_2')
+        self.assertFalse(self.identity_layer.verify_access_key('access_key_1', 'secret_key_1'))
+        self.assertTrue(self.identity_layer.verify_access_key('access_key_1', 'secret_key_2'))
+
+        self.identity_layer.delete_access_key('access_key_1')
+        self.assertFalse(self.identity_layer.verify_access_key('access_key_1', 'secret_key_2'))
+
+    def test_missing_credentials(self):
+        self.assertFalse(self.identity_layer.verify_access_key(None, None))
+
+    def test_each_thread_reuses_its_connection(self):
+        self.identity_layer.set_access_key('access_key_1', 'secret_key_1')
+        results = []
+
+        def verify():
+            for i in range(3):
+                self.identity_layer.invalidate()
+                results.append(self.identity_layer.verify_access_key('access_key_1', 'secret_key_1'))
+
+        threads = [threading.Thread(target=verify) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [True] * 12)
+        self.assertEqual(len(self.identity_layer._connections), 5)
+
 
 if __name__ == '__main__':
     unittest.main()
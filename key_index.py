@@ -0,0 +1,174 @@
+import sqlite3
+import threading
+import time
+
+
+class IndexEntry:
+    """
+    An object as listed by the key index.
+
+    Attributes:
+    - key: The key of the object within its bucket.
+    - size: The size of the object data.
+    - hash: The SHA-256 hash of the object data.
+    - last_modified: The time (in seconds since the epoch) the object was last written.
+    """
+
+    __slots__ = ('key', 'size', 'hash', 'last_modified')
+
+    def __init__(self, key, size, hash, last_modified):
+        self.key = key
+        self.size = size
+        self.hash = hash
+        self.last_modified = last_modified
+
+
+class KeyIndex:
+    """
+    A sorted index of the keys of the objects in every bucket, kept in a SQLite database.
+
+    The objects table is clustered on (bucket, key), so listing a page of keys is a single
+    B-tree seek followed by a scan of the page, no matter how many objects there are. Keys
+    sharing a common prefix up to a delimiter are rolled up by seeking past all of them at once
+    instead of scanning them. Keys compare as UTF-8 bytes, the order S3 lists keys in.
+
+    Every thread keeps its own open connection to the database, like the identity layer. The
+    database is in WAL mode, so listings do not block writes.
+
+    Attributes:
+    - db_file: The SQLite database holding the index.
+    """
+
+    def __init__(self, db_file):
+        """
+        Initializes a new instance of the KeyIndex class, creating the index if it does not exist.
+
+        Args:
+        - db_file: The SQLite database holding the index.
+        """
+        self.db_file = db_file
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        conn = self._get_connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        with conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS objects (bucket TEXT NOT NULL, key TEXT NOT NULL, '
+                         'size INTEGER NOT NULL, hash TEXT NOT NULL, last_modified REAL NOT NULL, '
+                         'PRIMARY KEY (bucket, key)) WITHOUT ROWID')
+
+    def put(self, object_key, size, hash, last_modified=None):
+        """
+        Adds an object to the index, or updates it if it is already indexed.
+
+        Args:
+        - object_key: The key of the object, starting with its bucket.
+        - size: The size of the object data.
+        - hash: The SHA-256 hash of the object data.
+        - last_modified: The time the object was written; defaults to now.
+        """
+        bucket, _, key = object_key.partition('/')
+        conn = self._get_connection()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO objects (bucket, key, size, hash, last_modified) VALUES (?, ?, ?, ?, ?)',
+                         (bucket, key, size, hash, last_modified if last_modified is not None else time.time()))
+
+    def delete(self, object_key):
+        """
+        Removes an object from the index.
+        """
+        self.delete_many([object_key])
+
+    def delete_many(self, object_keys):
+        """
+        Removes objects from the index in a single transaction.
+        """
+        conn = self._get_connection()
+        with conn:
+            conn.executemany('DELETE FROM objects WHERE bucket = ? AND key = ?',
+                             (object_key.partition('/')[::2] for object_key in object_keys))
+
+    def is_empty(self):
+        return self._get_connection().execute('SELECT 1 FROM objects LIMIT 1').fetchone() is None
+
+    def rebuild(self, storage_backend):
+        """
+        Indexes every object of a storage backend, for servers that stored objects before they had an index.
+        """
+        conn = self._get_connection()
+        with conn:
+            for object_key in storage_backend.list_objects():
+                metadata = storage_backend.read_metadata(object_key)
+                if metadata is None:
+                    continue
+                bucket, _, key = object_key.partition('/')
+                conn.execute('INSERT OR REPLACE INTO objects (bucket, key, size, hash, last_modified) '
+                             'VALUES (?, ?, ?, ?, ?)',
+                             (bucket, key, metadata.size, metadata.hash, metadata.last_modified or time.time()))
+
+    def list_objects(self, bucket, prefix='', delimiter='', start_after='', max_keys=1000):
+        """
+        Lists the objects in a bucket in key order, a page at a time.
+
+        Args:
+        - bucket: The bucket to list.
+        - prefix: Only keys starting with the prefix are listed.
+        - delimiter: Keys containing the delimiter after the prefix are rolled up into a single
+          common prefix ending at the delimiter, or none are if it is empty.
+        - start_after: Only keys after it are listed.
+        - max_keys: The most keys and common prefixes listed.
+
+        Returns:
+        - A tuple of a list of IndexEntry instances, a list of common prefixes, and the key or
+          common prefix to start the next page after, or None if this is the last page.
+        """
+        conn = self._get_connection()
+        entries = []
+        common_prefixes = []
+        # the page starts at the lowest key after start_after, or at the prefix if that is later
+        position, inclusive = (prefix, True) if start_after < prefix else (start_after, False)
+        last_listed = start_after
+        while True:
+            limit = max_keys - len(entries) - len(common_prefixes) + 1
+            rows = conn.execute(f'SELECT key, size, hash, last_modified FROM objects '
+                                f'WHERE bucket = ? AND key {">=" if inclusive else ">"} ? ORDER BY key LIMIT ?',
+                                (bucket, position, limit)).fetchall()
+            for key, size, hash, last_modified in rows:
+                if not key.startswith(prefix):
+                    return entries, common_prefixes, None
+                if len(entries) + len(common_prefixes) == max_keys:
+                    return entries, common_prefixes, last_listed
+                delimiter_index = key.find(delimiter, len(prefix)) if delimiter else -1
+                if delimiter_index < 0:
+                    entries.append(IndexEntry(key, size, hash, last_modified))
+                    last_listed = key
+                    continue
+                common_prefix = key[:delimiter_index + len(delimiter)]
+                if common_prefix != last_listed:
+                    common_prefixes.append(common_prefix)
+                    last_listed = common_prefix
+                # seek past every key under the common prefix with a new query
+                position, inclusive = common_prefix[:-1] + chr(ord(common_prefix[-1]) + 1), True
+                break
+            else:
+                # every row was listed and fewer than the limit were found
+                return entries, common_prefixes, None
+
+    def close(self):
+        """
+        Closes the database connections of all threads.
+        """
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    def _get_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, check_same_thread=False)
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
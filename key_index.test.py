@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from key_index import KeyIndex
+from object_metadata import ObjectMetadata
+from storage_backend import DiskStorageBackend
+
+
+class TestKeyIndex(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.key_index = KeyIndex(os.path.join(self.path, 'keys.db'))
+        self.addCleanup(self.key_index.close)
+
+    def list_keys(self, *args, **kwargs):
+        entries, common_prefixes, next_position = self.key_index.list_objects(*args, **kwargs)
+        return [entry.key for entry in entries], common_prefixes, next_position
+
+    def test_list_in_key_order(self):
+        for object_key in ['bucket/b', 'bucket/a', 'other/c', 'bucket/a/b']:
+            self.key_index.put(object_key, 4, 'hash', 1000.0)
+
+        entries, _, _ = self.key_index.list_objects('bucket')
+        self.assertEqual([entry.key for entry in entries], ['a', 'a/b', 'b'])
+        self.assertEqual((entries[0].size, entries[0].hash, entries[0].last_modified), (4, 'hash', 1000.0))
+
+    def test_put_replaces_and_delete_removes(self):
+        self.key_index.put('bucket/a', 4, 'old')
+        self.key_index.put('bucket/a', 5, 'new')
+        self.key_index.put('bucket/b', 4, 'hash')
+        self.key_index.delete('bucket/b')
+
+        entries, _, _ = self.key_index.list_objects('bucket')
+        self.assertEqual([(entry.key, entry.size, entry.hash) for entry in entries], [('a', 5, 'new')])
+
+    def test_prefix_and_start_after(self):
+        for key in ['logs/1', 'logs/2', 'logs/3', 'photos/1']:
+            self.key_index.put(f'bucket/{key}', 1, 'hash')
+
+        self.assertEqual(self.list_keys('bucket', prefix='logs/'), (['logs/1', 'logs/2', 'logs/3'], [], None))
+        self.assertEqual(self.list_keys('bucket', prefix='logs/', start_after='logs/1'), (['logs/2', 'logs/3'], [], None))
+        self.assertEqual(self.list_keys('bucket', prefix='logs/', start_after='a'), (['logs/1', 'logs/2', 'logs/3'], [], None))
+
+    def test_delimiter_rolls_up_common_prefixes(self):
+        for key in ['a', 'logs/2024/1', 'logs/2024/2', 'logs/2025/1', 'logs/x', 'photos/1', 'z']:
+            self.key_index.put(f'bucket/{key}', 1, 'hash')
+
+        self.assertEqual(self.list_keys('bucket', delimiter='/'), (['a', 'z'], ['logs/', 'photos/'], None))
+        self.assertEqual(self.list_keys('bucket', prefix='logs/', delimiter='/'),
+                         (['logs/x'], ['logs/2024/', 'logs/2025/'], None))
+
+    def test_pages(self):
+        for key in ['a', 'b/1', 'b/2', 'c', 'd/1', 'e']:
+            self.key_index.put(f'bucket/{key}', 1, 'hash')
+
+        pages = []
+        position = ''
+        while position is not None:
+            keys, common_prefixes, position = self.list_keys('bucket', delimiter='/', start_after=position, max_keys=2)
+            pages.append(keys + common_prefixes)
+        self.assertEqual(pages, [['a', 'b/'], ['c', 'd/'], ['e']])
+
+    def test_rebuild_from_storage_backend(self):
+        storage_backend = DiskStorageBackend(os.path.join(self.path, 'data'))
+        storage_backend.write_object('bucket/object', b'data')
+        storage_backend.write_metadata('bucket/object', ObjectMetadata(size=4, hash='hash'))
+        self.assertTrue(self.key_index.is_empty())
+
+        self.key_index.rebuild(storage_backend)
+
+        self.assertFalse(self.key_index.is_empty())
+        self.assertEqual(self.list_keys('bucket'), (['object'], [], None))
+
+
+if __name__ == '__main__':
+    unittest.main()
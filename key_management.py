@@ -0,0 +1,152 @@
+import hashlib
+import hmac
+import os
+import uuid
+
+from Crypto.Cipher import AES
+
+from cache import LRUCache
+
+# identifies wrapped data keys and the version of their format
+WRAPPED_KEY_VERSION = 1
+
+KEY_SIZE = 32
+_KEY_ID_SIZE = 4
+_NONCE_SIZE = 12
+_TAG_SIZE = 16
+WRAPPED_KEY_SIZE = 1 + _KEY_ID_SIZE + _NONCE_SIZE + KEY_SIZE + _TAG_SIZE
+
+
+class InvalidKeyError(Exception):
+    pass
+
+
+class KeyManager:
+    """
+    Wraps the data keys objects are encrypted with using a master key (the key-encryption key),
+    so that the metadata records hold no key that decrypts object data on its own.
+
+    The master key is read from a local keyfile, which is created with a random key if it does
+    not exist. Every object server of a cluster must use the same keyfile, as replicas are copied
+    between servers along with their wrapped keys. Data keys are wrapped with AES-256-GCM, so a
+    wrapped key that was tampered with, or wrapped with another master key, fails to unwrap
+    rather than decrypting objects into garbage.
+
+    Unwrapped data keys are cached, so reading a popular object does not unwrap its key every time.
+
+    Wrapped keys are laid out as a version byte, the ID of the master key, the GCM nonce, the
+    encrypted data key and the GCM tag.
+
+    Attributes:
+    - keyfile: The file the master key is read from.
+    - key_id: The first bytes of the SHA-256 hash of the master key, stored with every wrapped key.
+    - key_cache: The cache of unwrapped data keys, by wrapped key.
+    """
+
+    def __init__(self, keyfile, cache_size=10000):
+        """
+        Initializes a new instance of the KeyManager class.
+
+        Args:
+        - keyfile: The file the master key is read from, created with a random key if it does not exist.
+        - cache_size: The most unwrapped data keys cached.
+
+        Raises:
+        - ValueError: If the keyfile does not hold a 32-byte key.
+        """
+        self.keyfile = keyfile
+        self._master_key = self._load_master_key(keyfile)
+        self.key_id = hashlib.sha256(self._master_key).digest()[:_KEY_ID_SIZE]
+        self.key_cache = LRUCache(cache_size)
+
+    def generate_data_key(self):
+        """
+        Returns a new random data key and the data key wrapped with the master key.
+        """
+        data_key = os.urandom(KEY_SIZE)
+        return data_key, self.wrap(data_key)
+
+    def wrap(self, data_key: bytes) -> bytes:
+        """
+        Returns a data key encrypted and authenticated with the master key.
+        """
+        nonce = os.urandom(_NONCE_SIZE)
+        header = bytes([WRAPPED_KEY_VERSION]) + self.key_id
+        cipher = AES.new(self._master_key, AES.MODE_GCM, nonce=nonce)
+        cipher.update(header)
+        encrypted_key, tag = cipher.encrypt_and_digest(data_key)
+        return header + nonce + encrypted_key + tag
+
+    def unwrap(self, wrapped_key: bytes) -> bytes:
+        """
+        Returns the data key a wrapped key holds.
+
+        Raises:
+        - InvalidKeyError: If the key was not wrapped with the master key or was tampered with.
+        """
+        data_key = self.key_cache.get(wrapped_key)
+        if data_key is not None:
+            return data_key
+        if len(wrapped_key) != WRAPPED_KEY_SIZE or wrapped_key[0] != WRAPPED_KEY_VERSION:
+            raise InvalidKeyError("The wrapped key has an unknown format.")
+        header, nonce = wrapped_key[:1 + _KEY_ID_SIZE], wrapped_key[1 + _KEY_ID_SIZE:1 + _KEY_ID_SIZE + _NONCE_SIZE]
+        encrypted_key, tag = wrapped_key[-KEY_SIZE - _TAG_SIZE:-_TAG_SIZE], wrapped_key[-_TAG_SIZE:]
+        if header[1:] != self.key_id:
+            raise InvalidKeyError(f"The key was wrapped with master key {header[1:].hex()}, "
+                                  f"not {self.key_id.hex()}.")
+        cipher = AES.new(self._master_key, AES.MODE_GCM, nonce=nonce)
+        cipher.update(header)
+        try:
+            data_key = cipher.decrypt_and_verify(encrypted_key, tag)
+        except ValueError:
+            raise InvalidKeyError("The wrapped key failed authentication.")
+        self.key_cache.put(wrapped_key, data_key)
+        return data_key
+
+    def derive_key(self, purpose: bytes) -> bytes:
+        """
+        Returns a key derived from the master key for another purpose than wrapping data keys,
+        such as authenticating the object servers of a cluster to each other. Every purpose gets
+        a key of its own, and none of them reveals the master key.
+        """
+        return hmac.new(self._master_key, b'kriya/' + purpose, hashlib.sha256).digest()
+
+    def data_key(self, encryption_key: bytes) -> bytes:
+        """
+        Returns the data key to decrypt an object with, given the encryption key of its metadata:
+        the key unwrapped, a plain key as stored before keys were wrapped, or empty for
+        unencrypted objects.
+
+        Raises:
+        - InvalidKeyError: If the key was not wrapped with the master key or was tampered with.
+        """
+        if len(encryption_key) in (0, KEY_SIZE):
+            return encryption_key
+        return self.unwrap(encryption_key)
+
+    @staticmethod
+    def _load_master_key(keyfile):
+        try:
+            with open(keyfile, 'rb') as f:
+                master_key = f.read()
+        except FileNotFoundError:
+            master_key = os.urandom(KEY_SIZE)
+            # write the key to a file only the owner can read, and move it into place at once so
+            # that servers starting together never read a partially written key
+            tmp_path = f"{keyfile}.{uuid.uuid4().hex}.tmp"
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(master_key)
+                f.flush()
+                os.fsync(f.fileno())
+            try:
+                # never replace a key another server created in the meantime
+                os.link(tmp_path, keyfile)
+            except FileExistsError:
+                with open(keyfile, 'rb') as f:
+                    master_key = f.read()
+            finally:
+                os.remove(tmp_path)
+        if len(master_key) != KEY_SIZE:
+            raise ValueError(f"Keyfile {keyfile} does not hold a {KEY_SIZE}-byte key.")
+        return master_key
@@ -0,0 +1,70 @@
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from key_management import InvalidKeyError, KeyManager
+
+
+class TestKeyManager(unittest.TestCase):
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base_path)
+        self.keyfile = os.path.join(self.base_path, 'master.key')
+        self.key_manager = KeyManager(self.keyfile)
+
+    def test_wrap_then_unwrap(self):
+        data_key, wrapped_key = self.key_manager.generate_data_key()
+        self.assertNotIn(data_key, wrapped_key)
+        self.assertEqual(KeyManager(self.keyfile).unwrap(wrapped_key), data_key)
+        # every wrap uses a nonce of its own
+        self.assertNotEqual(self.key_manager.wrap(data_key), wrapped_key)
+
+    def test_keyfile_is_created_readable_by_owner_only(self):
+        self.assertEqual(stat.S_IMODE(os.stat(self.keyfile).st_mode), 0o600)
+        with open(self.keyfile, 'rb') as f:
+            self.assertEqual(len(f.read()), 32)
+        self.assertEqual(os.listdir(self.base_path), ['master.key'])
+
+    def test_tampered_key_fails_to_unwrap(self):
+        _, wrapped_key = self.key_manager.generate_data_key()
+        tampered_key = bytearray(wrapped_key)
+        tampered_key[-20] ^= 1
+        with self.assertRaises(InvalidKeyError):
+            self.key_manager.unwrap(bytes(tampered_key))
+
+    def test_key_wrapped_with_other_master_key_fails_to_unwrap(self):
+        other_key_manager = KeyManager(os.path.join(self.base_path, 'other.key'))
+        _, wrapped_key = other_key_manager.generate_data_key()
+        with self.assertRaises(InvalidKeyError):
+            self.key_manager.unwrap(wrapped_key)
+
+    def test_unwrapped_keys_are_cached(self):
+        data_key, wrapped_key = self.key_manager.generate_data_key()
+        self.assertEqual(self.key_manager.unwrap(wrapped_key), data_key)
+        self.assertEqual(self.key_manager.unwrap(wrapped_key), data_key)
+        self.assertEqual((self.key_manager.key_cache.hits, self.key_manager.key_cache.misses), (1, 1))
+
+    def test_data_key_of_plain_and_unencrypted_objects(self):
+        plain_key = os.urandom(32)
+        self.assertEqual(self.key_manager.data_key(plain_key), plain_key)
+        self.assertEqual(self.key_manager.data_key(b''), b'')
+
+    def test_derived_keys(self):
+        transport_key = self.key_manager.derive_key(b'transport')
+        self.assertEqual(len(transport_key), 32)
+        self.assertEqual(KeyManager(self.keyfile).derive_key(b'transport'), transport_key)
+        self.assertNotEqual(self.key_manager.derive_key(b'other'), transport_key)
+        self.assertNotEqual(KeyManager(os.path.join(self.base_path, 'other.key')).derive_key(b'transport'),
+                            transport_key)
+
+    def test_keyfile_with_wrong_size(self):
+        with open(self.keyfile, 'wb') as f:
+            f.write(b'short')
+        with self.assertRaises(ValueError):
+            KeyManager(self.keyfile)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,208 @@
+import argparse
+import os
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from key_management import KeyManager
+from transport import SECRET_PURPOSE
+
+HOST = '127.0.0.1'
+
+
+def _free_port():
+    # gossip ports are used for both UDP and TCP, so every port picked is free for both
+    while True:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.bind((HOST, 0))
+            port = s.getsockname()[1]
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+                s.bind((HOST, port))
+        except OSError:
+            continue
+        return port
+
+
+class LocalNode:
+    """
+    An object server of a local cluster, running in a process of its own.
+
+    Attributes:
+    - port: The port the object server serves HTTP requests on.
+    - gossip_port: The port the object server gossips (UDP) and serves other object servers (TCP) on.
+    - storage_path: The directory the object server stores objects, its database and its log in.
+    - process: The process running the object server, or None if it is not running.
+    """
+
+    def __init__(self, port, gossip_port, storage_path):
+        self.port = port
+        self.gossip_port = gossip_port
+        self.storage_path = storage_path
+        self.process = None
+
+    @property
+    def node_id(self):
+        return f'{HOST}:{self.port}'
+
+    @property
+    def address(self):
+        return HOST, self.port
+
+    @property
+    def gossip_address(self):
+        return HOST, self.gossip_port
+
+
+class LocalCluster:
+    """
+    Starts a cluster of object servers on localhost, every one in a process of its own, for
+    testing replication and failures over the real transport. The first node is the seed the
+    others join the cluster through. Every node wraps object keys with the same master key, kept
+    in a keyfile under the base path.
+
+    Attributes:
+    - nodes: The LocalNode instances of the cluster.
+    - access_key: The access key every object server accepts.
+    - secret_key: The secret key of the access key.
+    """
+
+    def __init__(self, num_nodes=3, base_path=None, access_key='test-access-key', secret_key='test-secret-key',
+                 extra_args=()):
+        """
+        Initializes a new instance of the LocalCluster class.
+
+        Args:
+        - num_nodes: The number of object servers.
+        - base_path: The directory the object servers store their data under, or None for a
+          temporary directory removed when the cluster stops.
+        - access_key: The access key every object server accepts.
+        - secret_key: The secret key of the access key.
+        - extra_args: Command-line arguments passed to every object server.
+        """
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.extra_args = list(extra_args)
+        self._temporary = base_path is None
+        self.base_path = tempfile.mkdtemp() if base_path is None else base_path
+        self.nodes = []
+        for i in range(num_nodes):
+            self.nodes.append(LocalNode(_free_port(), _free_port(), os.path.join(self.base_path, f'node{i}')))
+
+    @property
+    def keyfile(self):
+        return os.path.join(self.base_path, 'master.key')
+
+    def transport_secret(self):
+        """
+        Returns the cluster secret the transport servers of the nodes accept, derived from the
+        master key they share. The keyfile exists once a node has started.
+        """
+        return KeyManager(self.keyfile).derive_key(SECRET_PURPOSE)
+
+    def start(self, timeout=30):
+        """
+        Starts every object server and waits until all of them accept connections, from clients
+        and from each other.
+
+        Raises:
+        - TimeoutError: If an object server does not accept connections in time.
+        """
+        for node in self.nodes:
+            self.start_node(node)
+        deadline = time.monotonic() + timeout
+        for node in self.nodes:
+            self._wait_for(node, deadline)
+
+    def start_node(self, node):
+        """
+        Starts the object server of a node, which does not wait for it to accept connections.
+        """
+        os.makedirs(node.storage_path, exist_ok=True)
+        db_file = os.path.join(node.storage_path, 'kriya.db')
+        conn = sqlite3.connect(db_file)
+        with conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS access_keys (access_key TEXT, secret_key TEXT)')
+            if conn.execute('SELECT 1 FROM access_keys WHERE access_key = ?', (self.access_key,)).fetchone() is None:
+                conn.execute('INSERT INTO access_keys VALUES (?, ?)', (self.access_key, self.secret_key))
+        conn.close()
+        seed = self.nodes[0]
+        args = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'object_server.py'),
+                '--host', HOST, '--port', str(node.port), '--gossip-port', str(node.gossip_port),
+                '--db-file', db_file, '--storage-path', os.path.join(node.storage_path, 'data'),
+                '--keyfile', self.keyfile]
+        if node is not seed:
+            args += ['--seed', f'{HOST}:{seed.gossip_port}']
+        with open(os.path.join(node.storage_path, 'server.log'), 'ab') as log_file:
+            node.process = subprocess.Popen(args + self.extra_args, stdout=log_file, stderr=subprocess.STDOUT)
+
+    def stop_node(self, node):
+        """
+        Stops the object server of a node, killing it if it does not exit in time.
+        """
+        if node.process is None:
+            return
+        node.process.terminate()
+        try:
+            node.process.wait(10)
+        except subprocess.TimeoutExpired:
+            node.process.kill()
+            node.process.wait()
+        node.process = None
+
+    def stop(self):
+        """
+        Stops every object server, and removes the data if it is in a temporary directory.
+        """
+        for node in self.nodes:
+            self.stop_node(node)
+        if self._temporary:
+            shutil.rmtree(self.base_path, ignore_errors=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _wait_for(self, node, deadline):
+        while True:
+            if node.process.poll() is not None:
+                raise RuntimeError(f"Object server {node.node_id} exited with status {node.process.returncode}.")
+            try:
+                # the HTTP port is bound before the transport server starts, so wait for both
+                for address in (node.address, node.gossip_address):
+                    socket.create_connection(address, timeout=1).close()
+                return
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Object server {node.node_id} did not start in time.")
+                time.sleep(0.1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a Kriya cluster on localhost')
+    parser.add_argument('--nodes', type=int, default=3)
+    parser.add_argument('--base-path', help='the directory to store data under; defaults to a temporary directory')
+    args, extra_args = parser.parse_known_args()
+
+    cluster = LocalCluster(args.nodes, args.base_path, extra_args=extra_args)
+    cluster.start()
+    try:
+        for node in cluster.nodes:
+            print(f"{node.node_id} (gossip and transport on port {node.gossip_port}) storing in {node.storage_path}")
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        cluster.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+import http.client
+import time
+import unittest
+
+from local_cluster import LocalCluster
+from transport import RemoteStorageBackend
+
+
+class TestLocalCluster(unittest.TestCase):
+    def setUp(self):
+        self.cluster = LocalCluster(num_nodes=3)
+        self.cluster.start()
+        self.addCleanup(self.cluster.stop)
+        self.peers = [RemoteStorageBackend(node.gossip_address, self.cluster.transport_secret())
+                      for node in self.cluster.nodes[1:]]
+        for peer in self.peers:
+            self.addCleanup(peer.close)
+
+    def request(self, node, method, path, body=None):
+        conn = http.client.HTTPConnection(*node.address, timeout=10)
+        conn.request(method, path, body=body,
+                     headers={'X-Amz-Content-Sha256': 'UNSIGNED-PAYLOAD', 'X-Amz-Access-Key': self.cluster.access_key,
+                              'X-Amz-Secret-Key': self.cluster.secret_key})
+        try:
+            response = conn.getresponse()
+            return response, response.read()
+        finally:
+            conn.close()
+
+    def replica_count(self, object_key):
+        return sum(peer.read_metadata(object_key) is not None for peer in self.peers)
+
+    def test_objects_are_replicated_between_processes(self):
+        # the nodes only replicate to each other once they learnt about each other by gossip,
+        # so write until a replica shows up
+        deadline = time.monotonic() + 30
+        while not self.replica_count('bucket/object'):
+            self.assertLess(time.monotonic(), deadline, "The object was not replicated in time.")
+            response, _ = self.request(self.cluster.nodes[0], 'PUT', '/bucket/object', body=b'data' * 1000)
+            self.assertEqual(response.status, 200)
+            time.sleep(0.2)
+
+        response, _ = self.request(self.cluster.nodes[0], 'DELETE', '/bucket/object')
+        self.assertEqual(response.status, 204)
+        # replicas are deleted after responding
+        deadline = time.monotonic() + 10
+        while self.replica_count('bucket/object'):
+            self.assertLess(time.monotonic(), deadline, "The replicas were not deleted in time.")
+            time.sleep(0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
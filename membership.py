@@ -0,0 +1,350 @@
+import itertools
+import json
+import math
+import random
+import socket
+import threading
+import time
+
+ALIVE = 'alive'
+SUSPECT = 'suspect'
+DEAD = 'dead'
+
+# the largest datagram sent, small enough not to be fragmented on common networks
+MAX_MESSAGE_SIZE = 1400
+
+
+class Member:
+    """
+    A member of the cluster as seen by the local node.
+
+    Attributes:
+    - node_id: The ID of the member.
+    - address: The (host, port) address the member gossips on.
+    - incarnation: The incarnation number of the member, which only the member itself increments
+      to refute being suspected.
+    - state: ALIVE, SUSPECT or DEAD.
+    - state_changed: The time the state of the member last changed.
+    """
+
+    __slots__ = ('node_id', 'address', 'incarnation', 'state', 'state_changed')
+
+    def __init__(self, node_id, address, incarnation, state, state_changed):
+        self.node_id = node_id
+        self.address = address
+        self.incarnation = incarnation
+        self.state = state
+        self.state_changed = state_changed
+
+
+class Membership:
+    """
+    A SWIM membership and failure detection protocol over one persistent UDP socket.
+
+    Every protocol period the local node pings one member, going round-robin through the members
+    in a random order, so every member is probed within a bounded time while the load per node
+    stays constant no matter how large the cluster is. A member that does not acknowledge in time
+    is probed indirectly through a few others, and only then suspected. A suspected member that
+    does not refute the suspicion, by gossiping a higher incarnation number, within the suspicion
+    timeout is declared dead. Changes in membership are not broadcast but piggybacked on the
+    pings and acknowledgements, each retransmitted a logarithmic number of times, so they reach
+    every member in O(log N) protocol periods.
+
+    Attributes:
+    - node_id: The ID of the local node.
+    - address: The (host, port) address the local node gossips on.
+    - incarnation: The incarnation number of the local node.
+    - members: A dict mapping the IDs of the other members to Member instances.
+    - protocol_period: The interval (in seconds) at which a member is probed.
+    - ping_timeout: The time (in seconds) to wait for an acknowledgement before probing indirectly.
+    - indirect_probes: The number of members asked to probe a member indirectly.
+    - suspicion_timeout: The time (in seconds) a suspected member has to refute the suspicion.
+    - retransmit_multiplier: Scales how many times every change in membership is piggybacked.
+    """
+
+    def __init__(self, node_id, bind_address, protocol_period=1.0, ping_timeout=0.3, indirect_probes=3,
+                 suspicion_timeout=5.0, retransmit_multiplier=3, clock=time.monotonic):
+        """
+        Initializes a new instance of the Membership class, binding its socket.
+
+        Args:
+        - node_id: The ID of the local node.
+        - bind_address: The (host, port) address to gossip on; port 0 picks a free port.
+        - protocol_period: The interval (in seconds) at which a member is probed.
+        - ping_timeout: The time (in seconds) to wait for an acknowledgement before probing indirectly.
+        - indirect_probes: The number of members asked to probe a member indirectly.
+        - suspicion_timeout: The time (in seconds) a suspected member has to refute the suspicion.
+        - retransmit_multiplier: Scales how many times every change in membership is piggybacked.
+        - clock: A callable returning the current time in seconds.
+        """
+        self.node_id = node_id
+        self.incarnation = 0
+        self.members = {}
+        self.protocol_period = protocol_period
+        self.ping_timeout = ping_timeout
+        self.indirect_probes = indirect_probes
+        self.suspicion_timeout = suspicion_timeout
+        self.retransmit_multiplier = retransmit_multiplier
+        self._clock = clock
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind(bind_address)
+        self._socket.settimeout(0.1)
+        self.address = self._socket.getsockname()
+        # the changes in membership still to piggyback, as a dict mapping node IDs to
+        # [update, transmissions] pairs
+        self._updates = {}
+        self._acks = {}
+        # the pings sent on behalf of other members, as a dict mapping their sequence numbers to
+        # (requester_address, requester_sequence_number, expiry) tuples, oldest first
+        self._forwarded_pings = {}
+        self._sequence_numbers = itertools.count()
+        self._probe_order = []
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._threads = []
+
+    def add_listener(self, listener):
+        """
+        Registers a callable called whenever the state of a member changes.
+
+        Args:
+        - listener: A callable taking the node ID, gossip address and new state of the member.
+        """
+        self._listeners.append(listener)
+
+    def state(self, node_id):
+        """
+        Returns the state of a member, or None if it is not known.
+        """
+        if node_id == self.node_id:
+            return ALIVE
+        member = self.members.get(node_id)
+        return member.state if member is not None else None
+
+    def alive_members(self):
+        """
+        Returns the IDs of the members that are not dead, suspected members included.
+        """
+        with self._lock:
+            return [node_id for node_id, member in self.members.items() if member.state != DEAD]
+
+    def join(self, seed_addresses):
+        """
+        Announces the local node to seed members, which gossip it to the rest of the cluster.
+
+        Args:
+        - seed_addresses: An iterable over the (host, port) gossip addresses of seed members.
+        """
+        self._enqueue_update(self._local_update())
+        for seed_address in seed_addresses:
+            if tuple(seed_address) != tuple(self.address):
+                self._send(seed_address, {'type': 'ping', 'seq': next(self._sequence_numbers)})
+
+    def start(self):
+        """
+        Starts the threads receiving messages and probing members.
+        """
+        self._threads = [threading.Thread(target=self._receive_messages, name='membership-receiver', daemon=True),
+                         threading.Thread(target=self._probe_periodically, name='membership-prober', daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """
+        Stops the threads and closes the socket.
+        """
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join()
+        self._socket.close()
+
+    def probe(self):
+        """
+        Runs one protocol period: probes the next member, suspecting it if neither it nor the
+        members probing it indirectly acknowledge in time, and declares suspected members dead
+        once their suspicion timed out.
+        """
+        period_end = self._clock() + self.protocol_period
+        member = self._next_member()
+        if member is not None and not self._ping(member, period_end):
+            self._suspect(member)
+        self._expire_suspicions()
+
+    def _next_member(self):
+        with self._lock:
+            while self._probe_order:
+                member = self.members.get(self._probe_order.pop())
+                if member is not None and member.state != DEAD:
+                    return member
+            # start a new round in a new random order
+            self._probe_order = [node_id for node_id, member in self.members.items() if member.state != DEAD]
+            random.shuffle(self._probe_order)
+            return self.members[self._probe_order.pop()] if self._probe_order else None
+
+    def _ping(self, member, period_end):
+        sequence_number = next(self._sequence_numbers)
+        acked = threading.Event()
+        self._acks[sequence_number] = acked
+        try:
+            self._send(member.address, {'type': 'ping', 'seq': sequence_number})
+            if acked.wait(self.ping_timeout):
+                return True
+            # ask other members to probe it, in case only the path to it is lossy
+            with self._lock:
+                helpers = [helper for helper in self.members.values()
+                           if helper.state == ALIVE and helper.node_id != member.node_id]
+            for helper in random.sample(helpers, min(self.indirect_probes, len(helpers))):
+                self._send(helper.address, {'type': 'ping-req', 'seq': sequence_number,
+                                            'target': list(member.address)})
+            return acked.wait(max(period_end - self._clock(), 0))
+        finally:
+            del self._acks[sequence_number]
+
+    def _suspect(self, member):
+        self._apply_update([member.node_id, list(member.address), member.incarnation, SUSPECT])
+
+    def _expire_suspicions(self):
+        now = self._clock()
+        with self._lock:
+            expired = [member for member in self.members.values()
+                       if member.state == SUSPECT and now - member.state_changed >= self.suspicion_timeout]
+        for member in expired:
+            self._apply_update([member.node_id, list(member.address), member.incarnation, DEAD])
+
+    def _probe_periodically(self):
+        while not self._stopped.is_set():
+            started = self._clock()
+            try:
+                self.probe()
+            except OSError as e:
+                if self._stopped.is_set():
+                    return
+                print(f"Error probing members: {e}")
+            self._stopped.wait(max(self.protocol_period - (self._clock() - started), 0))
+
+    def _receive_messages(self):
+        while not self._stopped.is_set():
+            try:
+                data, address = self._socket.recvfrom(65536)
+                message = json.loads(data)
+            except socket.timeout:
+                continue
+            except OSError:
+                if self._stopped.is_set():
+                    return
+                continue
+            except ValueError:
+                continue
+            self._handle_message(message, address)
+
+    def _handle_message(self, message, address):
+        # every message comes from the persistent socket of its sender, so it also tells the
+        # gossip address of the sender and that it is alive
+        sender = message.get('from')
+        if sender is not None:
+            self._apply_update([sender, list(address), message.get('incarnation', 0), ALIVE])
+            member = self.members.get(sender)
+            if member is not None and member.state == DEAD:
+                # let a member that was declared dead learn about it, so it can refute it
+                self._enqueue_update([sender, list(member.address), member.incarnation, DEAD])
+        for update in message.get('updates', []):
+            self._apply_update(update)
+        message_type = message.get('type')
+        sequence_number = message.get('seq')
+        if message_type == 'ping':
+            self._send(address, {'type': 'ack', 'seq': sequence_number})
+        elif message_type == 'ping-req':
+            # probe the target on behalf of the sender and relay its acknowledgement
+            self._expire_forwarded_pings()
+            forwarded_sequence_number = next(self._sequence_numbers)
+            self._forwarded_pings[forwarded_sequence_number] = (address, sequence_number,
+                                                                self._clock() + self.protocol_period)
+            self._send(tuple(message['target']), {'type': 'ping', 'seq': forwarded_sequence_number})
+        elif message_type == 'ack':
+            forwarded_ping = self._forwarded_pings.pop(sequence_number, None)
+            if forwarded_ping is not None:
+                requester_address, requester_sequence_number, _ = forwarded_ping
+                self._send(requester_address, {'type': 'ack', 'seq': requester_sequence_number})
+            elif sequence_number in self._acks:
+                self._acks[sequence_number].set()
+
+    def _expire_forwarded_pings(self):
+        # the requester stops waiting at the end of its protocol period, so a target that has not
+        # acknowledged by then never will in time; entries expire in the order they were added
+        now = self._clock()
+        while self._forwarded_pings:
+            forwarded_sequence_number, (_, _, expiry) = next(iter(self._forwarded_pings.items()))
+            if expiry > now:
+                return
+            del self._forwarded_pings[forwarded_sequence_number]
+
+    def _apply_update(self, update):
+        node_id, address, incarnation, state = update
+        address = tuple(address)
+        if node_id == self.node_id:
+            if state != ALIVE and incarnation >= self.incarnation:
+                # refute the suspicion by gossiping a newer incarnation
+                with self._lock:
+                    self.incarnation = incarnation + 1
+                self._enqueue_update(self._local_update())
+            return
+
+        with self._lock:
+            member = self.members.get(node_id)
+            if member is None:
+                if state == DEAD:
+                    return
+                member = self.members[node_id] = Member(node_id, address, incarnation, state, self._clock())
+            elif not self._overrides(member, incarnation, state):
+                return
+            else:
+                member.address = address
+                member.incarnation = incarnation
+                member.state = state
+                member.state_changed = self._clock()
+        self._enqueue_update([node_id, list(address), incarnation, state])
+        for listener in self._listeners:
+            listener(node_id, address, state)
+
+    def _overrides(self, member, incarnation, state):
+        # the precedence rules of SWIM: newer incarnations win, and at the same incarnation
+        # suspicion wins over being alive and death wins over everything
+        if state == ALIVE:
+            return incarnation > member.incarnation
+        if state == SUSPECT:
+            return (incarnation > member.incarnation
+                    or (incarnation == member.incarnation and member.state == ALIVE))
+        return member.state != DEAD and incarnation >= member.incarnation
+
+    def _local_update(self):
+        return [self.node_id, list(self.address), self.incarnation, ALIVE]
+
+    def _enqueue_update(self, update):
+        with self._lock:
+            self._updates[update[0]] = [update, 0]
+
+    def _send(self, address, message):
+        with self._lock:
+            retransmit_limit = self.retransmit_multiplier * math.ceil(math.log2(len(self.members) + 2))
+            # piggyback the changes sent the fewest times first
+            updates = sorted(self._updates.values(), key=lambda entry: entry[1])
+            message['from'] = self.node_id
+            message['incarnation'] = self.incarnation
+            message['updates'] = []
+            data = json.dumps(message).encode()
+            for entry in updates:
+                message['updates'].append(entry[0])
+                encoded_message = json.dumps(message).encode()
+                if len(encoded_message) > MAX_MESSAGE_SIZE:
+                    message['updates'].pop()
+                    break
+                data = encoded_message
+                entry[1] += 1
+                if entry[1] >= retransmit_limit:
+                    del self._updates[entry[0][0]]
+        try:
+            self._socket.sendto(data, tuple(address))
+        except OSError as e:
+            if not self._stopped.is_set():
+                print(f"Error sending to {address}: {e}")
@@ -0,0 +1,77 @@
+import time
+import unittest
+
+from membership import ALIVE, DEAD, SUSPECT, Membership
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class TestMembership(unittest.TestCase):
+    def setUp(self):
+        self.memberships = {}
+        self.changes = []
+        for node_id in ['a', 'b', 'c']:
+            membership = Membership(node_id, ('localhost', 0), protocol_period=0.05, ping_timeout=0.02,
+                                    suspicion_timeout=0.3)
+            membership.add_listener(lambda node_id, address, state, observer=node_id:
+                                    self.changes.append((observer, node_id, state)))
+            membership.start()
+            self.addCleanup(self.stop, membership)
+            self.memberships[node_id] = membership
+        for node_id in ['b', 'c']:
+            self.memberships[node_id].join([self.memberships['a'].address])
+        self.assertTrue(wait_until(lambda: all(len(membership.alive_members()) == 2
+                                               for membership in self.memberships.values())))
+
+    def stop(self, membership):
+        if not membership._stopped.is_set():
+            membership.stop()
+
+    def test_members_discover_each_other(self):
+        self.assertEqual(sorted(self.memberships['b'].alive_members()), ['a', 'c'])
+        self.assertEqual(self.memberships['c'].state('b'), ALIVE)
+        self.assertIsNone(self.memberships['c'].state('unknown'))
+        self.assertIn(('c', 'b', ALIVE), self.changes)
+
+    def test_failed_member_is_declared_dead(self):
+        self.memberships['c'].stop()
+        self.assertTrue(wait_until(lambda: self.memberships['a'].state('c') == DEAD
+                                   and self.memberships['b'].state('c') == DEAD))
+        self.assertEqual(self.memberships['a'].alive_members(), ['b'])
+        changes = [state for observer, node_id, state in self.changes if observer == 'a' and node_id == 'c']
+        self.assertEqual(changes[-2:], [SUSPECT, DEAD])
+
+    def test_suspected_member_refutes_suspicion(self):
+        membership = self.memberships['a']
+        member = membership.members['b']
+        membership._apply_update(['b', list(member.address), member.incarnation, SUSPECT])
+        self.assertEqual(membership.state('b'), SUSPECT)
+        self.assertTrue(wait_until(lambda: membership.state('b') == ALIVE))
+        self.assertGreater(self.memberships['b'].incarnation, 0)
+
+
+    def test_unacknowledged_forwarded_pings_expire(self):
+        now = [0.0]
+        membership = Membership('d', ('localhost', 0), protocol_period=1.0, clock=lambda: now[0])
+        self.addCleanup(membership._socket.close)
+        # the target never acknowledges
+        ping_request = {'type': 'ping-req', 'seq': 1, 'target': list(self.memberships['a'].address)}
+        self.memberships['a'].stop()
+        for _ in range(3):
+            membership._handle_message(ping_request, ('localhost', 1))
+        self.assertEqual(len(membership._forwarded_pings), 3)
+
+        now[0] = 1.5
+        membership._handle_message(ping_request, ('localhost', 1))
+        self.assertEqual(len(membership._forwarded_pings), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,347 @@
+import bisect
+import contextlib
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# the upper bounds (in seconds) of the buckets of latency histograms
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# the methods requests are counted by; other methods are counted as 'other' so that clients
+# cannot add label values at will
+METHODS = ('GET', 'HEAD', 'PUT', 'POST', 'DELETE')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(label_names, label_values):
+    if not label_names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(label_names, label_values)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    """
+    A metric with a value for every combination of label values.
+
+    Attributes:
+    - name: The name the metric is exposed by.
+    - help: The description the metric is exposed with.
+    - label_names: The names of the labels of the metric.
+    """
+
+    type = 'untyped'
+
+    def __init__(self, name, help, label_names=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def samples(self):
+        """
+        Returns a list of (suffix, label_names, label_values, value) tuples, one for every sample.
+        """
+        with self._lock:
+            return [('', self.label_names, label_values, value) for label_values, value in sorted(self._values.items())]
+
+    def render(self):
+        """
+        Returns the metric in the Prometheus text exposition format.
+        """
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        for suffix, label_names, label_values, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(label_names, label_values)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(Metric):
+    """
+    A metric whose value only ever goes up, such as the number of requests served.
+    """
+
+    type = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+
+class Gauge(Metric):
+    """
+    A metric whose value goes up and down, such as the number of requests in progress.
+    """
+
+    type = 'gauge'
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    def value(self, *label_values):
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+
+class Histogram(Metric):
+    """
+    A metric counting observations, such as request latencies, into buckets by their value.
+
+    Attributes:
+    - buckets: The upper bounds of the buckets, in increasing order.
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, help, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                # the count of every bucket, and of the implicit +Inf bucket, and the sum
+                state = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+
+    @contextlib.contextmanager
+    def time(self, *label_values):
+        """
+        Returns a context manager observing the time (in seconds) spent within it.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def count(self, *label_values):
+        with self._lock:
+            state = self._values.get(label_values)
+            return sum(state[0]) if state is not None else 0
+
+    def samples(self):
+        label_names = self.label_names + ('le',)
+        samples = []
+        with self._lock:
+            for label_values, (bucket_counts, total) in sorted(self._values.items()):
+                cumulative_count = 0
+                for upper_bound, bucket_count in zip(self.buckets + (float('inf'),), bucket_counts):
+                    cumulative_count += bucket_count
+                    samples.append(('_bucket', label_names, label_values + (_format_value(upper_bound),),
+                                    cumulative_count))
+                samples.append(('_sum', self.label_names, label_values, total))
+                samples.append(('_count', self.label_names, label_values, cumulative_count))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    The metrics exposed by one process.
+
+    Besides the metrics registered, collectors are called on every scrape to report the
+    statistics other components keep on their own, such as the hits of a cache.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """
+        Adds a metric to the registry and returns it.
+        """
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, label_names=()):
+        return self.register(Counter(name, help, label_names))
+
+    def gauge(self, name, help, label_names=()):
+        return self.register(Gauge(name, help, label_names))
+
+    def histogram(self, name, help, label_names=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, label_names, buckets))
+
+    def add_collector(self, collector):
+        """
+        Registers a callable called on every scrape, returning an iterable of metrics to expose.
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self):
+        """
+        Returns every metric in the Prometheus text exposition format.
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        for collector in collectors:
+            try:
+                metrics.extend(collector())
+            except Exception as e:
+                print(f"Error collecting metrics: {e}")
+        return ''.join(metric.render() for metric in metrics)
+
+
+class ServerMetrics(MetricsRegistry):
+    """
+    The metrics of an object server: the requests it serves and the time spent in every stage of
+    serving them.
+
+    Stages are timed separately, so that the latency of a request can be broken down into them:
+    - auth: Verifying the access key of the request.
+    - receive: Reading the request body from the client.
+    - compress, encrypt, checksum: Encoding object data, block by block.
+    - decompress, decrypt: Decoding object data, block by block; verifying its checksums is
+      timed as checksum.
+    - backend_read, backend_write: Reading and writing object data in the storage backend.
+    - metadata: Reading and writing metadata records.
+    - replicate: Replicating objects to the other object servers.
+
+    Attributes:
+    - requests: The number of requests served, by method and status.
+    - request_duration: The time requests took, by method.
+    - requests_in_flight: The number of requests in progress.
+    - stage_duration: The time spent in every stage of serving requests.
+    - received_bytes: The number of bytes of object data received from clients.
+    - sent_bytes: The number of bytes of object data sent to clients.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.requests = self.counter('kriya_requests_total', 'The number of requests served.',
+                                     ('method', 'status'))
+        self.request_duration = self.histogram('kriya_request_duration_seconds', 'The time requests took.',
+                                               ('method',))
+        self.requests_in_flight = self.gauge('kriya_requests_in_flight', 'The number of requests in progress.')
+        self.stage_duration = self.histogram('kriya_stage_duration_seconds',
+                                             'The time spent in every stage of serving requests.', ('stage',))
+        self.received_bytes = self.counter('kriya_received_bytes_total',
+                                           'The number of bytes of object data received from clients.')
+        self.sent_bytes = self.counter('kriya_sent_bytes_total', 'The number of bytes of object data sent to clients.')
+
+    def observe_request(self, method, status, duration):
+        """
+        Counts a request and observes the time (in seconds) it took.
+        """
+        method = method if method in METHODS else 'other'
+        self.requests.inc(method, str(status))
+        self.request_duration.observe(duration, method)
+
+    def observe_stage(self, stage, duration):
+        """
+        Observes the time (in seconds) spent in a stage of serving a request.
+        """
+        self.stage_duration.observe(duration, stage)
+
+    def stage(self, stage):
+        """
+        Returns a context manager observing the time spent within it as a stage.
+        """
+        return self.stage_duration.time(stage)
+
+
+def timed_iter(iterable, observe):
+    """
+    Yields the items of an iterable, and passes the total time (in seconds) spent producing them
+    to observe once the iteration ends, whether or not every item was consumed.
+    """
+    elapsed = 0.0
+    iterator = iter(iterable)
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed += time.perf_counter() - started
+            yield item
+    finally:
+        observe(elapsed)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404, 'Not Found')
+            return
+        body = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # scrapes are frequent and uninteresting
+        pass
+
+
+class MetricsServer(ThreadingHTTPServer):
+    """
+    Serves the metrics of a registry at /metrics, for Prometheus to scrape. It runs apart from
+    the object server, so that scrapes neither wait for nor take the workers serving objects.
+
+    Attributes:
+    - registry: The registry whose metrics are served.
+    - address: The (host, port) address the server listens on.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, registry):
+        super().__init__(address, _MetricsHandler)
+        self.registry = registry
+        self._thread = None
+
+    @property
+    def address(self):
+        return self.server_address[:2]
+
+    def start(self):
+        """
+        Starts serving in a background thread.
+        """
+        self._thread = threading.Thread(target=self.serve_forever, name='metrics-server', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops serving and closes the listening socket.
+        """
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
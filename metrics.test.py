@@ -0,0 +1,106 @@
+import http.client
+import unittest
+
+from metrics import Gauge, MetricsRegistry, MetricsServer, ServerMetrics, timed_iter
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_counter_and_gauge(self):
+        counter = self.registry.counter('requests_total', 'The number of requests.', ('method',))
+        counter.inc('GET')
+        counter.inc('GET', amount=2)
+        counter.inc('PUT')
+        gauge = self.registry.gauge('in_flight', 'The requests in progress.')
+        gauge.inc()
+        gauge.inc()
+        gauge.dec()
+
+        self.assertEqual(self.registry.render(),
+                         '# HELP requests_total The number of requests.\n'
+                         '# TYPE requests_total counter\n'
+                         'requests_total{method="GET"} 3\n'
+                         'requests_total{method="PUT"} 1\n'
+                         '# HELP in_flight The requests in progress.\n'
+                         '# TYPE in_flight gauge\n'
+                         'in_flight 1\n')
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('duration_seconds', 'The duration.', ('stage',), buckets=(0.1, 1))
+        histogram.observe(0.05, 'auth')
+        histogram.observe(0.1, 'auth')
+        histogram.observe(5, 'auth')
+
+        self.assertEqual(histogram.count('auth'), 3)
+        self.assertEqual(self.registry.render(),
+                         '# HELP duration_seconds The duration.\n'
+                         '# TYPE duration_seconds histogram\n'
+                         'duration_seconds_bucket{stage="auth",le="0.1"} 2\n'
+                         'duration_seconds_bucket{stage="auth",le="1"} 2\n'
+                         'duration_seconds_bucket{stage="auth",le="+Inf"} 3\n'
+                         'duration_seconds_sum{stage="auth"} 5.15\n'
+                         'duration_seconds_count{stage="auth"} 3\n')
+
+    def test_label_values_are_escaped(self):
+        self.registry.counter('errors_total', 'The errors.', ('message',)).inc('say "hi"\n')
+        self.assertIn('errors_total{message="say \\"hi\\"\\n"} 1\n', self.registry.render())
+
+    def test_collectors_are_called_on_every_render(self):
+        calls = []
+
+        def collect():
+            calls.append(None)
+            gauge = Gauge('calls', 'The calls.')
+            gauge.set(len(calls))
+            return [gauge]
+
+        self.registry.add_collector(collect)
+        self.assertIn('calls 1\n', self.registry.render())
+        self.assertIn('calls 2\n', self.registry.render())
+
+    def test_unknown_methods_are_counted_as_other(self):
+        metrics = ServerMetrics()
+        metrics.observe_request('GET', 200, 0.01)
+        metrics.observe_request('BREW', 501, 0.01)
+        self.assertEqual(metrics.requests.value('GET', '200'), 1)
+        self.assertEqual(metrics.requests.value('other', '501'), 1)
+        self.assertEqual(metrics.request_duration.count('GET'), 1)
+
+    def test_timed_iter_observes_when_closed_early(self):
+        observed = []
+        items = timed_iter(iter(range(10)), observed.append)
+        self.assertEqual(next(items), 0)
+        self.assertEqual(observed, [])
+        items.close()
+        self.assertEqual(len(observed), 1)
+
+        self.assertEqual(list(timed_iter([1, 2], observed.append)), [1, 2])
+        self.assertEqual(len(observed), 2)
+
+
+class TestMetricsServer(unittest.TestCase):
+    def test_serves_metrics(self):
+        registry = MetricsRegistry()
+        registry.counter('requests_total', 'The number of requests.').inc()
+        server = MetricsServer(('localhost', 0), registry)
+        server.start()
+        self.addCleanup(server.stop)
+
+        conn = http.client.HTTPConnection(*server.address, timeout=10)
+        self.addCleanup(conn.close)
+        conn.request('GET', '/metrics')
+        response = conn.getresponse()
+        self.assertEqual(response.status, 200)
+        self.assertTrue(response.getheader('Content-Type').startswith('text/plain; version=0.0.4'))
+        self.assertIn(b'requests_total 1\n', response.read())
+
+        conn.request('GET', '/other')
+        response = conn.getresponse()
+        response.read()
+        self.assertEqual(response.status, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
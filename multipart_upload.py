@@ -0,0 +1,179 @@
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+
+from object_metadata import ObjectMetadata
+
+# the prefix under which the parts of multipart uploads are stored
+MULTIPART_PREFIX = '.multipart'
+
+# the largest part number S3 clients may use
+MAX_PART_NUMBER = 10000
+
+
+class NoSuchUploadError(Exception):
+    pass
+
+
+class InvalidPartError(Exception):
+    pass
+
+
+class MultipartUploadManager:
+    """
+    Tracks multipart uploads and assembles their parts into objects.
+
+    Every part is stored as an object of its own, so parts can be uploaded, encrypted and
+    replicated concurrently by separate requests. Completing an upload only writes a manifest
+    listing the parts and their sizes into the metadata of the object; the part data is never
+    rewritten.
+
+    Attributes:
+    - storage_backend: The storage backend parts and manifests are stored in.
+    """
+
+    def __init__(self, storage_backend):
+        """
+        Initializes a new instance of the MultipartUploadManager class.
+
+        Args:
+        - storage_backend: The storage backend parts and manifests are stored in.
+        """
+        self.storage_backend = storage_backend
+        self._lock = threading.Lock()
+
+    def initiate(self, object_key):
+        """
+        Starts a new multipart upload.
+
+        Args:
+        - object_key: The key of the object being uploaded.
+
+        Returns:
+        - The ID of the new upload.
+        """
+        upload_id = uuid.uuid4().hex
+        self._write_upload(upload_id, {'object_key': object_key, 'parts': []})
+        return upload_id
+
+    def get_object_key(self, upload_id):
+        """
+        Returns the key of the object being uploaded by an upload.
+
+        Raises:
+        - NoSuchUploadError: If the upload does not exist.
+        """
+        return self._read_upload(upload_id)['object_key']
+
+    def part_key(self, upload_id, part_number):
+        """
+        Returns the key a part of an upload is stored under.
+
+        Raises:
+        - InvalidPartError: If the part number is out of range.
+        """
+        if not 1 <= part_number <= MAX_PART_NUMBER:
+            raise InvalidPartError(f"Part number must be between 1 and {MAX_PART_NUMBER}.")
+        return f"{MULTIPART_PREFIX}/{upload_id}/{part_number}"
+
+    def add_part(self, upload_id, part_number):
+        """
+        Records that a part of an upload has been stored.
+
+        Args:
+        - upload_id: The ID of the upload.
+        - part_number: The number of the stored part.
+        """
+        with self._lock:
+            upload = self._read_upload(upload_id)
+            if part_number not in upload['parts']:
+                upload['parts'].append(part_number)
+                self._write_upload(upload_id, upload)
+
+    def complete(self, upload_id, parts):
+        """
+        Completes an upload by writing a manifest of the given parts as the object.
+
+        Args:
+        - upload_id: The ID of the upload.
+        - parts: A list of (part_number, etag) tuples in ascending part number order.
+
+        Returns:
+        - The key of the completed object.
+
+        Raises:
+        - NoSuchUploadError: If the upload does not exist.
+        - InvalidPartError: If a part is missing, out of order or has a different ETag.
+        """
+        with self._lock:
+            upload = self._read_upload(upload_id)
+            object_key = upload['object_key']
+            uploaded_part_numbers = upload['parts']
+            if not parts:
+                raise InvalidPartError("At least one part must be specified.")
+
+            manifest = []
+            part_keys = []
+            part_hashes = []
+            object_size = 0
+            previous_part_number = 0
+            for part_number, etag in parts:
+                if part_number <= previous_part_number:
+                    raise InvalidPartError("Parts must be listed in ascending order.")
+                if part_number not in uploaded_part_numbers:
+                    raise InvalidPartError(f"Part {part_number} has not been uploaded.")
+                part_key = self.part_key(upload_id, part_number)
+                part_metadata = self.storage_backend.read_metadata(part_key)
+                if part_metadata is None or (etag or '').strip('"') != part_metadata.hash:
+                    raise InvalidPartError(f"Part {part_number} has a different ETag.")
+                part_keys.append(part_key)
+                part_hashes.append(bytes.fromhex(part_metadata.hash))
+                manifest.append([part_key, part_metadata.size])
+                object_size += part_metadata.size
+                previous_part_number = part_number
+
+            # the object itself has no data of its own, only the manifest of its parts
+            self.storage_backend.write_object(object_key, b'')
+            self.storage_backend.write_metadata(object_key, ObjectMetadata(
+                size=object_size,
+                hash=f"{hashlib.sha256(b''.join(part_hashes)).hexdigest()}-{len(part_keys)}",
+                parts=manifest,
+                last_modified=time.time()))
+
+            # parts that were uploaded but left out of the object are not needed anymore
+            for part_number in uploaded_part_numbers:
+                part_key = self.part_key(upload_id, part_number)
+                if part_key not in part_keys:
+                    self.storage_backend.delete_object(part_key)
+            self.storage_backend.delete_object(self._upload_key(upload_id))
+            return object_key
+
+    def abort(self, upload_id):
+        """
+        Aborts an upload and deletes its parts.
+
+        Raises:
+        - NoSuchUploadError: If the upload does not exist.
+        """
+        with self._lock:
+            for part_number in self._read_upload(upload_id)['parts']:
+                self.storage_backend.delete_object(self.part_key(upload_id, part_number))
+            self.storage_backend.delete_object(self._upload_key(upload_id))
+
+    def _read_upload(self, upload_id):
+        # the state of an upload is kept as a small JSON object next to its parts
+        if not re.fullmatch('[0-9a-f]{32}', upload_id):
+            raise NoSuchUploadError(f"Upload {upload_id} does not exist.")
+        try:
+            return json.loads(self.storage_backend.read_object(self._upload_key(upload_id)))
+        except FileNotFoundError:
+            raise NoSuchUploadError(f"Upload {upload_id} does not exist.")
+
+    def _write_upload(self, upload_id, upload):
+        self.storage_backend.write_object(self._upload_key(upload_id), json.dumps(upload).encode('utf-8'))
+
+    def _upload_key(self, upload_id):
+        return f"{MULTIPART_PREFIX}/{upload_id}/upload"
@@ -0,0 +1,74 @@
+import shutil
+import tempfile
+import unittest
+
+from multipart_upload import InvalidPartError, MultipartUploadManager, NoSuchUploadError
+from object_metadata import ObjectMetadata
+from storage_backend import DiskStorageBackend
+
+
+class TestMultipartUploadManager(unittest.TestCase):
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base_path)
+        self.storage_backend = DiskStorageBackend(self.base_path)
+        self.manager = MultipartUploadManager(self.storage_backend)
+
+    def upload_part(self, upload_id, part_number, part_hash, size):
+        part_key = self.manager.part_key(upload_id, part_number)
+        self.storage_backend.write_object(part_key, b'part')
+        self.storage_backend.write_metadata(part_key, ObjectMetadata(size=size, hash=part_hash))
+        self.manager.add_part(upload_id, part_number)
+        return part_key
+
+    def test_complete_writes_manifest(self):
+        upload_id = self.manager.initiate('bucket/object')
+        first_part_key = self.upload_part(upload_id, 1, 'aa', 5)
+        second_part_key = self.upload_part(upload_id, 2, 'bb', 3)
+        unused_part_key = self.upload_part(upload_id, 3, 'cc', 1)
+
+        object_key = self.manager.complete(upload_id, [(1, '"aa"'), (2, '"bb"')])
+
+        self.assertEqual(object_key, 'bucket/object')
+        metadata = self.storage_backend.read_metadata(object_key)
+        self.assertEqual(metadata.parts, [[first_part_key, 5], [second_part_key, 3]])
+        self.assertEqual(metadata.size, 8)
+        self.assertTrue(metadata.hash.endswith('-2'))
+        self.assertTrue(self.storage_backend.object_exists(first_part_key))
+        self.assertFalse(self.storage_backend.object_exists(unused_part_key))
+        with self.assertRaises(NoSuchUploadError):
+            self.manager.get_object_key(upload_id)
+
+    def test_complete_with_invalid_parts(self):
+        upload_id = self.manager.initiate('bucket/object')
+        self.upload_part(upload_id, 1, 'aa', 5)
+        self.upload_part(upload_id, 2, 'bb', 5)
+
+        for parts in ([], [(2, 'bb'), (1, 'aa')], [(1, 'aa'), (4, 'dd')], [(1, 'bb')]):
+            with self.assertRaises(InvalidPartError):
+                self.manager.complete(upload_id, parts)
+
+    def test_abort_deletes_parts(self):
+        upload_id = self.manager.initiate('bucket/object')
+        part_key = self.upload_part(upload_id, 1, 'aa', 5)
+
+        self.manager.abort(upload_id)
+
+        self.assertFalse(self.storage_backend.object_exists(part_key))
+        with self.assertRaises(NoSuchUploadError):
+            self.manager.abort(upload_id)
+
+    def test_unknown_upload(self):
+        for upload_id in ('0' * 32, '../../etc'):
+            with self.assertRaises(NoSuchUploadError):
+                self.manager.get_object_key(upload_id)
+
+    def test_part_number_out_of_range(self):
+        with self.assertRaises(InvalidPartError):
+            self.manager.part_key('0' * 32, 0)
+        with self.assertRaises(InvalidPartError):
+            self.manager.part_key('0' * 32, 10001)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+import struct
+
+# identifies serialized metadata records and the version of their format
+MAGIC = b'KMD\x01'
+
+_FIELD_HEADER = struct.Struct('<BI')
+_BLOCK = struct.Struct('<II')
+_PART_KEY_LENGTH = struct.Struct('<H')
+_STRING_LENGTH = struct.Struct('<H')
+_PART_SIZE = struct.Struct('<Q')
+_UINT64 = struct.Struct('<Q')
+_DOUBLE = struct.Struct('<d')
+
+
+def _encode_blocks(blocks):
+    return b''.join(_BLOCK.pack(stored_length, checksum) for stored_length, checksum in blocks)
+
+
+def _decode_blocks(data):
+    return [list(block) for block in _BLOCK.iter_unpack(data)]
+
+
+def _encode_parts(parts):
+    encoded_parts = []
+    for part_key, part_size in parts:
+        encoded_part_key = part_key.encode('utf-8')
+        encoded_parts.append(_PART_KEY_LENGTH.pack(len(encoded_part_key)) + encoded_part_key + _PART_SIZE.pack(part_size))
+    return b''.join(encoded_parts)
+
+
+def _decode_parts(data):
+    parts = []
+    offset = 0
+    while offset < len(data):
+        (part_key_length,) = _PART_KEY_LENGTH.unpack_from(data, offset)
+        offset += _PART_KEY_LENGTH.size
+        part_key = data[offset:offset + part_key_length].decode('utf-8')
+        offset += part_key_length
+        (part_size,) = _PART_SIZE.unpack_from(data, offset)
+        offset += _PART_SIZE.size
+        parts.append([part_key, part_size])
+    return parts
+
+
+def _encode_strings(strings):
+    encoded_strings = []
+    for string in strings:
+        encoded_string = string.encode('utf-8')
+        encoded_strings.append(_STRING_LENGTH.pack(len(encoded_string)) + encoded_string)
+    return b''.join(encoded_strings)
+
+
+def _decode_strings(data):
+    strings = []
+    offset = 0
+    while offset < len(data):
+        (string_length,) = _STRING_LENGTH.unpack_from(data, offset)
+        offset += _STRING_LENGTH.size
+        strings.append(data[offset:offset + string_length].decode('utf-8'))
+        offset += string_length
+    return strings
+
+
+# the tag, name, encoder and decoder of every field; tags must never be reused
+_FIELDS = [
+    (1, 'size', _UINT64.pack, lambda data: _UINT64.unpack(data)[0]),
+    (2, 'hash', lambda value: value.encode('ascii'), lambda data: data.decode('ascii')),
+    (3, 'encryption_key', bytes, bytes),
+    (4, 'nonce', bytes, bytes),
+    (5, 'block_size', _UINT64.pack, lambda data: _UINT64.unpack(data)[0]),
+    (6, 'blocks', _encode_blocks, _decode_blocks),
+    (7, 'parts', _encode_parts, _decode_parts),
+    (8, 'block_codecs', bytes, bytes),
+    (9, 'data_shards', _UINT64.pack, lambda data: _UINT64.unpack(data)[0]),
+    (10, 'parity_shards', _UINT64.pack, lambda data: _UINT64.unpack(data)[0]),
+    (11, 'shard_nodes', _encode_strings, _decode_strings),
+    (12, 'last_modified', _DOUBLE.pack, lambda data: _DOUBLE.unpack(data)[0]),
+    (13, 'checksum_algorithm', _UINT64.pack, lambda data: _UINT64.unpack(data)[0]),
+    (14, 'checksum', lambda value: value.encode('ascii'), lambda data: data.decode('ascii')),
+]
+_FIELDS_BY_TAG = {tag: (name, decode) for tag, name, _, decode in _FIELDS}
+
+
+class ObjectMetadata:
+    """
+    The metadata of one stored object, read and written as a single record.
+
+    Records are serialized as a sequence of tagged, length-prefixed fields. Fields left at their
+    default value are not written, and fields with unknown tags are skipped when reading, so
+    fields can be added without rewriting existing records.
+
+    Attributes:
+    - size: The size of the object data.
+    - hash: The hex SHA-256 hash of the object data, or of its parts for multipart objects.
+    - encryption_key: The AES-256 data key the object data is encrypted with, wrapped with the master
+      key, or the plain key for objects written before data keys were wrapped.
+    - nonce: The CTR nonce the object data is encrypted with.
+    - block_size: The number of bytes of object data in every block but the last.
+    - blocks: A list of [stored_length, checksum] pairs, one for every block.
+    - block_codecs: The identifier of the codec of every block, or empty if every block was
+      compressed using zlib.
+    - parts: A list of [part_key, part_size] pairs for objects completed from a multipart
+      upload, whose data is stored in the parts rather than in the object itself.
+    - data_shards: The number of data shards of erasure-coded objects, whose data is stored in
+      shards spread across the cluster rather than in the object itself, or 0.
+    - parity_shards: The number of parity shards of erasure-coded objects.
+    - shard_nodes: The ID of the node holding every shard of erasure-coded objects, or an empty
+      string for shards that could not be written.
+    - last_modified: The time (in seconds since the epoch) the object was written, or 0 if unknown.
+    - checksum_algorithm: The identifier of the algorithm of the block checksums, or 0 for CRC32.
+    - checksum: The whole-object checksum the client sent, as the algorithm and base64-encoded
+      value separated by a colon, or empty if it sent none.
+    """
+
+    __slots__ = ('size', 'hash', 'encryption_key', 'nonce', 'block_size', 'blocks', 'block_codecs', 'parts',
+                 'data_shards', 'parity_shards', 'shard_nodes', 'last_modified', 'checksum_algorithm', 'checksum')
+
+    def __init__(self, size=0, hash='', encryption_key=b'', nonce=b'', block_size=0, blocks=None,
+                 block_codecs=b'', parts=None, data_shards=0, parity_shards=0, shard_nodes=None,
+                 last_modified=0.0, checksum_algorithm=0, checksum=''):
+        self.size = size
+        self.hash = hash
+        self.encryption_key = encryption_key
+        self.nonce = nonce
+        self.block_size = block_size
+        self.blocks = [] if blocks is None else blocks
+        self.block_codecs = block_codecs
+        self.parts = [] if parts is None else parts
+        self.data_shards = data_shards
+        self.parity_shards = parity_shards
+        self.shard_nodes = [] if shard_nodes is None else shard_nodes
+        self.last_modified = last_modified
+        self.checksum_algorithm = checksum_algorithm
+        self.checksum = checksum
+
+    def to_bytes(self) -> bytes:
+        """
+        Serializes the record.
+        """
+        fields = [MAGIC]
+        for tag, name, encode, _ in _FIELDS:
+            value = getattr(self, name)
+            if value:
+                encoded_value = encode(value)
+                fields.append(_FIELD_HEADER.pack(tag, len(encoded_value)))
+                fields.append(encoded_value)
+        return b''.join(fields)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'ObjectMetadata':
+        """
+        Deserializes a record written by to_bytes.
+
+        Raises:
+        - ValueError: If the data is not a metadata record.
+        """
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError("Not an object metadata record.")
+        metadata = cls()
+        offset = len(MAGIC)
+        try:
+            while offset < len(data):
+                tag, length = _FIELD_HEADER.unpack_from(data, offset)
+                offset += _FIELD_HEADER.size
+                if offset + length > len(data):
+                    raise ValueError("Object metadata record is truncated.")
+                if tag in _FIELDS_BY_TAG:
+                    name, decode = _FIELDS_BY_TAG[tag]
+                    setattr(metadata, name, decode(data[offset:offset + length]))
+                offset += length
+        except struct.error as e:
+            raise ValueError(f"Object metadata record is corrupted: {e}")
+        return metadata
+
+    def __eq__(self, other):
+        if not isinstance(other, ObjectMetadata):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return f"ObjectMetadata(size={self.size}, hash={self.hash!r}, blocks={len(self.blocks)}, parts={len(self.parts)})"
@@ -0,0 +1,45 @@
+import os
+import unittest
+
+from object_metadata import MAGIC, ObjectMetadata
+
+
+class TestObjectMetadata(unittest.TestCase):
+    def test_round_trip(self):
+        metadata = ObjectMetadata(size=3 * 1024 * 1024, hash='ab' * 32, encryption_key=os.urandom(32),
+                                  nonce=os.urandom(8), block_size=1024 * 1024,
+                                  blocks=[[1048590, 12345], [1048590, 0], [100, 2 ** 32 - 1]],
+                                  parts=[['.multipart/upload/1', 5], ['.multipart/upload/ü', 2 ** 40]],
+                                  last_modified=1700000000.125, checksum_algorithm=2, checksum='crc32:AAAAAA==')
+
+        self.assertEqual(ObjectMetadata.from_bytes(metadata.to_bytes()), metadata)
+
+    def test_erasure_coded_round_trip(self):
+        metadata = ObjectMetadata(size=10, data_shards=4, parity_shards=2,
+                                  shard_nodes=['localhost:8080', '', 'ü:1', 'a', 'b', 'c'])
+
+        self.assertEqual(ObjectMetadata.from_bytes(metadata.to_bytes()), metadata)
+
+    def test_empty_record(self):
+        self.assertEqual(ObjectMetadata().to_bytes(), MAGIC)
+        self.assertEqual(ObjectMetadata.from_bytes(MAGIC), ObjectMetadata())
+
+    def test_unknown_fields_are_skipped(self):
+        data = ObjectMetadata(size=5).to_bytes() + bytes([200]) + (3).to_bytes(4, 'little') + b'xyz'
+
+        self.assertEqual(ObjectMetadata.from_bytes(data), ObjectMetadata(size=5))
+
+    def test_invalid_records(self):
+        for data in (b'', b'{"size": 5}', ObjectMetadata(hash='ab' * 32).to_bytes()[:-1]):
+            with self.assertRaises(ValueError):
+                ObjectMetadata.from_bytes(data)
+
+    def test_record_is_compact(self):
+        metadata = ObjectMetadata(size=1, hash='ab' * 32, encryption_key=os.urandom(32), nonce=os.urandom(8),
+                                  block_size=1024 * 1024, blocks=[[20, 1]])
+
+        self.assertLess(len(metadata.to_bytes()), 180)
+
+
+if __name__ == '__main__':
+    unittest.main()
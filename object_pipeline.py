@@ -0,0 +1,413 @@
+import collections
+import functools
+import hashlib
+import itertools
+import time
+
+from Crypto.Cipher import AES
+
+from checksums import CHECKSUMS, CHECKSUMS_BY_ID, DEFAULT_CHECKSUM_ID
+from compression import CODECS, CODECS_BY_ID, DEFAULT_CODEC_ID, is_compressed
+
+# the size of the chunks an object is read and sent in
+CHUNK_SIZE = 1024 * 1024
+
+# the size of the blocks an object is split into before it is compressed and encrypted
+BLOCK_SIZE = 1024 * 1024
+
+# the most blocks stored uncompressed, after a block compressed poorly, before compressing is tried again
+MAX_SKIPPED_BLOCKS = 64
+
+# the smallest object worth encoding or decoding its blocks in parallel
+PARALLEL_MIN_SIZE = 4 * BLOCK_SIZE
+
+
+class ChecksumError(Exception):
+    pass
+
+
+def block_cipher(encryption_key: bytes, nonce: bytes, block_number: int):
+    """
+    Returns the AES-256 CTR cipher for one block of an object.
+
+    Every block starts at its own counter value, so blocks can be encrypted and decrypted
+    independently of each other without ever reusing a counter within an object.
+    """
+    return AES.new(encryption_key, AES.MODE_CTR, nonce=nonce, initial_value=block_number << 32)
+
+
+def _timed(stage_timer, stage, function, *args):
+    # calls a function, passing the time it took to the stage timer, if any
+    if stage_timer is None:
+        return function(*args)
+    started = time.perf_counter()
+    result = function(*args)
+    stage_timer(stage, time.perf_counter() - started)
+    return result
+
+
+def _ordered_map(executor, function, items, max_pending):
+    # like Executor.map, but without submitting more than max_pending items ahead of the results
+    # consumed, so a large object is never held in memory whole
+    pending = collections.deque()
+    try:
+        for item in items:
+            pending.append(executor.submit(function, *item))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def parse_range(range_header: str, object_size: int):
+    """
+    Parses the value of a Range header holding a single byte range.
+
+    Args:
+    - range_header: The value of the Range header, e.g. 'bytes=0-99', 'bytes=100-' or 'bytes=-100'.
+    - object_size: The size of the object the range applies to.
+
+    Returns:
+    - The (start, end) range of the object to return, end exclusive, or None if the header
+      should be ignored and the whole object returned.
+
+    Raises:
+    - ValueError: If the range cannot be satisfied.
+    """
+    unit, _, byte_range = range_header.partition('=')
+    if unit.strip() != 'bytes' or ',' in byte_range:
+        return None
+    first, _, last = byte_range.strip().partition('-')
+    try:
+        if not first:
+            suffix_length = int(last)
+            if suffix_length == 0:
+                raise ValueError("Range is empty.")
+            start, end = max(object_size - suffix_length, 0), object_size
+        else:
+            start = int(first)
+            end = min(int(last) + 1, object_size) if last else object_size
+    except ValueError:
+        raise ValueError(f"Invalid range: {range_header}")
+    if start >= object_size or start >= end:
+        raise ValueError(f"Range not satisfiable: {range_header}")
+    return start, end
+
+
+def is_stored_plain(metadata) -> bool:
+    """
+    Returns whether the stored data of an object is the object data itself, neither encrypted
+    nor compressed, so that it can be sent without being decoded.
+    """
+    return (not metadata.encryption_key and not metadata.shard_nodes and bool(metadata.block_codecs)
+            and not any(metadata.block_codecs))
+
+
+class ObjectEncoder:
+    """
+    Splits an object into blocks and compresses, encrypts and checksums each block on its own,
+    so that memory use stays bounded by the block size no matter how large the object is and
+    any range of the object can later be read without decoding the blocks before it.
+
+    Each block is compressed with the given codec and then encrypted using AES-256 in CTR mode,
+    unless no encryption key is given.
+    Objects that already start like a compressed format are not compressed at all, and blocks
+    that do not shrink below min_ratio of their size are stored uncompressed, with compressing
+    skipped for a growing number of the blocks after them. A checksum of the given algorithm is
+    kept for every block and a SHA-256 hash for the whole object.
+
+    Given an executor, blocks are compressed, encrypted and checksummed on its threads, several
+    at a time, while the object data streams in; compressing, encrypting and checksumming all
+    release the GIL. Blocks are still stored in order and, as every block has a counter range of
+    its own and the codec of every block is decided in order, the encoded object is the same as
+    if its blocks were encoded one at a time.
+
+    Given a stage timer, the time spent compressing, encrypting and checksumming is passed to it
+    as the 'compress', 'encrypt' and 'checksum' stages.
+
+    Attributes:
+    - size: The number of bytes of object data encoded so far.
+    - blocks: A list of [stored_length, checksum] pairs, one for every block encoded so far.
+    - block_codecs: The identifier of the codec of every block encoded so far.
+    - checksum: The algorithm the blocks are checksummed with.
+    """
+
+    def __init__(self, encryption_key: bytes, nonce: bytes, block_size: int = BLOCK_SIZE,
+                 codec=CODECS['zlib'], min_ratio: float = 0.9, checksum=CHECKSUMS['crc32'], executor=None,
+                 max_pending_blocks: int = 16, stage_timer=None):
+        """
+        Initializes a new instance of the ObjectEncoder class.
+
+        Args:
+        - encryption_key: The 32-byte AES-256 key to encrypt the object with, or empty to store it unencrypted.
+        - nonce: The 8-byte CTR nonce to encrypt the object with.
+        - block_size: The number of bytes of object data in every block but the last.
+        - codec: The codec to compress blocks with.
+        - min_ratio: The compressed size, as a fraction of the original size, above which a
+          block is stored uncompressed instead.
+        - checksum: The algorithm to checksum blocks with.
+        - executor: The executor to encode blocks in parallel on, or None to encode them on the calling thread.
+        - max_pending_blocks: The most blocks encoded ahead of the blocks stored.
+        - stage_timer: A callable taking the name of a stage and the time (in seconds) spent in
+          it, or None to not time stages.
+        """
+        self.size = 0
+        self.blocks = []
+        self.block_codecs = bytearray()
+        self.block_size = block_size
+        self.checksum = checksum
+        self._encryption_key = encryption_key
+        self._nonce = nonce
+        self._sha256 = hashlib.sha256()
+        self._codec = codec
+        self._min_ratio = min_ratio
+        self._blocks_to_skip = 0
+        self._skipped_blocks_after_poor_ratio = 1
+        self._executor = executor
+        self._max_pending_blocks = max_pending_blocks
+        self._stage_timer = stage_timer
+
+    @property
+    def hash(self) -> str:
+        """
+        The hex SHA-256 hash of the object data encoded so far.
+        """
+        return self._sha256.hexdigest()
+
+    def encode(self, chunks):
+        """
+        Encodes a stream of object data.
+
+        Args:
+        - chunks: An iterable over the chunks of object data.
+
+        Returns:
+        - An iterator over the encoded blocks to store.
+        """
+        if self._executor is None:
+            for block in self._split_blocks(chunks):
+                yield self._encode_block(block)
+            return
+
+        encoded_blocks = _ordered_map(self._executor, self._encode_block_ahead,
+                                      ((block, block_number) for block_number, block
+                                       in enumerate(self._split_blocks(chunks))),
+                                      self._max_pending_blocks)
+        for block, compressed_block, encrypted_block, encrypted_plain, checksum in encoded_blocks:
+            codec, stored_block = self._compress_block(block, compressed_block)
+            if (stored_block is block) == encrypted_plain:
+                stored_block = encrypted_block
+            else:
+                # compressing was skipped for this block, though it compressed well ahead of time
+                stored_block = self._encrypt_block(stored_block, len(self.blocks))
+            self.blocks.append([len(stored_block), checksum])
+            self.block_codecs.append(codec.codec_id)
+            yield stored_block
+
+    def _split_blocks(self, chunks):
+        block = bytearray()
+        first_block = True
+        for chunk in chunks:
+            self.size += len(chunk)
+            _timed(self._stage_timer, 'checksum', self._sha256.update, chunk)
+            block += chunk
+            while len(block) >= self.block_size:
+                yield self._check_compressed(bytes(block[:self.block_size]), first_block)
+                first_block = False
+                del block[:self.block_size]
+        if block:
+            yield self._check_compressed(bytes(block), first_block)
+
+    def _check_compressed(self, block, first_block):
+        # data that is already compressed is not worth compressing again
+        if first_block and is_compressed(block):
+            self._codec = CODECS['none']
+        return block
+
+    def _encode_block(self, block):
+        codec, stored_block = self._compress_block(block)
+        stored_block = self._encrypt_block(stored_block, len(self.blocks))
+        self.blocks.append([len(stored_block), _timed(self._stage_timer, 'checksum', self.checksum.compute, block)])
+        self.block_codecs.append(codec.codec_id)
+        return stored_block
+
+    def _encode_block_ahead(self, block, block_number):
+        # runs on the executor: compresses the block, if its codec compresses at all, and
+        # encrypts whichever of the block and its compressed form _compress_block will most
+        # likely choose, which it only does not while skipping blocks after a poor ratio
+        compressed_block = None
+        encrypted_plain = True
+        if self._codec is not CODECS['none']:
+            compressed_block = _timed(self._stage_timer, 'compress', self._codec.compress, block)
+            encrypted_plain = len(compressed_block) > self._min_ratio * len(block)
+        encrypted_block = self._encrypt_block(block if encrypted_plain else compressed_block, block_number)
+        checksum = _timed(self._stage_timer, 'checksum', self.checksum.compute, block)
+        return block, compressed_block, encrypted_block, encrypted_plain, checksum
+
+    def _encrypt_block(self, block, block_number):
+        if not self._encryption_key:
+            return block
+        return _timed(self._stage_timer, 'encrypt',
+                      block_cipher(self._encryption_key, self._nonce, block_number).encrypt, block)
+
+    def _compress_block(self, block, compressed_block=None):
+        # compressed_block is the block compressed ahead of time, or None to compress it here
+        if self._codec is CODECS['none']:
+            return self._codec, block
+        if self._blocks_to_skip > 0:
+            self._blocks_to_skip -= 1
+            return CODECS['none'], block
+
+        if compressed_block is None:
+            compressed_block = _timed(self._stage_timer, 'compress', self._codec.compress, block)
+        if len(compressed_block) > self._min_ratio * len(block):
+            # skip compressing twice as many blocks every time compressing does not pay off
+            self._blocks_to_skip = self._skipped_blocks_after_poor_ratio
+            self._skipped_blocks_after_poor_ratio = min(2 * self._skipped_blocks_after_poor_ratio, MAX_SKIPPED_BLOCKS)
+            return CODECS['none'], block
+        self._skipped_blocks_after_poor_ratio = 1
+        return self._codec, compressed_block
+
+
+class ObjectDecoder:
+    """
+    Decrypts, decompresses and verifies the blocks of an object encoded by ObjectEncoder.
+
+    Attributes:
+    - size: The size of the object data.
+    - block_size: The number of bytes of object data in every block but the last.
+    - blocks: A list of [stored_length, checksum] pairs, one for every block.
+    - block_codecs: The identifier of the codec of every block, or empty if every block was
+      compressed using zlib.
+    - checksum_algorithm: The identifier of the algorithm the blocks were checksummed with.
+
+    Given an executor, blocks are decoded on its threads, several at a time, while the stored
+    data is read ahead of them, and still returned in order. Given a stage timer, the time spent
+    decrypting, decompressing and checksumming is passed to it as the 'decrypt', 'decompress'
+    and 'checksum' stages.
+    """
+
+    def __init__(self, encryption_key: bytes, nonce: bytes, size: int, block_size: int, blocks,
+                 block_codecs: bytes = b'', checksum_algorithm: int = DEFAULT_CHECKSUM_ID, executor=None,
+                 max_pending_blocks: int = 16, stage_timer=None):
+        """
+        Initializes a new instance of the ObjectDecoder class.
+
+        Args:
+        - encryption_key: The 32-byte AES-256 key the object was encrypted with, or empty if it is unencrypted.
+        - nonce: The 8-byte CTR nonce the object was encrypted with.
+        - size: The size of the object data.
+        - block_size: The number of bytes of object data in every block but the last.
+        - blocks: A list of [stored_length, checksum] pairs, one for every block.
+        - block_codecs: The identifier of the codec of every block, or empty if every block was
+          compressed using zlib.
+        - checksum_algorithm: The identifier of the algorithm the blocks were checksummed with.
+        - executor: The executor to decode blocks in parallel on, or None to decode them on the calling thread.
+        - max_pending_blocks: The most blocks decoded ahead of the blocks returned.
+        - stage_timer: A callable taking the name of a stage and the time (in seconds) spent in
+          it, or None to not time stages.
+        """
+        self.size = size
+        self.block_size = block_size
+        self.blocks = blocks
+        self.block_codecs = block_codecs
+        self.checksum_algorithm = checksum_algorithm
+        self._encryption_key = encryption_key
+        self._nonce = nonce
+        self._executor = executor
+        self._max_pending_blocks = max_pending_blocks
+        self._stage_timer = stage_timer
+
+    def decode(self, read_stored_range, start=0, end=None, rebuild_block=None):
+        """
+        Decodes a range of the object, reading only the blocks the range overlaps. Every block
+        is verified against its checksum before any of its data is returned.
+
+        Args:
+        - read_stored_range: A callable taking an offset and length into the stored data and
+          returning an iterator over the chunks of stored data in that range.
+        - start: The offset of the first byte of object data to return.
+        - end: The offset after the last byte of object data to return, or None for the end of the object.
+        - rebuild_block: A callable taking the number of a block that does not match its checksum
+          and a callable decoding a stored block, returning the block decoded from its stored
+          data read some other way, or None to fail on such a block.
+
+        Returns:
+        - An iterator over the chunks of object data in the range.
+
+        Raises:
+        - ChecksumError: If a block does not match its checksum.
+        """
+        end = self.size if end is None else end
+        if start >= end:
+            return
+        first_block = start // self.block_size
+        last_block = (end - 1) // self.block_size
+        stored_offset = sum(stored_length for stored_length, _ in self.blocks[:first_block])
+        stored_length = sum(stored_length for stored_length, _ in self.blocks[first_block:last_block + 1])
+
+        stored_blocks = self._read_stored_blocks(read_stored_range(stored_offset, stored_length), first_block,
+                                                 last_block)
+        decode_block = self._decode_block
+        if rebuild_block is not None:
+            decode_block = functools.partial(self._decode_or_rebuild_block, rebuild_block)
+        if self._executor is None or last_block == first_block:
+            blocks = itertools.starmap(decode_block, stored_blocks)
+        else:
+            blocks = _ordered_map(self._executor, decode_block, stored_blocks, self._max_pending_blocks)
+        for block_number, block in enumerate(blocks, first_block):
+            block_start = block_number * self.block_size
+            yield block[max(start - block_start, 0):end - block_start]
+
+    def verify_block(self, block_number, stored_block):
+        """
+        Decodes one stored block, verifying it against its checksum.
+
+        Returns:
+        - The decoded block.
+
+        Raises:
+        - ChecksumError: If the block does not match its checksum.
+        """
+        return self._decode_block(block_number, stored_block, self.blocks[block_number][1])
+
+    def _decode_or_rebuild_block(self, rebuild_block, block_number, stored_block, block_checksum):
+        try:
+            return self._decode_block(block_number, stored_block, block_checksum)
+        except ChecksumError:
+            return rebuild_block(block_number, self.verify_block)
+
+    def _read_stored_blocks(self, stored_chunks, first_block, last_block):
+        stored_chunks = iter(stored_chunks)
+        buffer = bytearray()
+        for block_number in range(first_block, last_block + 1):
+            block_stored_length, block_checksum = self.blocks[block_number]
+            while len(buffer) < block_stored_length:
+                chunk = next(stored_chunks, None)
+                if chunk is None:
+                    raise ChecksumError("Object data is truncated.")
+                buffer += chunk
+            yield block_number, bytes(buffer[:block_stored_length]), block_checksum
+            del buffer[:block_stored_length]
+
+    def _decode_block(self, block_number, stored_block, block_checksum):
+        block_size = min(self.block_size, self.size - block_number * self.block_size)
+        if self._encryption_key:
+            stored_block = _timed(self._stage_timer, 'decrypt',
+                                  block_cipher(self._encryption_key, self._nonce, block_number).decrypt, stored_block)
+        codec_id = self.block_codecs[block_number] if self.block_codecs else DEFAULT_CODEC_ID
+        try:
+            block = _timed(self._stage_timer, 'decompress', CODECS_BY_ID[codec_id].decompress, stored_block, block_size)
+        except KeyError:
+            raise ChecksumError(f"Block {block_number} uses codec {codec_id}, which is not available.")
+        except Exception as e:
+            raise ChecksumError(f"Block {block_number} is corrupted: {e}")
+        checksum = CHECKSUMS_BY_ID.get(self.checksum_algorithm)
+        if checksum is None:
+            raise ChecksumError(f"Checksum algorithm {self.checksum_algorithm} is not available.")
+        if len(block) != block_size or _timed(self._stage_timer, 'checksum', checksum.compute, block) != block_checksum:
+            raise ChecksumError(f"Checksum verification failed for block {block_number}.")
+        return block
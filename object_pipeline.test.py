@@ -0,0 +1,204 @@
+import os
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import checksums
+from checksums import ChecksumAlgorithm
+from compression import CODECS
+from object_metadata import ObjectMetadata
+from object_pipeline import ChecksumError, ObjectDecoder, ObjectEncoder, is_stored_plain, parse_range
+
+
+class TestObjectPipeline(unittest.TestCase):
+    def setUp(self):
+        self.encryption_key = os.urandom(32)
+        self.nonce = os.urandom(8)
+        self.reads = []
+
+    def encode(self, object_data, block_size=4096, codec=CODECS['zlib']):
+        encoder = ObjectEncoder(self.encryption_key, self.nonce, block_size, codec)
+        chunks = [object_data[i:i + 1000] for i in range(0, len(object_data), 1000)]
+        stored_data = b''.join(encoder.encode(chunks))
+        decoder = ObjectDecoder(self.encryption_key, self.nonce, encoder.size, block_size, encoder.blocks,
+                                bytes(encoder.block_codecs))
+        return encoder, decoder, stored_data
+
+    def read_stored_range(self, stored_data):
+        def read(offset, length):
+            self.reads.append((offset, length))
+            return [stored_data[i:min(i + 777, offset + length)] for i in range(offset, offset + length, 777)]
+        return read
+
+    def test_block_checksum_algorithm(self):
+        algorithm = ChecksumAlgorithm(200, 'test', lambda data: len(data))
+        object_data = b'a' * 10000
+        encoder = ObjectEncoder(self.encryption_key, self.nonce, 4096, checksum=algorithm)
+        stored_data = b''.join(encoder.encode([object_data]))
+        self.assertEqual([checksum for _, checksum in encoder.blocks], [4096, 4096, 1808])
+
+        with mock.patch.dict(checksums.CHECKSUMS_BY_ID, {200: algorithm}):
+            decoder = ObjectDecoder(self.encryption_key, self.nonce, encoder.size, 4096, encoder.blocks,
+                                    bytes(encoder.block_codecs), algorithm.algorithm_id)
+            self.assertEqual(b''.join(decoder.decode(self.read_stored_range(stored_data))), object_data)
+        # blocks checksummed with an algorithm that is not available cannot be verified
+        with self.assertRaises(ChecksumError):
+            list(decoder.decode(self.read_stored_range(stored_data)))
+
+    def test_parallel_encoding_is_deterministic(self):
+        # incompressible stretches make the encoder skip compressing the blocks after them
+        object_data = b''.join(os.urandom(4096) if i % 7 in (2, 3) else bytes([i]) * 4096 for i in range(60)) + b'end'
+        chunks = [object_data[i:i + 3000] for i in range(0, len(object_data), 3000)]
+        encoder = ObjectEncoder(self.encryption_key, self.nonce, 4096)
+        stored_data = b''.join(encoder.encode(chunks))
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            parallel_encoder = ObjectEncoder(self.encryption_key, self.nonce, 4096, executor=executor,
+                                             max_pending_blocks=5)
+            self.assertEqual(b''.join(parallel_encoder.encode(chunks)), stored_data)
+            decoder = ObjectDecoder(self.encryption_key, self.nonce, encoder.size, 4096, encoder.blocks,
+                                    bytes(encoder.block_codecs), executor=executor, max_pending_blocks=5)
+            self.assertEqual(b''.join(decoder.decode(self.read_stored_range(stored_data), 100, 200000)),
+                             object_data[100:200000])
+        self.assertEqual((parallel_encoder.blocks, parallel_encoder.block_codecs, parallel_encoder.hash),
+                         (encoder.blocks, encoder.block_codecs, encoder.hash))
+        self.assertIn(0, encoder.block_codecs)
+
+    def test_stage_timer(self):
+        stages = []
+        object_data = b'a' * 10000
+        encoder = ObjectEncoder(self.encryption_key, self.nonce, 4096,
+                                stage_timer=lambda stage, elapsed: stages.append(stage))
+        stored_data = b''.join(encoder.encode([object_data]))
+        self.assertEqual(sorted(set(stages)), ['checksum', 'compress', 'encrypt'])
+        self.assertEqual(stages.count('encrypt'), 3)
+
+        stages.clear()
+        decoder = ObjectDecoder(self.encryption_key, self.nonce, encoder.size, 4096, encoder.blocks,
+                                bytes(encoder.block_codecs), stage_timer=lambda stage, elapsed: stages.append(stage))
+        self.assertEqual(b''.join(decoder.decode(self.read_stored_range(stored_data))), object_data)
+        self.assertEqual(sorted(stages), ['checksum'] * 3 + ['decompress'] * 3 + ['decrypt'] * 3)
+
+    def test_round_trip(self):
+        object_data = os.urandom(5000) + b'a' * 20000
+        encoder, decoder, stored_data = self.encode(object_data)
+
+        self.assertEqual(b''.join(decoder.decode(self.read_stored_range(stored_data))), object_data)
+        self.assertEqual(encoder.size, len(object_data))
+        self.assertEqual(len(encoder.blocks), 7)
+        self.assertEqual(sum(stored_length for stored_length, _ in encoder.blocks), len(stored_data))
+
+    def test_empty_object(self):
+        encoder, decoder, stored_data = self.encode(b'')
+
+        self.assertEqual(stored_data, b'')
+        self.assertEqual(list(decoder.decode(self.read_stored_range(stored_data))), [])
+
+    def test_stored_data_is_encrypted(self):
+        _, _, stored_data = self.encode(os.urandom(100) + b'secret' * 1000)
+
+        self.assertNotIn(b'secret', stored_data)
+
+    def test_unencrypted_uncompressed_object_is_stored_plain(self):
+        self.encryption_key = b''
+        object_data = b'public' * 2000
+        encoder, decoder, stored_data = self.encode(object_data, codec=CODECS['none'])
+
+        self.assertEqual(stored_data, object_data)
+        self.assertEqual(b''.join(decoder.decode(self.read_stored_range(stored_data), 10, 7000)), object_data[10:7000])
+        self.assertTrue(is_stored_plain(ObjectMetadata(block_codecs=bytes(encoder.block_codecs))))
+        self.assertFalse(is_stored_plain(ObjectMetadata(encryption_key=os.urandom(32),
+                                                        block_codecs=bytes(encoder.block_codecs))))
+        self.assertFalse(is_stored_plain(ObjectMetadata(block_codecs=b'\x00\x01')))
+        self.assertFalse(is_stored_plain(ObjectMetadata()))
+
+    def test_range_reads_only_overlapping_blocks(self):
+        object_data = os.urandom(4096 * 10)
+        encoder, decoder, stored_data = self.encode(object_data)
+
+        object_range = b''.join(decoder.decode(self.read_stored_range(stored_data), 5000, 9000))
+
+        self.assertEqual(object_range, object_data[5000:9000])
+        first_block_offset = encoder.blocks[0][0]
+        self.assertEqual(self.reads, [(first_block_offset, encoder.blocks[1][0] + encoder.blocks[2][0])])
+
+    def test_corrupted_block(self):
+        object_data = os.urandom(4096 * 3)
+        _, decoder, stored_data = self.encode(object_data)
+        corrupted_data = stored_data[:5000] + bytes([stored_data[5000] ^ 1]) + stored_data[5001:]
+
+        object_chunks = []
+        with self.assertRaises(ChecksumError):
+            for chunk in decoder.decode(self.read_stored_range(corrupted_data)):
+                object_chunks.append(chunk)
+
+        self.assertEqual(object_chunks, [object_data[:4096]])
+
+    def test_corrupted_block_is_rebuilt(self):
+        object_data = os.urandom(4096 * 3)
+        encoder, decoder, stored_data = self.encode(object_data)
+        corrupted_data = stored_data[:5000] + bytes([stored_data[5000] ^ 1]) + stored_data[5001:]
+        block_offset = encoder.blocks[0][0]
+        rebuilt_blocks = []
+
+        def rebuild_block(block_number, decode_block):
+            rebuilt_blocks.append(block_number)
+            with self.assertRaises(ChecksumError):
+                decode_block(block_number, corrupted_data[block_offset:block_offset + encoder.blocks[1][0]])
+            return decode_block(block_number, stored_data[block_offset:block_offset + encoder.blocks[1][0]])
+
+        self.assertEqual(b''.join(decoder.decode(self.read_stored_range(corrupted_data),
+                                                 rebuild_block=rebuild_block)), object_data)
+        self.assertEqual(rebuilt_blocks, [1])
+
+    def test_truncated_data(self):
+        _, decoder, stored_data = self.encode(os.urandom(10000))
+
+        with self.assertRaises(ChecksumError):
+            list(decoder.decode(self.read_stored_range(stored_data[:-10])))
+
+    def test_incompressible_blocks_are_stored_uncompressed(self):
+        object_data = b'a' * 4096 + os.urandom(4096 * 5) + b'a' * 4096 * 2
+        encoder, decoder, stored_data = self.encode(object_data)
+
+        self.assertEqual(b''.join(decoder.decode(self.read_stored_range(stored_data))), object_data)
+        # after a poorly compressing block, one and then two blocks are not even tried
+        self.assertEqual(list(encoder.block_codecs), [1, 0, 0, 0, 0, 0, 1, 1])
+
+    def test_compressed_formats_are_not_compressed(self):
+        object_data = b'\x1f\x8b' + b'a' * 10000
+        encoder, decoder, stored_data = self.encode(object_data)
+
+        self.assertEqual(b''.join(decoder.decode(self.read_stored_range(stored_data))), object_data)
+        self.assertEqual(list(encoder.block_codecs), [0, 0, 0])
+
+    def test_uncompressed_codec(self):
+        object_data = b'a' * 10000
+        encoder, decoder, stored_data = self.encode(object_data, codec=CODECS['none'])
+
+        self.assertEqual(len(stored_data), len(object_data))
+        self.assertEqual(b''.join(decoder.decode(self.read_stored_range(stored_data))), object_data)
+
+    def test_blocks_without_codecs_are_zlib(self):
+        object_data = b'a' * 10000
+        encoder, _, stored_data = self.encode(object_data)
+
+        decoder = ObjectDecoder(self.encryption_key, self.nonce, encoder.size, 4096, encoder.blocks)
+
+        self.assertEqual(b''.join(decoder.decode(self.read_stored_range(stored_data))), object_data)
+
+    def test_parse_range(self):
+        self.assertEqual(parse_range('bytes=0-99', 1000), (0, 100))
+        self.assertEqual(parse_range('bytes=900-', 1000), (900, 1000))
+        self.assertEqual(parse_range('bytes=900-5000', 1000), (900, 1000))
+        self.assertEqual(parse_range('bytes=-100', 1000), (900, 1000))
+        self.assertEqual(parse_range('bytes=-5000', 1000), (0, 1000))
+        self.assertIsNone(parse_range('bytes=0-1,5-6', 1000))
+        self.assertIsNone(parse_range('items=0-1', 1000))
+        for range_header in ('bytes=1000-', 'bytes=5-4', 'bytes=-0', 'bytes=a-b'):
+            with self.assertRaises(ValueError):
+                parse_range(range_header, 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
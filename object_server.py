@@ -1,17 +1,72 @@
-import gzip
-import hashlib
+import argparse
+import base64
+import email.utils
 import os
+import queue
+import threading
 import time
-import zlib
 from http.server import BaseHTTPRequestHandler, HTTPServer
 from urllib.parse import urlparse, parse_qs
+from xml.etree import ElementTree
 
-from Crypto.Cipher import AES
-from Crypto.Util.Padding import pad, unpad
+from checksums import CHECKSUMS, BadDigestError, ObjectChecksum, sha256_checksum
+from compression import CODECS, CompressionPolicy
+from erasure_coding import ErasureCoder, NotEnoughShardsError
+from key_management import InvalidKeyError
+from metrics import timed_iter
+from multipart_upload import InvalidPartError, NoSuchUploadError
+from object_metadata import ObjectMetadata
+from object_pipeline import (CHUNK_SIZE, PARALLEL_MIN_SIZE, ChecksumError, ObjectDecoder, ObjectEncoder,
+                             is_stored_plain, parse_range)
+from server_context import ServerContext
+from storage_backend import RESERVED_SUFFIXES
 
-from identity_layer import IdentityLayer
-from object_server_cluster import ObjectServerCluster
-from storage_backend import StorageBackend
+
+S3_XMLNS = 'http://s3.amazonaws.com/doc/2006-03-01/'
+
+# the most keys a single listing returns, as in S3
+MAX_KEYS = 1000
+
+# the algorithms of the x-amz-checksum-* headers S3 defines, not all of which may be available
+S3_CHECKSUM_ALGORITHMS = ('crc32', 'crc32c', 'crc64nvme', 'sha1', 'sha256')
+
+
+def _format_iso8601(timestamp):
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(timestamp)) + f'.{int(timestamp * 1000) % 1000:03d}Z'
+
+
+def _etag_matches(header, object_hash):
+    # compares the entity tags listed in an If-Match or If-None-Match header weakly, as S3 does
+    if header.strip() == '*':
+        return True
+    for etag in header.split(','):
+        etag = etag.strip()
+        if etag.startswith('W/'):
+            etag = etag[2:]
+        if etag.strip('"') == object_hash:
+            return True
+    return False
+
+
+def is_valid_object_key(object_key):
+    """
+    Returns whether a key sent by a client names an object, rather than resolving to a path
+    outside its bucket, to the internal objects stored under keys starting with a dot or to the
+    files the storage backend keeps beside objects.
+    """
+    if not object_key or object_key.startswith(('.', '/')) or '\\' in object_key or '\0' in object_key:
+        return False
+    if object_key.endswith(RESERVED_SUFFIXES):
+        return False
+    return all(segment not in ('.', '..') for segment in object_key.split('/'))
+
+
+def _parse_http_date(value):
+    # returns None for dates that cannot be parsed, so that the condition is ignored
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
 
 
 class NetworkError(Exception):
@@ -22,16 +77,167 @@ class StorageError(Exception):
     pass
 
 
+class ObjectHTTPServer(HTTPServer):
+    """
+    An HTTP server that serves connections from a bounded pool of worker threads.
+
+    Accepted connections are queued for the workers. Once max_connections connections are
+    queued or in service, new connections are answered with 503 so clients back off instead
+    of piling up behind a slow request.
+
+    Attributes:
+    - max_workers: The number of worker threads serving connections.
+    - max_connections: The maximum number of connections queued or in service at once.
+    - keep_alive_timeout: The time (in seconds) an idle keep-alive connection holds a worker.
+    - context: The state shared by all request handlers, owned by this server.
+    """
+
+    def __init__(self, server_address, RequestHandlerClass, max_workers=32, max_connections=256,
+                 keep_alive_timeout=15, context=None):
+        """
+        Initializes a new instance of the ObjectHTTPServer class and starts its workers.
+
+        Args:
+        - server_address: The (host, port) address to listen on.
+        - RequestHandlerClass: The handler class used for each connection.
+        - max_workers: The number of worker threads serving connections.
+        - max_connections: The maximum number of connections queued or in service at once.
+        - keep_alive_timeout: The time (in seconds) an idle keep-alive connection holds a worker.
+        - context: The state shared by all request handlers. It is started here and shut down
+          by server_close.
+        """
+        if max_connections < max_workers:
+            raise ValueError("max_connections must be at least max_workers")
+        self.request_queue_size = max_connections
+        super().__init__(server_address, RequestHandlerClass)
+        self.max_workers = max_workers
+        self.max_connections = max_connections
+        self.keep_alive_timeout = keep_alive_timeout
+        self.context = context
+        if context is not None:
+            context.startup()
+        self._connection_slots = threading.BoundedSemaphore(max_connections)
+        self._pending_connections = queue.Queue()
+        self._workers = []
+        for i in range(max_workers):
+            worker = threading.Thread(target=self._serve_connections, name=f"object-server-worker-{i}")
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def process_request(self, request, client_address):
+        """
+        Queues an accepted connection for the worker pool, or rejects it when the server is full.
+        """
+        if not self._connection_slots.acquire(blocking=False):
+            self._reject_request(request)
+            return
+        self._pending_connections.put((request, client_address))
+
+    def server_close(self):
+        """
+        Stops the worker threads and closes the listening socket.
+        """
+        super().server_close()
+        for _ in self._workers:
+            self._pending_connections.put(None)
+        for worker in self._workers:
+            worker.join()
+        if self.context is not None:
+            self.context.shutdown()
+
+    def _serve_connections(self):
+        while True:
+            pending_connection = self._pending_connections.get()
+            if pending_connection is None:
+                return
+            request, client_address = pending_connection
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                self._connection_slots.release()
+
+    def _reject_request(self, request):
+        try:
+            request.sendall(b"HTTP/1.1 503 Service Unavailable\r\n"
+                            b"Retry-After: 1\r\n"
+                            b"Content-Length: 0\r\n"
+                            b"Connection: close\r\n\r\n")
+        except OSError:
+            pass
+        finally:
+            self.shutdown_request(request)
+
+
 class ObjectServer(BaseHTTPRequestHandler):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.identity_layer = IdentityLayer('kriya.db')
-        self.object_server_cluster = ObjectServerCluster()
-        self.storage_backend = StorageBackend()
+    # keep connections open between requests; every response must carry a Content-Length
+    protocol_version = 'HTTP/1.1'
+
+    def __init__(self, request, client_address, server):
+        # the handler serves the whole connection from within __init__, so the shared
+        # components must be in place before calling the base class
+        context = server.context
+        self.identity_layer = context.identity_layer
+        self.object_server_cluster = context.object_server_cluster
+        self.storage_backend = context.storage_backend
+        self.multipart_upload_manager = context.multipart_upload_manager
+        self.compression_policy = context.compression_policy
+        self.block_checksum = context.block_checksum
+        self.block_executor = context.block_executor
+        self.rebalancer = context.rebalancer
+        self.unencrypted_buckets = context.unencrypted_buckets
+        self.key_manager = context.key_manager
+        self.key_index = context.key_index
+        self.object_cache = context.object_cache
+        self.object_locks = context.object_locks
+        self.metrics = context.metrics
+        self._request_started = None
+        self._status = None
+        super().__init__(request, client_address, server)
+
+    def setup(self):
+        # bound how long an idle keep-alive connection can hold a worker
+        self.timeout = getattr(self.server, 'keep_alive_timeout', None)
+        super().setup()
+
+    def handle_one_request(self):
+        self._request_started = None
+        self._status = None
+        try:
+            super().handle_one_request()
+        except Exception as e:
+            # an error no handler expected, such as a metadata record that cannot be parsed, still
+            # gets a response if none was started, and the connection is closed either way
+            self.log_error('Failed to handle %s %s: %r', self.command, self.path, e)
+            self.close_connection = True
+            if self._status is None and self._request_started is not None:
+                try:
+                    self.send_error(500, 'Internal Server Error', 'The request could not be handled.')
+                except OSError:
+                    pass
+        finally:
+            if self._request_started is not None:
+                self.metrics.requests_in_flight.dec()
+                self.metrics.observe_request(self.command, self._status,
+                                             time.perf_counter() - self._request_started)
+
+    def parse_request(self):
+        # requests are timed from when their request line was read, so that the time an idle
+        # keep-alive connection waits for the next request is left out
+        self._request_started = time.perf_counter()
+        self.metrics.requests_in_flight.inc()
+        return super().parse_request()
+
+    def send_response(self, code, message=None):
+        self._status = code
+        super().send_response(code, message)
 
     def do_GET(self):
         parsed_url = urlparse(self.path)
-        query_params = parse_qs(parsed_url.query)
+        query_params = parse_qs(parsed_url.query, keep_blank_values=True)
 
         # validate request according to S3 protocol
         if 'X-Amz-Content-Sha256' not in self.headers:
@@ -40,100 +246,455 @@ class ObjectServer(BaseHTTPRequestHandler):
 
         # extract object key from request
         object_key = parsed_url.path.lstrip('/')
+        if not is_valid_object_key(object_key):
+            self.send_error(400, 'Bad Request', 'Invalid object key.')
+            return
 
-        # perform read operation on object
-        object_data = self.storage_backend.read_object(object_key)
-
-        # decrypt the object data using AES-256 with the encryption key
-        encryption_key = self.storage_backend.read_metadata(object_key, 'encryption_key')
-        cipher = AES.new(encryption_key, AES.MODE_CBC)
-        object_data = unpad(cipher.decrypt(object_data), AES.block_size)
+        # list the objects in a bucket
+        bucket, _, key = object_key.partition('/')
+        if bucket and not key:
+            self._list_objects(bucket, query_params)
+            return
 
-        # decompress the object data using GZIP
-        compressed_object_data = self.storage_backend.read_metadata(object_key, 'compressed_data')
-        object_data = gzip.decompress(compressed_object_data)
+        # read the metadata of the object, which also tells whether it exists
+        with self.metrics.stage('metadata'):
+            metadata = self.storage_backend.read_metadata(object_key)
+        if metadata is None:
+            self.send_error(404, 'Not Found', 'The specified key does not exist.')
+            return
 
-        # verify the checksum of the object data using CRC32
-        checksum = zlib.crc32(object_data)
-        stored_checksum = self.storage_backend.read_metadata(object_key, 'checksum')
-        if checksum != stored_checksum:
-            self.send_error(500, 'Internal Server Error', 'Checksum verification failed.')
+        # answer conditional requests from the metadata alone
+        status = self._evaluate_preconditions(metadata)
+        if status == 304:
+            self.send_response(304)
+            self._send_validators(metadata)
+            self.end_headers()
             return
+        if status == 412:
+            self.send_error(412, 'Precondition Failed', 'At least one of the preconditions did not hold.')
+            return
+
+        # objects completed from a multipart upload are stored as a list of parts
+        object_size = metadata.size
+        segments = metadata.parts or [[object_key, object_size]]
+
+        # serve a single byte range if the client asked for one
+        start, end = 0, object_size
+        byte_range = None
+        if 'Range' in self.headers:
+            try:
+                byte_range = parse_range(self.headers['Range'], object_size)
+            except ValueError:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{object_size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+        if byte_range is not None:
+            start, end = byte_range
 
         # return object data to client
-        self.send_response(200)
+        self.send_response(206 if byte_range is not None else 200)
         self.send_header('Content-Type', 'application/octet-stream')
-        self.send_header('Content-Length', str(len(object_data)))
+        self.send_header('Content-Length', str(end - start))
+        self.send_header('Accept-Ranges', 'bytes')
+        self._send_validators(metadata)
+        if byte_range is not None:
+            self.send_header('Content-Range', f'bytes {start}-{end - 1}/{object_size}')
+        else:
+            self._send_checksum(metadata)
         self.end_headers()
-        self.wfile.write(object_data)
+
+        # stream the object data to the client, reading, decrypting, decompressing and
+        # verifying only the blocks that overlap the requested range; small objects are decoded
+        # whole into the read cache instead, so popular ones are decoded once
+        try:
+            if self.object_cache is not None and object_size <= self.object_cache.max_value_size \
+                    and not is_stored_plain(metadata):
+                object_data = self.object_cache.get_or_load(
+                    object_key, metadata.hash,
+                    lambda: b''.join(self._read_segments(object_key, metadata, segments, 0, object_size)))
+                self.wfile.write(memoryview(object_data)[start:end])
+                self.metrics.sent_bytes.inc(amount=end - start)
+            else:
+                for object_chunk in self._read_segments(object_key, metadata, segments, start, end, sendfile=True):
+                    self.wfile.write(object_chunk)
+                    self.metrics.sent_bytes.inc(amount=len(object_chunk))
+        except (ChecksumError, NotEnoughShardsError, InvalidKeyError) as e:
+            # the status line has already been sent, so close the connection to leave the
+            # client with a body shorter than its Content-Length
+            self.log_error('Failed to read object %s: %s', object_key, e)
+            self.close_connection = True
+
+    def _read_segments(self, object_key, metadata, segments, start, end, sendfile=False):
+        # yields the decoded data of a range of an object; with sendfile, segments stored as
+        # plain data are sent to the client directly instead
+        segment_start = 0
+        for segment_key, segment_size in segments:
+            segment_end = segment_start + segment_size
+            if segment_start < end and start < segment_end:
+                segment_metadata = metadata
+                if segment_key != object_key:
+                    with self.metrics.stage('metadata'):
+                        segment_metadata = self.storage_backend.read_metadata(segment_key)
+                if sendfile and is_stored_plain(segment_metadata) and self._send_stored_range(
+                        segment_key, max(start - segment_start, 0), min(end, segment_end) - segment_start):
+                    segment_start = segment_end
+                    continue
+                decoder = ObjectDecoder(self.key_manager.data_key(segment_metadata.encryption_key),
+                                        segment_metadata.nonce,
+                                        segment_metadata.size, segment_metadata.block_size,
+                                        segment_metadata.blocks, segment_metadata.block_codecs,
+                                        segment_metadata.checksum_algorithm, self._block_executor_for(end - start),
+                                        stage_timer=self.metrics.observe_stage)
+                rebuild_block = None
+                if segment_metadata.shard_nodes:
+                    # erasure-coded objects are rebuilt from the shards spread across the cluster, and
+                    # a block failing its checksum from the other combinations of its shards
+                    def read_stored_range(offset, length, segment_key=segment_key,
+                                          segment_metadata=segment_metadata):
+                        return self.object_server_cluster.read_shards(segment_key, segment_metadata, offset, length)
+
+                    def rebuild_block(block_number, decode_block, segment_key=segment_key,
+                                      segment_metadata=segment_metadata):
+                        return self.object_server_cluster.rebuild_block(segment_key, segment_metadata, block_number,
+                                                                        decode_block)
+                else:
+                    def read_stored_range(offset, length, segment_key=segment_key):
+                        return timed_iter(self.storage_backend.read_object_stream(segment_key, CHUNK_SIZE,
+                                                                                  offset, length),
+                                          lambda elapsed: self.metrics.observe_stage('backend_read', elapsed))
+                yield from decoder.decode(read_stored_range, max(start - segment_start, 0),
+                                          min(end, segment_end) - segment_start, rebuild_block)
+            segment_start = segment_end
+
+    def _evaluate_preconditions(self, metadata, write=False):
+        # evaluates the conditional headers in the order of RFC 9110, returning the status to
+        # answer with if one does not hold, or None; metadata is None if the object does not exist
+        if_match = self.headers.get('If-Match')
+        if if_match is not None:
+            if metadata is None or not _etag_matches(if_match, metadata.hash):
+                return 412
+        elif metadata is not None and metadata.last_modified and 'If-Unmodified-Since' in self.headers:
+            since = _parse_http_date(self.headers['If-Unmodified-Since'])
+            if since is not None and int(metadata.last_modified) > since:
+                return 412
+
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            if metadata is not None and _etag_matches(if_none_match, metadata.hash):
+                return 412 if write else 304
+        elif not write and metadata is not None and metadata.last_modified and 'If-Modified-Since' in self.headers:
+            since = _parse_http_date(self.headers['If-Modified-Since'])
+            if since is not None and int(metadata.last_modified) <= since:
+                return 304
+        return None
+
+    def _send_validators(self, metadata):
+        if metadata.hash:
+            self.send_header('ETag', f'"{metadata.hash}"')
+        if metadata.last_modified:
+            self.send_header('Last-Modified', email.utils.formatdate(metadata.last_modified, usegmt=True))
+
+    def _block_executor_for(self, size):
+        # large objects are encoded and decoded several blocks at a time, small ones on the
+        # request thread, where handing blocks to other threads would cost more than it saves
+        return self.block_executor if size >= PARALLEL_MIN_SIZE else None
+
+    def _send_checksum(self, metadata):
+        # the whole-object checksum is only sent to clients asking for it, as in S3; objects
+        # stored without one the client sent still have their SHA-256 hash
+        if self.headers.get('x-amz-checksum-mode', '').upper() != 'ENABLED':
+            return
+        if metadata.checksum:
+            algorithm, _, value = metadata.checksum.partition(':')
+            self.send_header(f'x-amz-checksum-{algorithm}', value)
+        elif metadata.hash and not metadata.parts:
+            self.send_header('x-amz-checksum-sha256', sha256_checksum(metadata.hash))
+
+    def _requested_checksum(self):
+        # returns the whole-object checksum the client sent and the algorithm to verify it with,
+        # or (None, None) if it sent none
+        algorithms = [algorithm for algorithm in S3_CHECKSUM_ALGORITHMS
+                      if f'x-amz-checksum-{algorithm}' in self.headers]
+        if not algorithms:
+            return None, None
+        if len(algorithms) > 1:
+            raise ValueError("Expecting a single x-amz-checksum- header.")
+        return ObjectChecksum(algorithms[0]), self.headers[f'x-amz-checksum-{algorithms[0]}'].strip()
+
+    def _verify_checksum(self, chunks, object_checksum, expected_value, encoder):
+        # passes the body through while computing its checksum, raising once it ends if the
+        # checksum does not match, so the storage backend drops the object instead of storing it
+        for chunk in chunks:
+            object_checksum.update(chunk)
+            yield chunk
+        if object_checksum.value(encoder.hash) != expected_value:
+            raise BadDigestError(f"The {object_checksum.algorithm} checksum does not match.")
+
+    def _list_objects(self, bucket, query_params):
+        # ListObjectsV2; the continuation token is the last key or common prefix listed, encoded
+        prefix = query_params.get('prefix', [''])[0]
+        delimiter = query_params.get('delimiter', [''])[0]
+        start_after = query_params.get('start-after', [''])[0]
+        continuation_token = query_params.get('continuation-token', [None])[0]
+        try:
+            max_keys = min(int(query_params.get('max-keys', [MAX_KEYS])[0]), MAX_KEYS)
+            if max_keys < 0:
+                raise ValueError(max_keys)
+        except ValueError:
+            self.send_error(400, 'Bad Request', 'Invalid max-keys.')
+            return
+        position = start_after
+        if continuation_token is not None:
+            try:
+                # urlsafe_b64decode drops characters outside the alphabet, so a mangled token would
+                # silently restart the listing somewhere else
+                position = base64.b64decode(continuation_token, altchars=b'-_', validate=True).decode('utf-8')
+            except (ValueError, UnicodeError):
+                self._send_s3_error(400, 'InvalidArgument', 'The continuation token provided is incorrect.')
+                return
+        entries, common_prefixes, next_position = self.key_index.list_objects(bucket, prefix, delimiter,
+                                                                              position, max_keys)
+
+        result = ElementTree.Element('ListBucketResult', xmlns=S3_XMLNS)
+        ElementTree.SubElement(result, 'Name').text = bucket
+        ElementTree.SubElement(result, 'Prefix').text = prefix
+        if delimiter:
+            ElementTree.SubElement(result, 'Delimiter').text = delimiter
+        ElementTree.SubElement(result, 'MaxKeys').text = str(max_keys)
+        ElementTree.SubElement(result, 'KeyCount').text = str(len(entries) + len(common_prefixes))
+        ElementTree.SubElement(result, 'IsTruncated').text = 'true' if next_position is not None else 'false'
+        if continuation_token is not None:
+            ElementTree.SubElement(result, 'ContinuationToken').text = continuation_token
+        if next_position is not None:
+            ElementTree.SubElement(result, 'NextContinuationToken').text = \
+                base64.urlsafe_b64encode(next_position.encode('utf-8')).decode('ascii')
+        if start_after:
+            ElementTree.SubElement(result, 'StartAfter').text = start_after
+        for entry in entries:
+            contents = ElementTree.SubElement(result, 'Contents')
+            ElementTree.SubElement(contents, 'Key').text = entry.key
+            ElementTree.SubElement(contents, 'LastModified').text = _format_iso8601(entry.last_modified)
+            ElementTree.SubElement(contents, 'ETag').text = f'"{entry.hash}"'
+            ElementTree.SubElement(contents, 'Size').text = str(entry.size)
+            ElementTree.SubElement(contents, 'StorageClass').text = 'STANDARD'
+        for common_prefix in common_prefixes:
+            ElementTree.SubElement(ElementTree.SubElement(result, 'CommonPrefixes'), 'Prefix').text = common_prefix
+        self._send_xml(200, result)
+
+    def _send_stored_range(self, object_key, start, end):
+        # objects stored as plain data are copied from the file holding them to the socket by the
+        # kernel, without passing through Python; block checksums are not verified on this path,
+        # which is left to scrubbing
+        source = self.storage_backend.open_object_file(object_key)
+        if source is None:
+            return False
+        f, offset, size = source
+        with f:
+            self.wfile.flush()
+            sent = self.connection.sendfile(f, offset + start, min(end, size) - start)
+        self.metrics.sent_bytes.inc(amount=sent)
+        if sent != end - start:
+            raise ChecksumError(f"Object {object_key} is shorter than its metadata.")
+        return True
 
     def do_PUT(self):
+        # conditional writes of the same object are serialized, so that the object cannot change
+        # between checking the preconditions and writing it
+        if 'If-Match' in self.headers or 'If-None-Match' in self.headers:
+            with self.object_locks.hold(urlparse(self.path).path.lstrip('/')):
+                self._put_object()
+        else:
+            self._put_object()
+
+    def _put_object(self):
         parsed_url = urlparse(self.path)
-        query_params = parse_qs(parsed_url.query)
+        query_params = parse_qs(parsed_url.query, keep_blank_values=True)
 
         # validate request according to S3 protocol
         if 'X-Amz-Content-Sha256' not in self.headers:
             self.send_error(400, 'Bad Request', 'Missing required header: X-Amz-Content-Sha256')
             return
+        if 'Content-Length' not in self.headers:
+            self.send_error(411, 'Length Required', 'Missing required header: Content-Length')
+            self.close_connection = True
+            return
+        try:
+            content_length = int(self.headers['Content-Length'])
+        except ValueError:
+            content_length = -1
+        if content_length < 0:
+            # the body cannot be told apart from the next request
+            self.send_error(400, 'Bad Request', 'Invalid Content-Length header.')
+            self.close_connection = True
+            return
 
         # extract object key from request
         object_key = parsed_url.path.lstrip('/')
+        if not is_valid_object_key(object_key):
+            self.send_error(400, 'Bad Request', 'Invalid object key.')
+            return
 
         # extract access key and secret key from request headers
         access_key = self.headers.get('X-Amz-Access-Key')
         secret_key = self.headers.get('X-Amz-Secret-Key')
 
         # verify access key and secret key using identity layer
-        if not self.identity_layer.verify_access_key(access_key, secret_key):
+        with self.metrics.stage('auth'):
+            authorized = self.identity_layer.verify_access_key(access_key, secret_key)
+        if not authorized:
             self.send_error(403, 'Forbidden', 'Invalid access key or secret key.')
             return
 
-        # read object data from request body
-        object_data = self.rfile.read(int(self.headers['Content-Length']))
-
-        # retry write operation if it fails due to network or storage errors
-        max_retries = 3
-        retry_count = 0
-        while retry_count < max_retries:
+        # the parts of a multipart upload are stored as objects of their own
+        upload_id = query_params.get('uploadId', [None])[0]
+        if upload_id is not None:
             try:
-                # generate a random encryption key for each object
-                encryption_key = os.urandom(32)
+                self.multipart_upload_manager.get_object_key(upload_id)
+                part_number = int(query_params['partNumber'][0])
+                storage_key = self.multipart_upload_manager.part_key(upload_id, part_number)
+            except NoSuchUploadError:
+                self.send_error(404, 'Not Found', 'The specified upload does not exist.')
+                return
+            except (KeyError, ValueError, InvalidPartError):
+                self.send_error(400, 'Bad Request', 'Invalid part number.')
+                return
+        else:
+            storage_key = object_key
+            with self.metrics.stage('metadata'):
+                previous_metadata = self.storage_backend.read_metadata(object_key)
+            if self._evaluate_preconditions(previous_metadata, write=True) is not None:
+                # the request body is left unread, so the connection cannot be reused
+                self.send_error(412, 'Precondition Failed', 'At least one of the preconditions did not hold.')
+                self.close_connection = True
+                return
 
-                # encrypt the object data using AES-256 with the encryption key
-                cipher = AES.new(encryption_key, AES.MODE_CBC)
-                object_data = cipher.encrypt(pad(object_data, AES.block_size))
+        # the client may send a checksum of the whole object, to have it verified and stored
+        try:
+            object_checksum, expected_checksum = self._requested_checksum()
+        except ValueError as e:
+            self.send_error(400, 'Bad Request', str(e))
+            self.close_connection = True
+            return
 
-                # compress the object data using GZIP
-                compressed_object_data = gzip.compress(object_data)
+        # generate a random data key and nonce for each object, unless its bucket is unencrypted;
+        # only the data key wrapped with the master key is stored
+        encryption_key = wrapped_key = b''
+        if object_key.partition('/')[0] not in self.unencrypted_buckets:
+            encryption_key, wrapped_key = self.key_manager.generate_data_key()
+        nonce = os.urandom(8)
 
-                # store the compressed object data as metadata of the object
-                self.storage_backend.write_metadata(object_key, 'compressed_data', compressed_object_data)
+        # stream the object data from the request body to the storage backend, compressing,
+        # encrypting and checksumming it one block at a time with the codec of its bucket
+        encoder = ObjectEncoder(encryption_key, nonce, codec=self.compression_policy.codec_for(object_key),
+                                min_ratio=self.compression_policy.min_ratio, checksum=self.block_checksum,
+                                executor=self._block_executor_for(content_length),
+                                stage_timer=self.metrics.observe_stage)
+        try:
+            object_chunks = timed_iter(self._read_body(content_length),
+                                       lambda elapsed: self.metrics.observe_stage('receive', elapsed))
+            if object_checksum is not None:
+                object_chunks = self._verify_checksum(object_chunks, object_checksum, expected_checksum, encoder)
+            # the time spent receiving and encoding blocks is observed as stages of its own, so
+            # it is left out of the time spent writing them
+            encoding_time = []
+            started = time.perf_counter()
+            self.storage_backend.write_object_stream(storage_key, timed_iter(encoder.encode(object_chunks),
+                                                                             encoding_time.append))
+            self.metrics.observe_stage('backend_write', time.perf_counter() - started - sum(encoding_time))
+        except BadDigestError as e:
+            self.send_error(400, 'Bad Digest', str(e))
+            return
+        except (NotADirectoryError, IsADirectoryError, FileExistsError) as e:
+            # the key names a directory of other keys, or runs through the file of another key
+            self.log_error('Failed to write object %s: %s', storage_key, e)
+            self.send_error(409, 'Conflict', 'The object key conflicts with the key of an existing object.')
+            self.close_connection = True
+            return
+        except (NetworkError, StorageError, OSError) as e:
+            # the request body has been consumed, so the write cannot be retried
+            self.log_error('Failed to write object %s: %s', storage_key, e)
+            self.send_error(500, 'Internal Server Error', 'Failed to write object.')
+            self.close_connection = True
+            return
+
+        # objects in erasure-coded buckets are spread across the cluster as shards, but not the
+        # parts of multipart uploads, which are only ever read locally while completing the upload
+        erasure_coded = upload_id is None and self.object_server_cluster.is_erasure_coded(object_key)
+        shard_nodes = None
 
-                # store the encrypted object data and the encryption key as metadata of the object
-                self.storage_backend.write_object(object_key, object_data)
-                self.storage_backend.write_metadata(object_key, 'encryption_key', encryption_key)
+        # retry the rest of the write operation if it fails due to network or storage errors
+        max_retries = 3
+        retry_count = 0
+        while retry_count < max_retries:
+            try:
+                # store the size and SHA-256 hash of the object data, the wrapped data key and nonce,
+                # and the index of its blocks, with their stored lengths, checksums and codecs, as
+                # the metadata record of the object
+                metadata = ObjectMetadata(
+                    size=encoder.size,
+                    hash=encoder.hash,
+                    encryption_key=wrapped_key,
+                    nonce=nonce,
+                    block_size=encoder.block_size,
+                    blocks=encoder.blocks,
+                    block_codecs=bytes(encoder.block_codecs),
+                    last_modified=time.time(),
+                    checksum_algorithm=encoder.checksum.algorithm_id,
+                    checksum=(f'{object_checksum.algorithm}:{expected_checksum}'
+                              if object_checksum is not None else ''))
+                if erasure_coded:
+                    # the shards are written only once, as the full local copy is dropped afterwards
+                    if shard_nodes is None:
+                        with self.metrics.stage('replicate'):
+                            shard_nodes = self.object_server_cluster.write_shards(
+                                storage_key, metadata,
+                                lambda offset, length: self.storage_backend.read_object_stream(
+                                    storage_key, CHUNK_SIZE, offset, length))
+                        if shard_nodes is None:
+                            raise NetworkError('Failed to write enough shards of the object.')
+                    metadata.data_shards = self.object_server_cluster.erasure_coder.data_shards
+                    metadata.parity_shards = self.object_server_cluster.erasure_coder.parity_shards
+                    metadata.shard_nodes = shard_nodes
+                with self.metrics.stage('metadata'):
+                    self.storage_backend.write_metadata(storage_key, metadata)
+                if self.object_cache is not None:
+                    self.object_cache.invalidate(storage_key)
+                if erasure_coded:
+                    self.storage_backend.write_object(storage_key, b'')
 
-                # compute the checksum of the object data using CRC32
-                checksum = zlib.crc32(object_data)
+                # replicate object to other object servers, waiting only for the write quorum
+                with self.metrics.stage('replicate'):
+                    replicated = self.object_server_cluster.replicate_object(
+                        storage_key, lambda: self.storage_backend.read_object_stream(storage_key, CHUNK_SIZE),
+                        metadata)
+                if not replicated:
+                    raise NetworkError('Failed to replicate object to a write quorum.')
 
-                # store the checksum as metadata of the object
-                self.storage_backend.write_metadata(object_key, 'checksum', checksum)
+                if upload_id is not None:
+                    # record the part so the upload can be completed
+                    self.multipart_upload_manager.add_part(upload_id, part_number)
+                else:
+                    self.key_index.put(object_key, metadata.size, metadata.hash, metadata.last_modified)
+                if upload_id is None and previous_metadata is not None:
+                    # the object may replace one assembled from parts, which are not needed anymore
+                    for part_key, _ in previous_metadata.parts:
+                        self.storage_backend.delete_object(part_key)
+                    # or one spread across the cluster as shards, of which only the overwritten ones are current
+                    if previous_metadata.shard_nodes:
+                        self.object_server_cluster.delete_shards(object_key, previous_metadata, shard_nodes or ())
 
                 # return success response to client
                 self.send_response(200)
+                self._send_validators(metadata)
+                if object_checksum is not None:
+                    self.send_header(f'x-amz-checksum-{object_checksum.algorithm}', expected_checksum)
+                self.send_header('Content-Length', '0')
                 self.end_headers()
 
-                # hash object data using SHA-256
-                object_hash = hashlib.sha256(object_data).hexdigest()
-
-                # store hash value as metadata of object
-                self.storage_backend.write_metadata(object_key, 'hash', object_hash)
-
-                # replicate object to other object servers
-                self.object_server_cluster.replicate_object(object_key, object_data)
-
-                # rebalance objects among object servers
-                self.object_server_cluster.rebalance_objects()
+                # let the rebalancer check the object reached all of its owners
+                self.rebalancer.add_hint(storage_key)
 
                 return
             except (NetworkError, StorageError) as e:
@@ -147,7 +708,7 @@ class ObjectServer(BaseHTTPRequestHandler):
 
     def do_DELETE(self):
         parsed_url = urlparse(self.path)
-        query_params = parse_qs(parsed_url.query)
+        query_params = parse_qs(parsed_url.query, keep_blank_values=True)
 
         # validate request according to S3 protocol
         if 'X-Amz-Content-Sha256' not in self.headers:
@@ -156,9 +717,42 @@ class ObjectServer(BaseHTTPRequestHandler):
 
         # extract object key from request
         object_key = parsed_url.path.lstrip('/')
+        if not is_valid_object_key(object_key):
+            self.send_error(400, 'Bad Request', 'Invalid object key.')
+            return
+
+        # extract access key and secret key from request headers
+        access_key = self.headers.get('X-Amz-Access-Key')
+        secret_key = self.headers.get('X-Amz-Secret-Key')
+
+        # verify access key and secret key using identity layer
+        with self.metrics.stage('auth'):
+            authorized = self.identity_layer.verify_access_key(access_key, secret_key)
+        if not authorized:
+            self.send_error(403, 'Forbidden', 'Invalid access key or secret key.')
+            return
 
-        # perform delete operation on object
+        # abort a multipart upload, deleting the parts uploaded so far
+        if 'uploadId' in query_params:
+            try:
+                self.multipart_upload_manager.abort(query_params['uploadId'][0])
+            except NoSuchUploadError:
+                self.send_error(404, 'Not Found', 'The specified upload does not exist.')
+                return
+            self.send_response(204)
+            self.end_headers()
+            return
+
+        # perform delete operation on object, including the parts it was assembled from
+        metadata = self.storage_backend.read_metadata(object_key)
+        self.key_index.delete(object_key)
         self.storage_backend.delete_object(object_key)
+        if self.object_cache is not None:
+            self.object_cache.invalidate(object_key)
+        for part_key, _ in metadata.parts if metadata is not None else []:
+            self.storage_backend.delete_object(part_key)
+        if metadata is not None and metadata.shard_nodes:
+            self.object_server_cluster.delete_shards(object_key, metadata)
 
         # return success response to client
         self.send_response(204)
@@ -169,7 +763,7 @@ class ObjectServer(BaseHTTPRequestHandler):
 
     def do_HEAD(self):
         parsed_url = urlparse(self.path)
-        query_params = parse_qs(parsed_url.query)
+        query_params = parse_qs(parsed_url.query, keep_blank_values=True)
 
         # validate request according to S3 protocol
         if 'X-Amz-Content-Sha256' not in self.headers:
@@ -178,21 +772,36 @@ class ObjectServer(BaseHTTPRequestHandler):
 
         # extract object key from request
         object_key = parsed_url.path.lstrip('/')
+        if not is_valid_object_key(object_key):
+            self.send_error(400, 'Bad Request', 'Invalid object key.')
+            return
 
-        # check if object exists
-        if not self.storage_backend.object_exists(object_key):
+        # read the metadata of the object, which also tells whether it exists
+        with self.metrics.stage('metadata'):
+            metadata = self.storage_backend.read_metadata(object_key)
+        if metadata is None:
             self.send_error(404, 'Not Found', 'The specified key does not exist.')
             return
 
-        # return success response to client
-        self.send_response(200)
-        self.send_header('Content-Type', 'application/octet-stream')
-        self.send_header('Content-Length', str(self.storage_backend.get_object_size(object_key)))
+        status = self._evaluate_preconditions(metadata)
+        if status == 412:
+            self.send_error(412, 'Precondition Failed', 'At least one of the preconditions did not hold.')
+            return
+
+        # return success response to client, with the size of the object data rather than of
+        # what is stored, which is compressed, encrypted or split into parts or shards
+        self.send_response(status or 200)
+        if status is None:
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(metadata.size))
+            self.send_header('Accept-Ranges', 'bytes')
+            self._send_checksum(metadata)
+        self._send_validators(metadata)
         self.end_headers()
 
     def do_POST(self):
         parsed_url = urlparse(self.path)
-        query_params = parse_qs(parsed_url.query)
+        query_params = parse_qs(parsed_url.query, keep_blank_values=True)
 
         # validate request according to S3 protocol
         if 'X-Amz-Content-Sha256' not in self.headers:
@@ -201,33 +810,252 @@ class ObjectServer(BaseHTTPRequestHandler):
 
         # extract object key from request
         object_key = parsed_url.path.lstrip('/')
+        if not is_valid_object_key(object_key):
+            self.send_error(400, 'Bad Request', 'Invalid object key.')
+            return
 
         # extract access key and secret key from request headers
         access_key = self.headers.get('X-Amz-Access-Key')
         secret_key = self.headers.get('X-Amz-Secret-Key')
 
         # verify access key and secret key using identity layer
-        if not self.identity_layer.verify_access_key(access_key, secret_key):
+        with self.metrics.stage('auth'):
+            authorized = self.identity_layer.verify_access_key(access_key, secret_key)
+        if not authorized:
             self.send_error(403, 'Forbidden', 'Invalid access key or secret key.')
             return
 
-        # perform create operation on object
-        self.storage_backend.create_object(object_key)
+        # start a multipart upload
+        if 'uploads' in query_params:
+            upload_id = self.multipart_upload_manager.initiate(object_key)
+            bucket, _, key = object_key.partition('/')
+            result = ElementTree.Element('InitiateMultipartUploadResult', xmlns=S3_XMLNS)
+            ElementTree.SubElement(result, 'Bucket').text = bucket
+            ElementTree.SubElement(result, 'Key').text = key
+            ElementTree.SubElement(result, 'UploadId').text = upload_id
+            self._send_xml(200, result)
+            return
 
-        # return success response to client
-        self.send_response(200)
+        # delete the objects listed in the request body
+        if 'delete' in query_params:
+            self._delete_objects(object_key)
+            return
+
+        # complete a multipart upload from the parts listed in the request body
+        if 'uploadId' in query_params:
+            try:
+                request = ElementTree.fromstring(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                parts = [(int(part.findtext(f'{{{S3_XMLNS}}}PartNumber', part.findtext('PartNumber'))),
+                          part.findtext(f'{{{S3_XMLNS}}}ETag', part.findtext('ETag')))
+                         for part in request if part.tag.endswith('Part')]
+                previous_metadata = self.storage_backend.read_metadata(
+                    self.multipart_upload_manager.get_object_key(query_params['uploadId'][0]))
+                object_key = self.multipart_upload_manager.complete(query_params['uploadId'][0], parts)
+            except NoSuchUploadError:
+                self.send_error(404, 'Not Found', 'The specified upload does not exist.')
+                return
+            except (ElementTree.ParseError, TypeError, ValueError, InvalidPartError) as e:
+                self.send_error(400, 'Bad Request', str(e))
+                return
+            metadata = self.storage_backend.read_metadata(object_key)
+            self.key_index.put(object_key, metadata.size, metadata.hash, metadata.last_modified)
+            if self.object_cache is not None:
+                self.object_cache.invalidate(object_key)
+            if previous_metadata is not None:
+                # the object may replace one assembled from parts, or spread across the cluster
+                # as shards, which are not needed anymore
+                for part_key, _ in previous_metadata.parts:
+                    self.storage_backend.delete_object(part_key)
+                if previous_metadata.shard_nodes:
+                    self.object_server_cluster.delete_shards(object_key, previous_metadata)
+            bucket, _, key = object_key.partition('/')
+            result = ElementTree.Element('CompleteMultipartUploadResult', xmlns=S3_XMLNS)
+            ElementTree.SubElement(result, 'Bucket').text = bucket
+            ElementTree.SubElement(result, 'Key').text = key
+            ElementTree.SubElement(result, 'ETag').text = f'"{metadata.hash}"'
+            self._send_xml(200, result)
+
+            # the completed object has not been replicated yet
+            self.rebalancer.add_hint(object_key)
+            return
+
+        # objects are written with PUT; a POST must start, complete or abort a multipart upload,
+        # or delete objects
+        self.send_error(400, 'Bad Request', 'Unsupported POST request.')
+
+    def _delete_objects(self, bucket):
+        # S3 multi-object delete: the objects are deleted from local storage as one batch, and
+        # then from every other object server as one batch per server, all concurrently
+        try:
+            request = ElementTree.fromstring(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        except (ElementTree.ParseError, ValueError):
+            self._send_s3_error(400, 'MalformedXML', 'The XML you provided was not well-formed.')
+            return
+        object_keys = []
+        for element in request:
+            if element.tag.endswith('Object'):
+                key = element.findtext(f'{{{S3_XMLNS}}}Key', element.findtext('Key'))
+                if key is None:
+                    self._send_s3_error(400, 'MalformedXML', 'Every Object element must have a Key.')
+                    return
+                object_keys.append(bucket + '/' + key)
+        quiet = request.findtext(f'{{{S3_XMLNS}}}Quiet', request.findtext('Quiet', 'false')).strip() == 'true'
+        if not object_keys or len(object_keys) > MAX_KEYS:
+            self.send_error(400, 'Bad Request', f'Between 1 and {MAX_KEYS} keys must be deleted at once.')
+            return
+        requested_keys = object_keys
+        object_keys = [object_key for object_key in requested_keys if is_valid_object_key(object_key)]
+
+        # objects assembled from parts or spread across the cluster as shards take those along
+        stored_keys = list(object_keys)
+        erasure_coded_objects = []
+        for object_key in object_keys:
+            metadata = self.storage_backend.read_metadata(object_key)
+            if metadata is not None:
+                stored_keys.extend(part_key for part_key, _ in metadata.parts)
+                if metadata.shard_nodes:
+                    erasure_coded_objects.append((object_key, metadata))
+        try:
+            errors = self.storage_backend.delete_objects(stored_keys)
+        except OSError as e:
+            errors = dict.fromkeys(stored_keys, e)
+        deleted_keys = [object_key for object_key in object_keys if object_key not in errors]
+        self.key_index.delete_many(deleted_keys)
+        if self.object_cache is not None:
+            for object_key in deleted_keys:
+                self.object_cache.invalidate(object_key)
+        self.object_server_cluster.delete_objects(
+            deleted_keys, [(object_key, metadata) for object_key, metadata in erasure_coded_objects
+                           if object_key not in errors])
+
+        result = ElementTree.Element('DeleteResult', xmlns=S3_XMLNS)
+        for object_key in requested_keys:
+            key = object_key.partition('/')[2]
+            if not is_valid_object_key(object_key):
+                error = ElementTree.SubElement(result, 'Error')
+                ElementTree.SubElement(error, 'Key').text = key
+                ElementTree.SubElement(error, 'Code').text = 'InvalidArgument'
+                ElementTree.SubElement(error, 'Message').text = 'Invalid object key.'
+            elif object_key in errors:
+                error = ElementTree.SubElement(result, 'Error')
+                ElementTree.SubElement(error, 'Key').text = key
+                ElementTree.SubElement(error, 'Code').text = 'InternalError'
+                ElementTree.SubElement(error, 'Message').text = str(errors[object_key])
+            elif not quiet:
+                ElementTree.SubElement(ElementTree.SubElement(result, 'Deleted'), 'Key').text = key
+        self._send_xml(200, result)
+
+    def _send_s3_error(self, code, error_code, message):
+        # sends an S3 error response, whose body names the error for S3 clients
+        error = ElementTree.Element('Error')
+        ElementTree.SubElement(error, 'Code').text = error_code
+        ElementTree.SubElement(error, 'Message').text = message
+        self._send_xml(code, error)
+
+    def _send_xml(self, code, element):
+        body = ElementTree.tostring(element, encoding='utf-8', xml_declaration=True)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('Content-Length', str(len(body)))
         self.end_headers()
+        self.wfile.write(body)
 
-        # rebalance objects among object servers
-        self.object_server_cluster.rebalance_objects()
+    def _read_body(self, content_length):
+        # read the request body in chunks so it is never held in memory as a whole
+        remaining = content_length
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, CHUNK_SIZE))
+            if not chunk:
+                raise NetworkError('Client closed the connection before sending the whole body.')
+            remaining -= len(chunk)
+            self.metrics.received_bytes.inc(amount=len(chunk))
+            yield chunk
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Kriya object server')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--max-workers', type=int, default=32)
+    parser.add_argument('--max-connections', type=int, default=256)
+    parser.add_argument('--keep-alive-timeout', type=float, default=15)
+    parser.add_argument('--db-file', default='kriya.db')
+    parser.add_argument('--storage-path', default='data')
+    parser.add_argument('--storage-engine', default='disk', choices=['disk', 'packed'],
+                        help='store every object in a file of its own, or pack small objects into segment files')
+    parser.add_argument('--default-codec', default='zlib', choices=sorted(CODECS))
+    parser.add_argument('--bucket-codec', action='append', default=[], metavar='BUCKET=CODEC',
+                        help='compress objects in BUCKET with CODEC instead of the default codec')
+    parser.add_argument('--min-compression-ratio', type=float, default=0.9)
+    parser.add_argument('--block-workers', type=int,
+                        help='the number of threads large objects are compressed and encrypted on, '
+                             'or 0 to use the request threads; defaults to one per CPU')
+    parser.add_argument('--block-checksum', default='crc32', choices=sorted(CHECKSUMS),
+                        help='the algorithm to checksum every block of object data with')
+    parser.add_argument('--read-cache-size', type=int, default=256 * 1024 * 1024,
+                        help='the most bytes of decoded objects cached in memory, or 0 to not cache objects')
+    parser.add_argument('--read-cache-max-object-size', type=int,
+                        help='the largest object cached; defaults to an eighth of the read cache size')
+    parser.add_argument('--rebalance-bandwidth', type=int, default=50 * 1024 * 1024,
+                        help='the most bytes per second copied when rebalancing objects')
+    parser.add_argument('--scrub-bandwidth', type=int, default=10 * 1024 * 1024,
+                        help='the most bytes per second read when verifying stored objects against their checksums')
+    parser.add_argument('--scrub-interval', type=float, default=7 * 24 * 60 * 60,
+                        help='the interval in seconds at which every stored object is verified')
+    parser.add_argument('--scrub-poll-interval', type=float, default=60,
+                        help='the time in seconds the scrubber waits when idle before checking for work again')
+    parser.add_argument('--erasure-coded-bucket', action='append', default=[], metavar='BUCKET',
+                        help='store objects in BUCKET as erasure-coded shards instead of full replicas')
+    parser.add_argument('--data-shards', type=int, default=4)
+    parser.add_argument('--parity-shards', type=int, default=2)
+    parser.add_argument('--unencrypted-bucket', action='append', default=[], metavar='BUCKET',
+                        help='store objects in BUCKET unencrypted, serving them with sendfile if they are not compressed')
+    parser.add_argument('--keyfile',
+                        help='the file holding the master key object keys are wrapped with, created if it does not exist; '
+                             'every object server of a cluster must use the same key; defaults to a file in the storage path')
+    parser.add_argument('--gossip-port', type=int,
+                        help='the port to detect failures of other object servers on (UDP) and to serve them objects on (TCP), '
+                             'to object servers sharing the master key only; the traffic is not encrypted, so the host '
+                             'should be on a private network')
+    parser.add_argument('--seed', action='append', default=[], metavar='HOST:PORT',
+                        help='the gossip address of an object server to join the cluster through')
+    parser.add_argument('--metrics-port', type=int,
+                        help='the port to serve metrics on at /metrics, in the Prometheus text format')
+    args = parser.parse_args()
+
+    # create the state shared by all request handlers
+    compression_policy = CompressionPolicy(default_codec=args.default_codec,
+                                           bucket_codecs=dict(bucket_codec.split('=', 1)
+                                                              for bucket_codec in args.bucket_codec),
+                                           min_ratio=args.min_compression_ratio)
+    context = ServerContext(db_file=args.db_file, storage_path=args.storage_path, storage_engine=args.storage_engine,
+                            compression_policy=compression_policy, node_id=f'{args.host}:{args.port}',
+                            block_checksum=args.block_checksum, block_workers=args.block_workers,
+                            read_cache_size=args.read_cache_size,
+                            read_cache_max_object_size=args.read_cache_max_object_size,
+                            rebalance_bandwidth=args.rebalance_bandwidth,
+                            scrub_bandwidth=args.scrub_bandwidth, scrub_interval=args.scrub_interval,
+                            scrub_poll_interval=args.scrub_poll_interval,
+                            erasure_coded_buckets=args.erasure_coded_bucket,
+                            erasure_coder=ErasureCoder(args.data_shards, args.parity_shards),
+                            unencrypted_buckets=args.unencrypted_bucket, keyfile=args.keyfile,
+                            gossip_address=(args.host, args.gossip_port) if args.gossip_port is not None else None,
+                            metrics_address=(args.host, args.metrics_port) if args.metrics_port is not None else None,
+                            seed_addresses=[(host, int(port)) for host, _, port in
+                                            (seed.rpartition(':') for seed in args.seed)])
+
     # create object server instance
-    object_server = HTTPServer(('localhost', 8080), ObjectServer)
+    object_server = ObjectHTTPServer((args.host, args.port), ObjectServer,
+                                     max_workers=args.max_workers,
+                                     max_connections=args.max_connections,
+                                     keep_alive_timeout=args.keep_alive_timeout,
+                                     context=context)
 
     # start object server
-    object_server.serve_forever()
+    try:
+        object_server.serve_forever()
+    finally:
+        object_server.server_close()
 
 
 if __name__ == '__main__':
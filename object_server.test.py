@@ -1,9 +1,25 @@
+import base64
+import hashlib
+import http.client
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
 import unittest
-from http.server import HTTPServer
+import zlib
+from http.server import BaseHTTPRequestHandler, HTTPServer
 from io import BytesIO as IO
+from unittest import mock
 from unittest.mock import MagicMock
+from xml.etree import ElementTree
 
-from object_server import ObjectServer
+from erasure_coding import shard_key
+from key_management import WRAPPED_KEY_SIZE
+from object_server import S3_XMLNS, ObjectHTTPServer, ObjectServer
+from server_context import ServerContext
+from storage_backend import DiskStorageBackend
 
 
 class MockRequest(IO):
@@ -163,25 +179,21 @@ class TestObjectServer(unittest.TestCase):
         self.object_server.headers = {'X-Amz-Content-Sha256': 'valid-sha256', 'X-Amz-Access-Key': 'test-access-key',
                                       'X-Amz-Secret-Key': 'test-secret-key'}
         self.object_server.path = '/test-object'
-        self.mock_storage_backend.create_object.return_value = True
         self.object_server.identity_layer.verify_access_key.return_value = True
 
         # Act
         self.object_server.do_POST()
 
         # Assert
-        self.mock_storage_backend.create_object.assert_called_once_with('test-object')
         self.object_server.identity_layer.verify_access_key.assert_called_once_with('test-access-key',
                                                                                     'test-secret-key')
-        self.object_server.send_response.assert_called_once_with(200)
-        self.object_server.end_headers.assert_called_once()
+        self.object_server.send_error.assert_called_once_with(400, 'Bad Request', 'Unsupported POST request.')
 
     def test_do_POST_with_invalid_access_key(self):
         # Arrange
         self.object_server.headers = {'X-Amz-Content-Sha256': 'valid-sha256', 'X-Amz-Access-Key': 'test-access-key',
                                       'X-Amz-Secret-Key': 'test-secret-key'}
         self.object_server.path = '/test-object'
-        self.mock_storage_backend.create_object.return_value = True
         self.object_server.identity_layer.verify_access_key.return_value = False
 
         # Act
@@ -191,3 +203,565 @@ class TestObjectServer(unittest.TestCase):
         self.object_server.identity_layer.verify_access_key.assert_called_once_with('test-access-key',
                                                                                     'test-secret-key')
         self.object_server.send_error.assert_called_once_with(403, 'Forbidden', 'Invalid access key or secret key.')
+
+
+class BlockingHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    release = threading.Event()
+
+    def do_GET(self):
+        if self.path == '/slow':
+            self.release.wait(5)
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+class TestObjectHTTPServer(unittest.TestCase):
+    def start_server(self, **kwargs):
+        BlockingHandler.release = threading.Event()
+        server = ObjectHTTPServer(('localhost', 0), BlockingHandler, **kwargs)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.addCleanup(BlockingHandler.release.set)
+        return server
+
+    def request(self, server, path):
+        conn = http.client.HTTPConnection('localhost', server.server_address[1], timeout=5)
+        self.addCleanup(conn.close)
+        conn.request('GET', path)
+        return conn
+
+    def test_slow_request_does_not_block_other_clients(self):
+        server = self.start_server(max_workers=2, max_connections=4)
+        self.request(server, '/slow')
+
+        response = self.request(server, '/fast').getresponse()
+
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.read(), b'ok')
+
+    def test_keep_alive_reuses_connection(self):
+        server = self.start_server(max_workers=1, max_connections=1)
+        conn = http.client.HTTPConnection('localhost', server.server_address[1], timeout=5)
+        self.addCleanup(conn.close)
+
+        for _ in range(3):
+            conn.request('GET', '/fast')
+            response = conn.getresponse()
+            self.assertEqual(response.read(), b'ok')
+
+    def test_rejects_connections_when_full(self):
+        server = self.start_server(max_workers=1, max_connections=1)
+        self.request(server, '/slow')
+
+        response = self.request(server, '/fast').getresponse()
+
+        self.assertEqual(response.status, 503)
+        self.assertEqual(response.getheader('Retry-After'), '1')
+
+    def test_max_connections_below_max_workers(self):
+        with self.assertRaises(ValueError):
+            ObjectHTTPServer(('localhost', 0), BlockingHandler, max_workers=4, max_connections=2)
+
+
+class TestObjectServerContext(unittest.TestCase):
+    def setUp(self):
+        storage_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, storage_path)
+        self.context = ServerContext(db_file=':memory:', storage_path=storage_path)
+        self.server = ObjectHTTPServer(('localhost', 0), ObjectServer, max_workers=2, max_connections=2,
+                                       context=self.context)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def test_server_starts_and_shuts_down_context(self):
+        self.assertTrue(self.context.started)
+        self.server.shutdown()
+        self.server.server_close()
+        self.assertFalse(self.context.started)
+
+    def test_handlers_share_context(self):
+        object_keys = []
+        self.context.storage_backend.read_metadata = lambda object_key: object_keys.append(object_key)
+        conn = http.client.HTTPConnection('localhost', self.server.server_address[1], timeout=5)
+        self.addCleanup(conn.close)
+
+        for object_key in ('a', 'b'):
+            conn.request('HEAD', '/' + object_key, headers={'X-Amz-Content-Sha256': 'UNSIGNED-PAYLOAD'})
+            response = conn.getresponse()
+            response.read()
+            self.assertEqual(response.status, 404)
+
+        self.assertEqual(object_keys, ['a', 'b'])
+
+
+class TestObjectServerRequests(unittest.TestCase):
+    storage_engine = 'disk'
+
+    def setUp(self):
+        self.storage_path = storage_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, storage_path)
+        db_file = os.path.join(storage_path, 'kriya.db')
+        conn = sqlite3.connect(db_file)
+        conn.execute('CREATE TABLE access_keys (access_key TEXT, secret_key TEXT)')
+        conn.execute("INSERT INTO access_keys VALUES ('test-access-key', 'test-secret-key')")
+        conn.commit()
+        conn.close()
+        self.context = ServerContext(db_file=db_file, storage_path=os.path.join(storage_path, 'data'),
+                                     storage_engine=self.storage_engine)
+        self.server = ObjectHTTPServer(('localhost', 0), ObjectServer, max_workers=2, max_connections=4,
+                                       context=self.context)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def request(self, method, path, body=None, headers=None):
+        conn = http.client.HTTPConnection('localhost', self.server.server_address[1], timeout=10)
+        request_headers = {'X-Amz-Content-Sha256': 'UNSIGNED-PAYLOAD', 'X-Amz-Access-Key': 'test-access-key',
+                           'X-Amz-Secret-Key': 'test-secret-key'}
+        request_headers.update(headers or {})
+        conn.request(method, path, body=body, headers=request_headers)
+        try:
+            response = conn.getresponse()
+            return response, response.read()
+        finally:
+            conn.close()
+
+    def test_put_then_get_round_trip(self):
+        object_data = os.urandom(1024) * 3000
+
+        response, _ = self.request('PUT', '/bucket/large-object', body=object_data)
+        self.assertEqual(response.status, 200)
+
+        response, body = self.request('GET', '/bucket/large-object')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader('Content-Length'), str(len(object_data)))
+        self.assertEqual(body, object_data)
+
+    def test_put_with_invalid_secret_key(self):
+        response, _ = self.request('PUT', '/bucket/object', body=b'data', headers={'X-Amz-Secret-Key': 'wrong'})
+        self.assertEqual(response.status, 403)
+
+    def test_get_missing_object(self):
+        response, _ = self.request('GET', '/bucket/missing')
+        self.assertEqual(response.status, 404)
+
+    def test_get_corrupted_object_is_truncated(self):
+        self.request('PUT', '/bucket/object', body=os.urandom(3 * 1024 * 1024))
+        metadata = self.context.storage_backend.read_metadata('bucket/object')
+        metadata.blocks[-1][1] += 1
+        self.context.storage_backend.write_metadata('bucket/object', metadata)
+
+        with self.assertRaises(http.client.IncompleteRead):
+            self.request('GET', '/bucket/object')
+
+    def test_data_key_is_stored_wrapped(self):
+        object_data = os.urandom(100000)
+        self.request('PUT', '/bucket/object', body=object_data)
+        metadata = self.context.storage_backend.read_metadata('bucket/object')
+        self.assertEqual(len(metadata.encryption_key), WRAPPED_KEY_SIZE)
+
+        # objects written before data keys were wrapped store the plain key
+        metadata.encryption_key = self.context.key_manager.unwrap(metadata.encryption_key)
+        self.context.storage_backend.write_metadata('bucket/object', metadata)
+        self.context.object_cache.clear()
+        response, body = self.request('GET', '/bucket/object')
+        self.assertEqual(body, object_data)
+
+    def test_requests_and_stages_are_measured(self):
+        object_data = os.urandom(100000)
+        self.request('PUT', '/bucket/object', body=object_data)
+        self.request('GET', '/bucket/object')
+        self.request('GET', '/bucket/missing')
+
+        # requests are observed once their response has been sent
+        metrics = self.context.metrics
+        deadline = time.monotonic() + 10
+        while metrics.request_duration.count('GET') < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(metrics.requests.value('PUT', '200'), 1)
+        self.assertEqual(metrics.requests.value('GET', '200'), 1)
+        self.assertEqual(metrics.requests.value('GET', '404'), 1)
+        self.assertEqual(metrics.request_duration.count('GET'), 2)
+        self.assertEqual(metrics.requests_in_flight.value(), 0)
+        self.assertEqual(metrics.received_bytes.value(), len(object_data))
+        self.assertEqual(metrics.sent_bytes.value(), len(object_data))
+        for stage in ('auth', 'receive', 'compress', 'encrypt', 'checksum', 'backend_write', 'metadata',
+                      'replicate', 'decrypt', 'decompress', 'backend_read'):
+            self.assertGreater(metrics.stage_duration.count(stage), 0, stage)
+        self.assertIn('kriya_cache_misses_total{cache="object"} 1\n', metrics.render())
+
+    def test_multipart_upload(self):
+        response, body = self.request('POST', '/bucket/multipart-object?uploads')
+        self.assertEqual(response.status, 200)
+        upload_id = ElementTree.fromstring(body).findtext(f'{{{S3_XMLNS}}}UploadId')
+
+        parts = [os.urandom(200000), os.urandom(100)]
+        etags = []
+        for part_number, part_data in enumerate(parts, 1):
+            response, _ = self.request('PUT', f'/bucket/multipart-object?partNumber={part_number}&uploadId={upload_id}',
+                                       body=part_data)
+            self.assertEqual(response.status, 200)
+            etags.append(response.getheader('ETag'))
+
+        complete = ''.join(f'<Part><PartNumber>{part_number}</PartNumber><ETag>{etag}</ETag></Part>'
+                           for part_number, etag in enumerate(etags, 1))
+        response, _ = self.request('POST', f'/bucket/multipart-object?uploadId={upload_id}',
+                                   body=f'<CompleteMultipartUpload>{complete}</CompleteMultipartUpload>')
+        self.assertEqual(response.status, 200)
+
+        response, body = self.request('GET', '/bucket/multipart-object')
+        self.assertEqual(body, b''.join(parts))
+
+    def upload_multipart(self, path, parts):
+        _, body = self.request('POST', f'{path}?uploads')
+        upload_id = ElementTree.fromstring(body).findtext(f'{{{S3_XMLNS}}}UploadId')
+        complete = ''
+        for part_number, part_data in enumerate(parts, 1):
+            response, _ = self.request('PUT', f'{path}?partNumber={part_number}&uploadId={upload_id}', body=part_data)
+            complete += (f'<Part><PartNumber>{part_number}</PartNumber>'
+                         f'<ETag>{response.getheader("ETag")}</ETag></Part>')
+        response, _ = self.request('POST', f'{path}?uploadId={upload_id}',
+                                   body=f'<CompleteMultipartUpload>{complete}</CompleteMultipartUpload>')
+        self.assertEqual(response.status, 200)
+
+    def test_completed_upload_replaces_parts_and_shards(self):
+        self.upload_multipart('/bucket/object', [os.urandom(1000), os.urandom(1000)])
+        old_parts = self.context.storage_backend.read_metadata('bucket/object').parts
+        self.upload_multipart('/bucket/object', [b'new'])
+        for part_key, _ in old_parts:
+            self.assertIsNone(self.context.storage_backend.read_metadata(part_key))
+        self.assertEqual(self.request('GET', '/bucket/object')[1], b'new')
+
+        object_server_cluster = self.context.object_server_cluster
+        object_server_cluster.erasure_coded_buckets.add('cold')
+        for i in range(6):
+            object_server_cluster.add_object_server(MagicMock(
+                node_id=f'server-{i}', storage_backend=DiskStorageBackend(os.path.join(self.storage_path, f'server-{i}'))))
+        self.request('PUT', '/cold/object', body=os.urandom(100000))
+        shard_nodes = self.context.storage_backend.read_metadata('cold/object').shard_nodes
+        self.upload_multipart('/cold/object', [b'new'])
+        for shard_index, node_id in enumerate(shard_nodes):
+            object_server = object_server_cluster.get_object_server(node_id)
+            self.assertFalse(object_server.storage_backend.object_exists(shard_key('cold/object', shard_index)))
+
+    def test_plain_post_is_rejected(self):
+        response, _ = self.request('POST', '/bucket/object', body=b'')
+        self.assertEqual(response.status, 400)
+
+    def test_abort_multipart_upload(self):
+        _, body = self.request('POST', '/bucket/multipart-object?uploads')
+        upload_id = ElementTree.fromstring(body).findtext(f'{{{S3_XMLNS}}}UploadId')
+
+        response, _ = self.request('DELETE', f'/bucket/multipart-object?uploadId={upload_id}')
+        self.assertEqual(response.status, 204)
+
+        response, _ = self.request('PUT', f'/bucket/multipart-object?partNumber=1&uploadId={upload_id}', body=b'data')
+        self.assertEqual(response.status, 404)
+
+    def test_get_range(self):
+        object_data = os.urandom(3 * 1024 * 1024)
+        self.request('PUT', '/bucket/object', body=object_data)
+
+        response, body = self.request('GET', '/bucket/object', headers={'Range': 'bytes=1048000-2097200'})
+        self.assertEqual(response.status, 206)
+        self.assertEqual(response.getheader('Content-Range'), f'bytes 1048000-2097200/{len(object_data)}')
+        self.assertEqual(body, object_data[1048000:2097201])
+
+        response, body = self.request('GET', '/bucket/object', headers={'Range': 'bytes=-10'})
+        self.assertEqual(body, object_data[-10:])
+
+    def test_get_unsatisfiable_range(self):
+        self.request('PUT', '/bucket/object', body=b'data')
+
+        response, _ = self.request('GET', '/bucket/object', headers={'Range': 'bytes=4-'})
+        self.assertEqual(response.status, 416)
+        self.assertEqual(response.getheader('Content-Range'), 'bytes */4')
+
+    def test_get_range_across_parts(self):
+        _, body = self.request('POST', '/bucket/multipart-object?uploads')
+        upload_id = ElementTree.fromstring(body).findtext(f'{{{S3_XMLNS}}}UploadId')
+        parts = [os.urandom(1000), os.urandom(1000)]
+        complete = ''
+        for part_number, part_data in enumerate(parts, 1):
+            response, _ = self.request('PUT', f'/bucket/multipart-object?partNumber={part_number}&uploadId={upload_id}',
+                                       body=part_data)
+            complete += f'<Part><PartNumber>{part_number}</PartNumber><ETag>{response.getheader("ETag")}</ETag></Part>'
+        self.request('POST', f'/bucket/multipart-object?uploadId={upload_id}',
+                     body=f'<CompleteMultipartUpload>{complete}</CompleteMultipartUpload>')
+
+        response, body = self.request('GET', '/bucket/multipart-object', headers={'Range': 'bytes=900-1099'})
+        self.assertEqual(response.status, 206)
+        self.assertEqual(body, b''.join(parts)[900:1100])
+
+    def test_erasure_coded_object(self):
+        object_server_cluster = self.context.object_server_cluster
+        object_server_cluster.erasure_coded_buckets.add('cold')
+        for i in range(6):
+            object_server_cluster.add_object_server(MagicMock(
+                node_id=f'server-{i}', storage_backend=DiskStorageBackend(os.path.join(self.storage_path, f'server-{i}'))))
+        object_data = os.urandom(2500000)
+
+        response, _ = self.request('PUT', '/cold/object', body=object_data)
+        self.assertEqual(response.status, 200)
+        metadata = self.context.storage_backend.read_metadata('cold/object')
+        self.assertEqual(len(metadata.shard_nodes), 6)
+        self.assertEqual(self.context.storage_backend.get_object_size('cold/object'), 0)
+
+        # the object survives losing any two shards
+        for shard_index in [1, 4]:
+            object_server = object_server_cluster.get_object_server(metadata.shard_nodes[shard_index])
+            object_server.storage_backend.delete_object(shard_key('cold/object', shard_index))
+        response, body = self.request('GET', '/cold/object')
+        self.assertEqual(body, object_data)
+        response, body = self.request('GET', '/cold/object', headers={'Range': 'bytes=1048000-2097200'})
+        self.assertEqual(body, object_data[1048000:2097201])
+
+        response, _ = self.request('DELETE', '/cold/object')
+        self.assertEqual(response.status, 204)
+        object_server = object_server_cluster.get_object_server(metadata.shard_nodes[0])
+        self.assertFalse(object_server.storage_backend.object_exists(shard_key('cold/object', 0)))
+
+    def test_erasure_coded_object_with_corrupted_shard(self):
+        object_server_cluster = self.context.object_server_cluster
+        object_server_cluster.erasure_coded_buckets.add('cold')
+        for i in range(6):
+            object_server_cluster.add_object_server(MagicMock(
+                node_id=f'server-{i}', storage_backend=DiskStorageBackend(os.path.join(self.storage_path, f'server-{i}'))))
+        object_data = os.urandom(2500000)
+        self.request('PUT', '/cold/object', body=object_data)
+        metadata = self.context.storage_backend.read_metadata('cold/object')
+        storage_backend = object_server_cluster.get_object_server(metadata.shard_nodes[0]).storage_backend
+        shard = storage_backend.read_object(shard_key('cold/object', 0))
+        storage_backend.write_object(shard_key('cold/object', 0), bytes([shard[0] ^ 1]) + shard[1:])
+
+        response, body = self.request('GET', '/cold/object')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(body, object_data)
+        # the corrupted shard is rewritten in the background once the object is read
+        deadline = time.monotonic() + 10
+        while storage_backend.read_object(shard_key('cold/object', 0)) != shard and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(storage_backend.read_object(shard_key('cold/object', 0)), shard)
+
+    def test_plain_object_is_sent_from_storage(self):
+        self.context.unencrypted_buckets.add('public')
+        self.context.compression_policy.bucket_codecs['public'] = 'none'
+        object_data = os.urandom(3 * 1024 * 1024)
+
+        response, _ = self.request('PUT', '/public/object', body=object_data)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(self.context.storage_backend.read_object('public/object'), object_data)
+
+        response, body = self.request('GET', '/public/object')
+        self.assertEqual(body, object_data)
+        response, body = self.request('GET', '/public/object', headers={'Range': 'bytes=1048000-2097200'})
+        self.assertEqual(response.status, 206)
+        self.assertEqual(body, object_data[1048000:2097201])
+
+    def test_list_objects(self):
+        for key in ['a', 'logs/1', 'logs/2', 'photos/1', 'z']:
+            self.request('PUT', f'/bucket/{key}', body=b'data')
+        self.request('DELETE', '/bucket/z')
+
+        response, body = self.request('GET', '/bucket?list-type=2&delimiter=/&max-keys=2')
+        self.assertEqual(response.status, 200)
+        result = ElementTree.fromstring(body)
+        self.assertEqual([key.text for key in result.iter(f'{{{S3_XMLNS}}}Key')], ['a'])
+        self.assertEqual([prefix.text for prefix in result.iter(f'{{{S3_XMLNS}}}Prefix')][1:], ['logs/'])
+        self.assertEqual(result.findtext(f'{{{S3_XMLNS}}}IsTruncated'), 'true')
+        self.assertEqual(result.findtext(f'{{{S3_XMLNS}}}Contents/{{{S3_XMLNS}}}Size'), '4')
+
+        token = result.findtext(f'{{{S3_XMLNS}}}NextContinuationToken')
+        response, body = self.request('GET', f'/bucket?list-type=2&delimiter=/&max-keys=2&continuation-token={token}')
+        result = ElementTree.fromstring(body)
+        self.assertEqual([prefix.text for prefix in result.iter(f'{{{S3_XMLNS}}}Prefix')][1:], ['photos/'])
+        self.assertEqual(result.findtext(f'{{{S3_XMLNS}}}IsTruncated'), 'false')
+
+        for token in ['%%%', 'YQ', '__8=']:
+            response, body = self.request('GET', f'/bucket?list-type=2&continuation-token={token}')
+            self.assertEqual(response.status, 400, token)
+            self.assertEqual(ElementTree.fromstring(body).findtext('Code'), 'InvalidArgument')
+
+        response, body = self.request('GET', '/bucket?list-type=2&prefix=logs/')
+        self.assertEqual([key.text for key in ElementTree.fromstring(body).iter(f'{{{S3_XMLNS}}}Key')],
+                         ['logs/1', 'logs/2'])
+
+    def test_read_cache(self):
+        self.request('PUT', '/bucket/object', body=b'first')
+        self.assertEqual(self.request('GET', '/bucket/object')[1], b'first')
+        self.assertEqual(self.request('GET', '/bucket/object', headers={'Range': 'bytes=1-2'})[1], b'ir')
+        self.assertEqual((self.context.object_cache.hits, self.context.object_cache.misses), (1, 1))
+
+        self.request('PUT', '/bucket/object', body=b'second')
+        self.assertEqual(self.request('GET', '/bucket/object')[1], b'second')
+        self.request('DELETE', '/bucket/object')
+        self.assertEqual(len(self.context.object_cache), 0)
+
+    def test_conditional_get_and_head(self):
+        object_data = os.urandom(5000)
+        response, _ = self.request('PUT', '/bucket/object', body=object_data)
+        etag = response.getheader('ETag')
+        self.assertEqual(etag, f'"{hashlib.sha256(object_data).hexdigest()}"')
+
+        response, _ = self.request('HEAD', '/bucket/object')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader('Content-Length'), '5000')
+        self.assertEqual(response.getheader('ETag'), etag)
+        last_modified = response.getheader('Last-Modified')
+
+        for headers in [{'If-None-Match': etag}, {'If-None-Match': f'"other", W/{etag}'},
+                        {'If-Modified-Since': last_modified}]:
+            response, body = self.request('GET', '/bucket/object', headers=headers)
+            self.assertEqual(response.status, 304)
+            self.assertEqual(body, b'')
+            self.assertEqual(response.getheader('ETag'), etag)
+        response, _ = self.request('HEAD', '/bucket/object', headers={'If-None-Match': etag})
+        self.assertEqual(response.status, 304)
+
+        response, _ = self.request('GET', '/bucket/object', headers={'If-Match': '"other"'})
+        self.assertEqual(response.status, 412)
+        response, _ = self.request('GET', '/bucket/object', headers={'If-Unmodified-Since': 'Mon, 01 Jan 2001 00:00:00 GMT'})
+        self.assertEqual(response.status, 412)
+        response, body = self.request('GET', '/bucket/object', headers={'If-Match': etag, 'If-None-Match': '"other"'})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(body, object_data)
+
+    def test_conditional_put(self):
+        response, _ = self.request('PUT', '/bucket/object', body=b'first', headers={'If-None-Match': '*'})
+        self.assertEqual(response.status, 200)
+        etag = response.getheader('ETag')
+        response, _ = self.request('PUT', '/bucket/object', body=b'second', headers={'If-None-Match': '*'})
+        self.assertEqual(response.status, 412)
+
+        response, _ = self.request('PUT', '/bucket/object', body=b'second', headers={'If-Match': etag})
+        self.assertEqual(response.status, 200)
+        response, _ = self.request('PUT', '/bucket/object', body=b'third', headers={'If-Match': etag})
+        self.assertEqual(response.status, 412)
+        self.assertEqual(self.request('GET', '/bucket/object')[1], b'second')
+
+    def test_put_with_checksum(self):
+        crc32 = base64.b64encode(zlib.crc32(b'data').to_bytes(4, 'big')).decode()
+        response, _ = self.request('PUT', '/bucket/object', body=b'data', headers={'x-amz-checksum-crc32': crc32})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader('x-amz-checksum-crc32'), crc32)
+
+        response, _ = self.request('PUT', '/bucket/object', body=b'other', headers={'x-amz-checksum-crc32': crc32})
+        self.assertEqual(response.status, 400)
+        response, body = self.request('GET', '/bucket/object', headers={'x-amz-checksum-mode': 'ENABLED'})
+        self.assertEqual(body, b'data')
+        self.assertEqual(response.getheader('x-amz-checksum-crc32'), crc32)
+        response, _ = self.request('HEAD', '/bucket/object')
+        self.assertIsNone(response.getheader('x-amz-checksum-crc32'))
+
+        # the SHA-256 checksum is the hash every object has anyway
+        sha256 = base64.b64encode(hashlib.sha256(b'other').digest()).decode()
+        response, _ = self.request('PUT', '/bucket/other', body=b'other', headers={'x-amz-checksum-sha256': sha256})
+        self.assertEqual(response.status, 200)
+        response, _ = self.request('PUT', '/bucket/object', body=b'data', headers={'x-amz-checksum-crc64nvme': 'AA=='})
+        self.assertEqual(response.status, 400)
+        response, _ = self.request('PUT', '/bucket/object', body=b'data', headers={'x-amz-checksum-mode': 'ENABLED'})
+        self.assertEqual(response.status, 200)
+        response, _ = self.request('HEAD', '/bucket/object', headers={'x-amz-checksum-mode': 'ENABLED'})
+        self.assertEqual(response.getheader('x-amz-checksum-sha256'),
+                         base64.b64encode(hashlib.sha256(b'data').digest()).decode())
+
+    def test_delete_objects(self):
+        for key in ['a', 'b', 'c']:
+            self.request('PUT', f'/bucket/{key}', body=b'data')
+
+        response, body = self.request('POST', '/bucket?delete', body=(
+            '<Delete><Object><Key>a</Key></Object><Object><Key>b</Key></Object>'
+            '<Object><Key>missing</Key></Object></Delete>'))
+        self.assertEqual(response.status, 200)
+        result = ElementTree.fromstring(body)
+        self.assertEqual([key.text for key in result.iter(f'{{{S3_XMLNS}}}Key')], ['a', 'b', 'missing'])
+        self.assertEqual(self.request('GET', '/bucket/a')[0].status, 404)
+        self.assertEqual(self.request('GET', '/bucket/c')[0].status, 200)
+        _, body = self.request('GET', '/bucket?list-type=2')
+        self.assertEqual([key.text for key in ElementTree.fromstring(body).iter(f'{{{S3_XMLNS}}}Key')], ['c'])
+
+        response, body = self.request('POST', '/bucket?delete',
+                                      body='<Delete><Quiet>true</Quiet><Object><Key>c</Key></Object></Delete>')
+        self.assertEqual(list(ElementTree.fromstring(body)), [])
+        response, _ = self.request('POST', '/bucket?delete', body='<Delete></Delete>')
+        self.assertEqual(response.status, 400)
+
+    def test_delete_objects_with_malformed_xml(self):
+        for request_body in ['<Delete><Object><Key>a</Key></Object><Object></Object></Delete>', '<Delete>']:
+            response, body = self.request('POST', '/bucket?delete', body=request_body)
+            self.assertEqual(response.status, 400, request_body)
+            self.assertEqual(ElementTree.fromstring(body).findtext('Code'), 'MalformedXML')
+
+    def test_keys_outside_buckets_are_rejected(self):
+        for path in ['/../escaped', '/bucket/../../escaped', '/.multipart/upload/1', '/bucket/./object']:
+            response, _ = self.request('PUT', path, body=b'data')
+            self.assertEqual(response.status, 400, path)
+            response, _ = self.request('DELETE', path)
+            self.assertEqual(response.status, 400, path)
+        self.assertFalse(os.path.exists(os.path.join(self.storage_path, 'escaped')))
+
+        self.request('PUT', '/bucket/a', body=b'data')
+        response, body = self.request('POST', '/bucket?delete', body=(
+            '<Delete><Object><Key>../../kriya.db</Key></Object><Object><Key>a</Key></Object></Delete>'))
+        result = ElementTree.fromstring(body)
+        self.assertEqual([error.findtext(f'{{{S3_XMLNS}}}Code') for error in result.iter(f'{{{S3_XMLNS}}}Error')],
+                         ['InvalidArgument'])
+        self.assertEqual(self.request('GET', '/bucket/a')[0].status, 404)
+        self.assertTrue(os.path.exists(os.path.join(self.storage_path, 'kriya.db')))
+
+    def test_keys_with_reserved_suffixes_are_rejected(self):
+        self.request('PUT', '/bucket/x', body=b'data')
+        for path in ['/bucket/x.metadata', '/bucket/x.1234.tmp']:
+            response, _ = self.request('PUT', path, body=b'garbage')
+            self.assertEqual(response.status, 400, path)
+        self.assertEqual(self.request('GET', '/bucket/x')[1], b'data')
+
+    def test_unreadable_metadata_gets_server_error(self):
+        self.request('PUT', '/bucket/object', body=b'data')
+        with mock.patch.object(self.context.storage_backend, 'read_metadata',
+                               side_effect=ValueError("Not an object metadata record.")):
+            response, _ = self.request('GET', '/bucket/object')
+        self.assertEqual(response.status, 500)
+
+    def test_keys_conflicting_with_stored_keys(self):
+        if self.storage_engine == 'packed':
+            self.skipTest("packed storage has no directories for keys to conflict with")
+        self.request('PUT', '/bucket/a', body=b'data')
+        self.request('PUT', '/bucket/dir/object', body=b'data')
+        for path in ['/bucket/a/c', '/bucket/dir/', '/bucket/dir']:
+            response, _ = self.request('PUT', path, body=b'data')
+            self.assertEqual(response.status, 409, path)
+        self.assertEqual(self.request('GET', '/bucket/a')[1], b'data')
+        self.assertEqual(self.request('GET', '/bucket/a/c')[0].status, 404)
+
+    def test_invalid_content_length(self):
+        for content_length in ['abc', '-1']:
+            response, _ = self.request('PUT', '/bucket/object', body=b'', headers={'Content-Length': content_length})
+            self.assertEqual(response.status, 400, content_length)
+
+    def test_delete_requires_authentication(self):
+        self.request('PUT', '/bucket/object', body=b'data')
+        response, _ = self.request('DELETE', '/bucket/object', headers={'X-Amz-Secret-Key': 'wrong'})
+        self.assertEqual(response.status, 403)
+        self.assertEqual(self.request('GET', '/bucket/object')[0].status, 200)
+
+
+class TestPackedObjectServerRequests(TestObjectServerRequests):
+    storage_engine = 'packed'
@@ -1,6 +1,12 @@
-import socket
+import itertools
+import queue
 import threading
-import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from erasure_coding import ErasureCoder, NotEnoughShardsError, shard_key
+from membership import DEAD
+from object_pipeline import CHUNK_SIZE
+from placement import HashRing, plan_movement
 
 
 class ObjectServerCluster:
@@ -9,32 +15,74 @@ class ObjectServerCluster:
 
     Attributes:
     - object_servers: A list of object servers in the cluster.
-    - heartbeat_interval: The interval (in seconds) at which object servers exchange heartbeats.
     - rebalance_interval: The interval (in seconds) at which objects are rebalanced across object servers.
     - consensus_threshold: The percentage of successful writes required for consensus.
     - redundancy_factor: The number of replicas to maintain for each object.
-    - heartbeat_port: The port used for exchanging heartbeats.
+    - write_quorum: The number of copies of an object, counting the local one, that must be written
+      before a write succeeds. The remaining replicas are written in the background.
+    - hint_replay_interval: The interval (in seconds) at which replicas that failed are retried.
+    - replica_timeout: The time (in seconds) a write waits for the replicas reaching its write quorum.
+    - hinted_handoffs: A dict mapping object servers to the replicas that could not be written to them,
+      as a dict mapping object keys to (object_data, metadata) tuples, or to (None, None) for
+      replicas that could not be deleted.
+    - membership: The membership protocol telling which object servers are alive, if any.
+    - peer_factory: A callable creating the object server for a node ID that joined the cluster, if any.
+    - local_node_id: The ID of the object server this cluster instance runs in, if it is part of the cluster.
+    - server_weights: A dict mapping node IDs to the share of objects their object servers own.
+    - ring: The consistent hash ring placing objects on object servers.
+    - previous_ring: The ring before the membership changes not yet rebalanced, or None.
+    - storage_backend: The storage backend of the object server this cluster instance runs in, if any.
+    - erasure_coded_buckets: The buckets whose objects are stored as erasure-coded shards instead
+      of full replicas.
+    - erasure_coder: The erasure code new erasure-coded objects are split with.
     """
 
-    def __init__(self):
+    def __init__(self, local_node_id=None, storage_backend=None):
         """
         Initializes a new instance of the ObjectServerCluster class.
+
+        Args:
+        - local_node_id: The ID of the object server this cluster instance runs in, if it is part of the cluster.
+        - storage_backend: The storage backend of the object server this cluster instance runs in, if any.
         """
         self.object_servers = []
-        self.heartbeat_interval = 5  # seconds
         self.rebalance_interval = 60  # seconds
         self.consensus_threshold = 0.5  # percentage
         self.redundancy_factor = 2  # number of replicas
-        self.heartbeat_port = 5000
+        self.write_quorum = self.redundancy_factor // 2 + 1  # number of copies
+        self.hint_replay_interval = 10  # seconds
+        self.replica_timeout = 30  # seconds
+        self.hinted_handoffs = {}
+        self.membership = None
+        self.peer_factory = None
+        self.local_node_id = local_node_id
+        self.server_weights = {}
+        self.ring = HashRing()
+        self.previous_ring = None
+        self.storage_backend = storage_backend
+        self.erasure_coded_buckets = set()
+        self.erasure_coder = ErasureCoder(data_shards=4, parity_shards=2)
+        self._erasure_coders = {}
+        self._replication_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='replication')
+        # shard reads get threads of their own, as repairs running on the replication threads read
+        # shards too, and would otherwise wait on reads queued behind them
+        self._shard_read_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='shard-read')
+        self._pending_replicas = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._hinted_handoff_thread = None
 
-    def add_object_server(self, object_server):
+    def add_object_server(self, object_server, weight=1):
         """
         Adds an object server to the cluster.
 
         Args:
         - object_server: The object server to add.
+        - weight: The share of objects the object server owns relative to the others.
         """
         self.object_servers.append(object_server)
+        self.server_weights[self._node_id(object_server)] = weight
+        self.update_ring()
 
     def remove_object_server(self, object_server):
         """
@@ -44,127 +92,794 @@ class ObjectServerCluster:
         - object_server: The object server to remove.
         """
         self.object_servers.remove(object_server)
+        self.update_ring()
+
+    def owners(self, object_key, num_owners=None):
+        """
+        Returns the IDs of the object servers that own an object, the primary owner first.
+
+        Args:
+        - object_key: The key of the object.
+        - num_owners: The number of owners to return; defaults to the redundancy factor.
+        """
+        self.update_ring()
+        return self.ring.owners(object_key, self.redundancy_factor if num_owners is None else num_owners)
+
+    def movement_plan(self, object_keys):
+        """
+        Computes which objects must move because of the membership changes since the last rebalance.
+
+        Args:
+        - object_keys: An iterable over the keys of the objects to plan for.
+
+        Returns:
+        - An iterator over (object_key, old_owners, new_owners) tuples for the objects whose owners changed.
+        """
+        self.update_ring()
+        if self.previous_ring is None:
+            return iter(())
+        return plan_movement(self.previous_ring, self.ring, object_keys, self.redundancy_factor)
+
+    def finish_movement(self, previous_ring):
+        """
+        Marks the membership changes up to the current ring as rebalanced.
+
+        Args:
+        - previous_ring: The previous ring the rebalance started from; if the membership changed
+          again meanwhile, the plan is kept.
+        """
+        with self._lock:
+            if self.previous_ring is previous_ring:
+                self.previous_ring = None
 
-    def replicate_object(self, object_key, object_data):
+    def get_object_server(self, node_id):
         """
-        Replicates an object to all object servers in the cluster.
+        Returns the object server with a node ID, or None if it is not a member of the cluster.
+        """
+        for object_server in self._peers():
+            if self._node_id(object_server) == node_id:
+                return object_server
+        return None
+
+    def replicate_object(self, object_key, object_data, metadata=None):
+        """
+        Replicates an object to the object servers that own it.
+
+        The replicas are written concurrently. This returns as soon as enough of them have been
+        written to reach the write quorum, while the others finish in the background. Replicas
+        that fail, or are still being written once replica_timeout has passed, are kept as hinted
+        handoffs and retried later.
 
         Args:
         - object_key: The key of the object to replicate.
-        - object_data: The data of the object to replicate.
+        - object_data: The data of the object to replicate, or a callable returning an iterator over its chunks.
+        - metadata: The metadata record of the object to replicate along with its data, if any.
+
+        Returns:
+        - True if the write quorum was reached, False otherwise.
+        """
+        peers = self._replica_servers(object_key)
+        required_replicas = min(self.write_quorum - 1, len(peers))
+        if required_replicas <= 0:
+            for object_server in peers:
+                self._submit_replica(object_server, object_key, object_data, metadata)
+            return True
+
+        num_successful_replicas = 0
+        futures = [self._submit_replica(object_server, object_key, object_data, metadata) for object_server in peers]
+        try:
+            for future in as_completed(futures, timeout=self.replica_timeout):
+                if future.result():
+                    num_successful_replicas += 1
+                    if num_successful_replicas >= required_replicas:
+                        return True
+        except TimeoutError:
+            # a hung object server counts as failed; should its write finish after all, the
+            # hint is dropped as stale
+            with self._lock:
+                for object_server, future in zip(peers, futures):
+                    if not future.done():
+                        self.hinted_handoffs.setdefault(object_server, {})[object_key] = (object_data, metadata)
+        return False
+
+    def is_erasure_coded(self, object_key):
+        """
+        Returns whether an object is stored as erasure-coded shards instead of full replicas.
+        """
+        return object_key.partition('/')[0] in self.erasure_coded_buckets
+
+    def write_shards(self, object_key, metadata, read_stored_range):
+        """
+        Splits the stored data of an object into erasure-coded shards and spreads them across the
+        object servers that own it, one shard per object server if there are enough of them.
+
+        Every block is split on its own, so any range of the object can be read back by rebuilding
+        only the blocks it overlaps. Every block is read and split once, and its shards are handed
+        to writers writing the shards concurrently; this waits for all of them.
+
+        Args:
+        - object_key: The key of the object.
+        - metadata: The metadata record of the object, whose block index the shards follow.
+        - read_stored_range: A callable taking an offset and length into the stored data and
+          returning an iterator over the chunks of stored data in that range.
+
+        Returns:
+        - The ID of the node holding every shard, or an empty string for shards that could not
+          be written, or None if too few shards were written to lose one more.
+        """
+        num_shards = self.erasure_coder.num_shards
+        owners = self.owners(object_key, num_shards)
+        if not owners:
+            return None
+        shard_nodes = [owners[shard_index % len(owners)] for shard_index in range(num_shards)]
+        # a few blocks are buffered for every writer, so a slow object server holds back the others
+        # only once it is that far behind
+        shard_queues = [queue.Queue(maxsize=4) for _ in range(num_shards)]
+        futures = [self._replication_executor.submit(self._write_shard, node_id, object_key, shard_index,
+                                                     self._queued_chunks(shard_queue))
+                   for shard_index, (node_id, shard_queue) in enumerate(zip(shard_nodes, shard_queues))]
+        end = None
+        try:
+            stored_offset = 0
+            for stored_length, _ in metadata.blocks:
+                block = b''.join(read_stored_range(stored_offset, stored_length))
+                stored_offset += stored_length
+                for shard_queue, future, shard in zip(shard_queues, futures, self.erasure_coder.encode(block)):
+                    self._put_chunk(shard_queue, future, shard)
+        except Exception as e:
+            # the writers fail rather than store truncated shards
+            print(f"Error reading {object_key} to split it into shards: {e}")
+            end = e
+        finally:
+            for shard_queue, future in zip(shard_queues, futures):
+                self._put_chunk(shard_queue, future, end)
+        shard_nodes = [node_id if future.result() else '' for node_id, future in zip(shard_nodes, futures)]
+        if sum(1 for node_id in shard_nodes if node_id) < min(self.erasure_coder.data_shards + 1, num_shards):
+            return None
+        return shard_nodes
+
+    def read_shards(self, object_key, metadata, offset, length, verify_block=None):
+        """
+        Reads a range of the stored data of an erasure-coded object, rebuilding every block it
+        overlaps from the first data_shards shards that can be read.
+
+        Given a callable verifying blocks, a block that fails verification is rebuilt from the
+        other combinations of its shards, and once the range is read, the shards found corrupted
+        are rewritten in the background.
+
+        Args:
+        - object_key: The key of the object.
+        - metadata: The metadata record of the object.
+        - offset: The offset into the stored data.
+        - length: The number of bytes of stored data to read.
+        - verify_block: A callable taking the number of a block and its stored data, raising an
+          exception if the block does not match its checksum, or None to not verify blocks.
+
+        Returns:
+        - An iterator over the chunks of stored data in the range.
+
+        Raises:
+        - NotEnoughShardsError: If too few shards of a block can be read to rebuild it.
+        - Whatever verify_block raises if no combination of shards rebuilds a block that passes it.
+        """
+        corrupted_shards = set()
+        try:
+            yield from self._read_stripes(object_key, metadata, offset, length, verify_block, set(),
+                                          corrupted_shards)
+        finally:
+            # readers often stop once they have the bytes they asked for, so this also runs when
+            # the iterator is closed early
+            if corrupted_shards:
+                self._submit_shard_repair(object_key, metadata, corrupted_shards, verify_block)
+
+    def rebuild_block(self, object_key, metadata, block_number, decode_block):
+        """
+        Rebuilds a block of an erasure-coded object that failed to decode, reading all of its
+        shards and trying every combination of them, and rewrites the shards found corrupted in
+        the background.
+
+        Readers decode the blocks read_shards returns themselves, and only call this for a block
+        that does not match its checksum, so healthy blocks are never decoded twice.
+
+        Args:
+        - object_key: The key of the object.
+        - metadata: The metadata record of the object.
+        - block_number: The number of the block.
+        - decode_block: A callable taking the number of a block and its stored data, returning
+          the decoded block or raising an exception if it does not match its checksum.
+
+        Returns:
+        - The block decode_block returns for the first combination of shards it accepts.
+
+        Raises:
+        - NotEnoughShardsError: If too few shards of the block can be read to rebuild it.
+        - Whatever decode_block raises if no combination of shards rebuilds a block that passes it.
+        """
+        erasure_coder = self._erasure_coder(metadata.data_shards, metadata.parity_shards)
+        shard_offset = sum(erasure_coder.shard_size(stored_length) for stored_length, _ in metadata.blocks[:block_number])
+        stored_length = metadata.blocks[block_number][0]
+        shards = {}
+        self._read_stripe_shards(object_key, metadata, shard_offset, erasure_coder.shard_size(stored_length), shards,
+                                 set(), len(metadata.shard_nodes))
+        corrupted_shards = set()
+        _, block = self._rebuild_stripe(erasure_coder, block_number, stored_length, shards, decode_block,
+                                        corrupted_shards)
+        if corrupted_shards:
+            self._submit_shard_repair(object_key, metadata, corrupted_shards, decode_block)
+        return block
+
+    def verify_shards(self, object_key, metadata, verify_block):
+        """
+        Reads every shard of an erasure-coded object and checks it against the blocks rebuilt
+        from the shards, which are verified first.
+
+        Args:
+        - object_key: The key of the object.
+        - metadata: The metadata record of the object.
+        - verify_block: A callable verifying the rebuilt blocks, as for read_shards.
+
+        Returns:
+        - The indexes of the shards that are missing, cannot be read or do not match the blocks.
+
+        Raises:
+        - NotEnoughShardsError: If too few shards of a block can be read to rebuild it.
+        - Whatever verify_block raises if no combination of shards rebuilds a block that passes it.
+        """
+        stored_size = sum(stored_length for stored_length, _ in metadata.blocks)
+        unavailable_shards = set()
+        corrupted_shards = set()
+        for _ in self._read_stripes(object_key, metadata, 0, stored_size, verify_block, unavailable_shards,
+                                    corrupted_shards, read_all=True):
+            pass
+        # shards that were never written have no node to be repaired on
+        return sorted(shard_index for shard_index in unavailable_shards | corrupted_shards
+                      if metadata.shard_nodes[shard_index])
+
+    def repair_shards(self, object_key, metadata, shard_indexes, verify_block=None):
+        """
+        Rewrites shards of an erasure-coded object that are corrupted or missing, rebuilding them
+        from the other shards.
+
+        Args:
+        - object_key: The key of the object.
+        - metadata: The metadata record of the object.
+        - shard_indexes: The indexes of the shards to rewrite.
+        - verify_block: A callable verifying the blocks the shards are rebuilt from, as for read_shards.
+
+        Returns:
+        - The indexes of the shards rewritten.
+        """
+        erasure_coder = self._erasure_coder(metadata.data_shards, metadata.parity_shards)
+        # the shards being rewritten are never read
+        unavailable_shards = set(shard_indexes)
+
+        def read_stored_range(offset, length):
+            return self._read_stripes(object_key, metadata, offset, length, verify_block, unavailable_shards, set())
+
+        def read_shard_chunks(shard_index):
+            stored_offset = 0
+            for stored_length, _ in metadata.blocks:
+                block = b''.join(read_stored_range(stored_offset, stored_length))
+                stored_offset += stored_length
+                yield erasure_coder.encode_shard(block, shard_index)
+
+        repaired_shards = []
+        for shard_index in sorted(shard_indexes):
+            node_id = metadata.shard_nodes[shard_index] if shard_index < len(metadata.shard_nodes) else ''
+            if node_id and self._write_shard(node_id, object_key, shard_index, read_shard_chunks(shard_index)):
+                repaired_shards.append(shard_index)
+        return repaired_shards
+
+    def delete_shards(self, object_key, metadata, kept_shard_nodes=()):
+        """
+        Deletes the shards of an erasure-coded object.
+
+        Args:
+        - object_key: The key of the object.
+        - metadata: The metadata record of the object.
+        - kept_shard_nodes: The shard nodes of a newer version of the object, whose shards on the
+          same nodes have already been overwritten and must be kept.
         """
-        for object_server in self.object_servers:
-            if object_server != self:
+        for shard_index, node_id in enumerate(metadata.shard_nodes):
+            if not node_id or (shard_index < len(kept_shard_nodes) and kept_shard_nodes[shard_index] == node_id):
+                continue
+            storage_backend = self._storage_backend_for(node_id)
+            try:
+                if storage_backend is not None:
+                    storage_backend.delete_object(shard_key(object_key, shard_index))
+            except Exception as e:
+                print(f"Error deleting shard {shard_index} of {object_key}: {e}")
+
+    def repair_object(self, object_key, metadata, verify):
+        """
+        Replaces the local copy of a corrupted object with a replica of the same version from
+        another object server, trying the owners of the object first.
+
+        Args:
+        - object_key: The key of the object.
+        - metadata: The metadata record of the local copy.
+        - verify: A callable taking the key and metadata record of the object, raising an
+          exception if the local copy does not match its checksums.
+
+        Returns:
+        - The ID of the node the object was repaired from, or None if no replica was healthy.
+        """
+        owners = self.owners(object_key)
+        peers = sorted(self._peers(), key=lambda object_server: self._node_id(object_server) not in owners)
+        for object_server in peers:
+            node_id = self._node_id(object_server)
+            try:
+                replica_metadata = object_server.storage_backend.read_metadata(object_key)
+                if replica_metadata is None or replica_metadata.hash != metadata.hash:
+                    continue
+                self.storage_backend.write_object_stream(
+                    object_key, object_server.storage_backend.read_object_stream(object_key, CHUNK_SIZE))
+                self.storage_backend.write_metadata(object_key, replica_metadata)
+                verify(object_key, replica_metadata)
+                return node_id
+            except Exception as e:
+                print(f"Error repairing {object_key} from {node_id}: {e}")
+        return None
+
+    def replay_hinted_handoffs(self):
+        """
+        Retries writing the replicas that could not be written to their object servers, and
+        deleting the ones that could not be deleted.
+        """
+        with self._lock:
+            hinted_handoffs = [(object_server, object_key, object_data, metadata)
+                               for object_server, hints in self.hinted_handoffs.items()
+                               for object_key, (object_data, metadata) in hints.items()]
+        for object_server, object_key, object_data, metadata in hinted_handoffs:
+            with self._lock:
+                # the hint may have been replaced by a newer write or dropped by a delete meanwhile
+                if self.hinted_handoffs.get(object_server, {}).get(object_key) != (object_data, metadata):
+                    continue
+                del self.hinted_handoffs[object_server][object_key]
+                if not self.hinted_handoffs[object_server]:
+                    del self.hinted_handoffs[object_server]
+            if object_data is None:
+                self.delete_replica(object_server, object_key)
+            else:
+                self.write_replica(object_server, object_key, object_data, metadata)
+
+    def wait_for_replicas(self, timeout=None):
+        """
+        Waits for the replicas and repaired shards still being written in the background.
+
+        Args:
+        - timeout: The maximum time (in seconds) to wait, or None to wait until all are written.
+        """
+        with self._lock:
+            futures = list(self._pending_replicas)
+        for future in as_completed(futures, timeout=timeout):
+            pass
+
+    def shutdown(self):
+        """
+        Waits for the replicas still being written and stops the replication threads.
+        """
+        self._replication_executor.shutdown(wait=True)
+        self._shard_read_executor.shutdown(wait=True)
+
+    def _peers(self):
+        return [object_server for object_server in self.object_servers
+                if object_server != self and not self._is_dead(object_server)]
+
+    def _is_dead(self, object_server):
+        return self.membership is not None and self.membership.state(self._node_id(object_server)) == DEAD
+
+    def _node_id(self, object_server):
+        node_id = getattr(object_server, 'node_id', None)
+        if not isinstance(node_id, str):
+            node_id = f'object-server-{id(object_server)}'
+        return node_id
+
+    def _replica_servers(self, object_key):
+        owners = self.owners(object_key)
+        return [object_server for object_server in self._peers() if self._node_id(object_server) in owners]
+
+    def update_ring(self):
+        """
+        Rebuilds the ring if the object servers in the cluster changed, including when
+        object_servers was changed directly.
+        """
+        nodes = {}
+        for object_server in self._peers():
+            node_id = self._node_id(object_server)
+            nodes[node_id] = self.server_weights.get(node_id, 1)
+        if self.local_node_id is not None:
+            nodes[self.local_node_id] = self.server_weights.get(self.local_node_id, 1)
+        with self._lock:
+            if nodes == self.ring.nodes:
+                return
+            ring = HashRing(self.ring.vnodes_per_weight)
+            for node_id, weight in nodes.items():
+                ring.add_node(node_id, weight)
+            if self.previous_ring is None:
+                self.previous_ring = self.ring
+            self.ring = ring
+
+    def _storage_backend_for(self, node_id):
+        if node_id == self.local_node_id:
+            return self.storage_backend
+        object_server = self.get_object_server(node_id)
+        return object_server.storage_backend if object_server is not None else None
+
+    def _erasure_coder(self, data_shards, parity_shards):
+        erasure_coder = self._erasure_coders.get((data_shards, parity_shards))
+        if erasure_coder is None:
+            erasure_coder = self._erasure_coders[(data_shards, parity_shards)] = ErasureCoder(data_shards,
+                                                                                              parity_shards)
+        return erasure_coder
+
+    def _write_shard(self, node_id, object_key, shard_index, shard_chunks):
+        storage_backend = self._storage_backend_for(node_id)
+        if storage_backend is None:
+            return False
+        try:
+            storage_backend.write_object_stream(shard_key(object_key, shard_index), shard_chunks)
+            return True
+        except Exception as e:
+            print(f"Error writing shard {shard_index} of {object_key} to {node_id}: {e}")
+            return False
+
+    @staticmethod
+    def _queued_chunks(shard_queue):
+        # yields the chunks put in a queue until None, raising an exception put in it instead
+        while True:
+            chunk = shard_queue.get()
+            if chunk is None:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+    @staticmethod
+    def _put_chunk(shard_queue, future, chunk):
+        # a writer that failed stops taking chunks, so its queue is left alone once it is done
+        while not future.done():
+            try:
+                shard_queue.put(chunk, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _read_stripes(self, object_key, metadata, offset, length, verify_block, unavailable_shards,
+                      corrupted_shards, read_all=False):
+        erasure_coder = self._erasure_coder(metadata.data_shards, metadata.parity_shards)
+        block_offset = 0
+        shard_offset = 0
+        for block_number, (stored_length, _) in enumerate(metadata.blocks):
+            shard_length = erasure_coder.shard_size(stored_length)
+            if block_offset < offset + length and offset < block_offset + stored_length:
+                block = self._read_stripe(object_key, metadata, erasure_coder, block_number, shard_offset,
+                                          shard_length, stored_length, verify_block, unavailable_shards,
+                                          corrupted_shards, read_all)
+                yield block[max(offset - block_offset, 0):offset + length - block_offset]
+            block_offset += stored_length
+            shard_offset += shard_length
+
+    def _read_stripe(self, object_key, metadata, erasure_coder, block_number, shard_offset, shard_length,
+                     stored_length, verify_block, unavailable_shards, corrupted_shards, read_all=False):
+        # data shards come first, so an object with all of them readable needs no decoding; with
+        # read_all, every shard is read and checked against the block
+        shards = {}
+        self._read_stripe_shards(object_key, metadata, shard_offset, shard_length, shards, unavailable_shards,
+                                 len(metadata.shard_nodes) if read_all else erasure_coder.data_shards)
+        block = erasure_coder.decode(shards, stored_length)
+        if verify_block is None:
+            return block
+        try:
+            verify_block(block_number, block)
+            if read_all:
+                corrupted_shards.update(self._mismatched_shards(erasure_coder, block, shards))
+            return block
+        except Exception as e:
+            error = e
+
+        # a shard read is corrupted, so read the other shards too and look for a combination of
+        # them rebuilding a block that passes verification
+        first_shard_indexes = tuple(sorted(shards)[:erasure_coder.data_shards])
+        self._read_stripe_shards(object_key, metadata, shard_offset, shard_length, shards, unavailable_shards,
+                                 len(metadata.shard_nodes))
+        block, _ = self._rebuild_stripe(erasure_coder, block_number, stored_length, shards, verify_block,
+                                        corrupted_shards, first_shard_indexes, error)
+        return block
+
+    def _rebuild_stripe(self, erasure_coder, block_number, stored_length, shards, verify_block, corrupted_shards,
+                        skipped_shard_indexes=(), error=None):
+        # returns the first block rebuilt from a combination of the shards that passes verify_block,
+        # with what verify_block returned for it
+        for shard_indexes in itertools.combinations(sorted(shards), erasure_coder.data_shards):
+            if shard_indexes == skipped_shard_indexes:
+                continue
+            block = erasure_coder.decode({shard_index: shards[shard_index] for shard_index in shard_indexes},
+                                         stored_length)
+            try:
+                verified_block = verify_block(block_number, block)
+            except Exception as e:
+                error = error or e
+                continue
+            corrupted_shards.update(self._mismatched_shards(erasure_coder, block, shards))
+            return block, verified_block
+        if error is None:
+            raise NotEnoughShardsError(f"{len(shards)} of {erasure_coder.data_shards} shards are available.")
+        raise error
+
+    @staticmethod
+    def _mismatched_shards(erasure_coder, block, shards):
+        return [shard_index for shard_index, shard in shards.items()
+                if erasure_coder.encode_shard(block, shard_index) != shard]
+
+    def _read_stripe_shards(self, object_key, metadata, shard_offset, shard_length, shards, unavailable_shards,
+                            wanted):
+        # reads shards of a stripe concurrently until wanted of them are read, reading the next
+        # shards in place of any that cannot be read
+        shard_indexes = (shard_index for shard_index in range(len(metadata.shard_nodes))
+                         if shard_index not in shards and shard_index not in unavailable_shards
+                         and metadata.shard_nodes[shard_index])
+        while len(shards) < wanted:
+            batch = list(itertools.islice(shard_indexes, wanted - len(shards)))
+            if not batch:
+                return
+            futures = [self._shard_read_executor.submit(self._read_shard, object_key, metadata, shard_index,
+                                                        shard_offset, shard_length)
+                       for shard_index in batch]
+            for shard_index, future in zip(batch, futures):
+                shard = future.result()
+                if shard is None:
+                    # skip the shard for the rest of the object rather than retrying it for every block
+                    unavailable_shards.add(shard_index)
+                else:
+                    shards[shard_index] = shard
+
+    def _read_shard(self, object_key, metadata, shard_index, shard_offset, shard_length):
+        try:
+            storage_backend = self._storage_backend_for(metadata.shard_nodes[shard_index])
+            shard = b''.join(storage_backend.read_object_stream(shard_key(object_key, shard_index), shard_length,
+                                                                shard_offset, shard_length))
+            if len(shard) != shard_length:
+                raise ValueError("Shard is truncated.")
+            return shard
+        except Exception:
+            return None
+
+    def _submit_replica(self, object_server, object_key, object_data, metadata):
+        future = self._replication_executor.submit(self.write_replica, object_server, object_key, object_data,
+                                                   metadata)
+        with self._lock:
+            self._pending_replicas.add(future)
+        future.add_done_callback(self._discard_pending_replica)
+        return future
+
+    def _submit_shard_repair(self, object_key, metadata, shard_indexes, verify_block):
+        try:
+            future = self._replication_executor.submit(self.repair_shards, object_key, metadata, shard_indexes,
+                                                       verify_block)
+        except RuntimeError:
+            # the cluster is shutting down, and scrubbing repairs the shards later
+            return
+        with self._lock:
+            self._pending_replicas.add(future)
+        future.add_done_callback(self._discard_pending_replica)
+
+    def _discard_pending_replica(self, future):
+        with self._lock:
+            self._pending_replicas.discard(future)
+
+    def write_replica(self, object_server, object_key, object_data, metadata=None):
+        """
+        Writes one replica of an object to an object server, keeping it as a hinted handoff if it fails.
+
+        Args:
+        - object_server: The object server to write the replica to.
+        - object_key: The key of the object.
+        - object_data: The data of the object, or a callable returning an iterator over its chunks.
+        - metadata: The metadata record of the object, if any.
+
+        Returns:
+        - True if the replica was written, False otherwise.
+        """
+        try:
+            if metadata is not None:
+                # the data and the metadata record go out together, so a remote object server
+                # costs a single round trip
+                object_server.storage_backend.write_object_with_metadata(
+                    object_key, object_data() if callable(object_data) else [object_data], metadata)
+            elif callable(object_data):
+                object_server.storage_backend.write_object_stream(object_key, object_data())
+            else:
                 object_server.storage_backend.write_object(object_key, object_data)
+        except Exception:
+            # keep the replica so it can be written once the object server is reachable again
+            with self._lock:
+                self.hinted_handoffs.setdefault(object_server, {})[object_key] = (object_data, metadata)
+            return False
+        with self._lock:
+            # a hint left by an earlier write that failed is stale now, and replaying it would
+            # overwrite this replica; a hint left by a newer write is kept
+            hints = self.hinted_handoffs.get(object_server, {})
+            hint = hints.get(object_key)
+            if hint is not None and not self._is_newer(hint[1], metadata):
+                del hints[object_key]
+                if not hints:
+                    del self.hinted_handoffs[object_server]
+        return True
+
+    def delete_replica(self, object_server, object_key):
+        """
+        Deletes one replica of an object from an object server, keeping a hinted handoff for the
+        delete if it fails.
+
+        Args:
+        - object_server: The object server to delete the replica from.
+        - object_key: The key of the object.
+
+        Returns:
+        - True if the replica was deleted, False otherwise.
+        """
+        try:
+            object_server.storage_backend.delete_object(object_key)
+        except Exception as e:
+            print(f"Error deleting {object_key} from {self._node_id(object_server)}: {e}")
+            # keep the delete so the replica is not left behind once the object server is reachable again
+            with self._lock:
+                self.hinted_handoffs.setdefault(object_server, {})[object_key] = (None, None)
+            return False
+        return True
+
+    @staticmethod
+    def _is_newer(metadata, other_metadata):
+        if metadata is None or other_metadata is None:
+            return False
+        if metadata.last_modified is None or other_metadata.last_modified is None:
+            return False
+        return metadata.last_modified > other_metadata.last_modified
 
     def delete_object(self, object_key):
         """
-        Deletes an object from all object servers in the cluster.
+        Deletes an object from all object servers in the cluster. The object servers that fail
+        to delete it are sent the delete again once they are reachable.
 
         Args:
         - object_key: The key of the object to delete.
+
+        Returns:
+        - True if every object server deleted the object, False otherwise.
         """
-        for object_server in self.object_servers:
-            if object_server != self:
-                object_server.storage_backend.delete_object(object_key)
+        with self._lock:
+            for hints in self.hinted_handoffs.values():
+                hints.pop(object_key, None)
+        # delete from all object servers concurrently rather than one after another
+        futures = [self._replication_executor.submit(self.delete_replica, object_server, object_key)
+                   for object_server in self._peers()]
+        return all([future.result() for future in futures])
 
-    def rebalance_objects(self):
+    def delete_objects(self, object_keys, erasure_coded_objects=()):
         """
-        Rebalances objects across object servers at regular intervals.
+        Deletes a batch of objects from all object servers in the cluster.
+
+        The deletes are grouped by object server, so every object server is sent a single batch,
+        and the batches are sent concurrently.
+
+        Args:
+        - object_keys: The keys of the objects to delete.
+        - erasure_coded_objects: (object_key, metadata) pairs of the erasure-coded objects among
+          them, whose shards are deleted from the object servers holding them as well.
+
+        Returns:
+        - A dict mapping the IDs of the nodes that failed to delete their batch to the error.
         """
-        while True:
-            self.rebalance_objects_using_load_balancing()
-            time.sleep(self.rebalance_interval)
+        object_keys = list(object_keys)
+        with self._lock:
+            for hints in self.hinted_handoffs.values():
+                for object_key in object_keys:
+                    hints.pop(object_key, None)
+
+        batches = {self._node_id(object_server): (object_server.storage_backend, list(object_keys))
+                   for object_server in self._peers()}
+        for object_key, metadata in erasure_coded_objects:
+            for shard_index, node_id in enumerate(metadata.shard_nodes):
+                if node_id not in batches:
+                    storage_backend = self._storage_backend_for(node_id) if node_id else None
+                    if storage_backend is None:
+                        continue
+                    batches[node_id] = (storage_backend, [])
+                batches[node_id][1].append(shard_key(object_key, shard_index))
+
+        futures = {node_id: self._replication_executor.submit(storage_backend.delete_objects, batch)
+                   for node_id, (storage_backend, batch) in batches.items()}
+        errors = {}
+        for node_id, future in futures.items():
+            try:
+                failed_keys = future.result()
+            except Exception as e:
+                errors[node_id] = e
+                continue
+            if failed_keys:
+                errors[node_id] = OSError(f"{len(failed_keys)} of {len(batches[node_id][1])} objects were not deleted.")
+        for node_id, error in errors.items():
+            print(f"Error deleting objects from {node_id}: {error}")
+        return errors
 
-    def exchange_heartbeats(self):
+    def replay_hinted_handoffs_periodically(self):
         """
-        Exchanges heartbeats with all object servers in the cluster at regular intervals.
+        Retries writing the replicas that could not be written at regular intervals.
         """
-        while True:
-            for object_server in self.object_servers:
-                if object_server != self:
-                    object_server.send_heartbeat()
-            time.sleep(self.heartbeat_interval)
+        while not self._stopped.wait(self.hint_replay_interval):
+            try:
+                self.replay_hinted_handoffs()
+            except Exception as e:
+                print(f"Error replaying hinted handoffs: {e}")
 
-    def send_heartbeat(self):
+    def on_membership_change(self, node_id, address, state):
         """
-        Sends a heartbeat message to all object servers in the cluster.
+        Updates the cluster when the membership protocol detects a member joining, failing or recovering.
+        Dead object servers are left out of replication and placement until they are alive again.
+
+        Args:
+        - node_id: The ID of the member.
+        - address: The gossip address of the member.
+        - state: The new state of the member.
         """
-        heartbeat_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        heartbeat_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        heartbeat_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        heartbeat_message = "heartbeat".encode()
-        heartbeat_socket.sendto(heartbeat_message, ('<broadcast>', self.heartbeat_port))
-        heartbeat_socket.close()
+        if state != DEAD and node_id != self.local_node_id and self.peer_factory is not None:
+            with self._lock:
+                known = any(self._node_id(object_server) == node_id for object_server in self.object_servers)
+            if not known:
+                self.add_object_server(self.peer_factory(node_id))
+        self.update_ring()
 
     def replicate_object_using_consensus(self, object_key: str, object_data: bytes):
         """
-        Replicates an object to all object servers in the cluster using consensus.
+        Replicates an object to all object servers in the cluster using consensus, writing to them
+        concurrently and waiting for all of them.
 
         Args:
         - object_key: The key of the object to replicate.
         - object_data: The data of the object to replicate.
         """
-        num_replicas = len(self.object_servers) * self.redundancy_factor
-        num_successful_replicas = 0
-        failed_replicas = []
-        for object_server in self.object_servers:
-            if object_server != self:
-                if object_server.storage_backend.write_object(object_key, object_data):
-                    num_successful_replicas += 1
-                else:
-                    failed_replicas.append(object_server)
+        peers = self._peers()
+        if not peers:
+            return
+        num_replicas = len(peers)
+        futures = {self._submit_replica(object_server, object_key, object_data, None): object_server
+                   for object_server in peers}
+        failed_replicas = [futures[future] for future in as_completed(futures) if not future.result()]
+        num_successful_replicas = num_replicas - len(failed_replicas)
         if num_successful_replicas / num_replicas < self.consensus_threshold:
             # Retry failed replicas
-            for object_server in failed_replicas:
-                if object_server.storage_backend.write_object(object_key, object_data):
-                    num_successful_replicas += 1
+            futures = {self._submit_replica(object_server, object_key, object_data, None): object_server
+                       for object_server in failed_replicas}
+            failed_replicas = [futures[future] for future in as_completed(futures) if not future.result()]
+            num_successful_replicas = num_replicas - len(failed_replicas)
             # If still below consensus threshold, remove failed object servers
             if num_successful_replicas / num_replicas < self.consensus_threshold:
                 for object_server in failed_replicas:
                     self.remove_object_server(object_server)
 
-    def rebalance_objects_using_load_balancing(self):
-        """
-        Rebalances objects across object servers using load balancing.
-        """
-        # Get the number of objects in each object server
-        num_objects = []
-        for object_server in self.object_servers:
-            num_objects.append(len(object_server.storage_backend.objects))
-        # Calculate the average number of objects per object server
-        avg_num_objects = sum(num_objects) / len(num_objects)
-        # Find the object server with the most objects
-        max_num_objects = max(num_objects)
-        max_object_server = self.object_servers[num_objects.index(max_num_objects)]
-        # Find the object server with the least objects
-        min_num_objects = min(num_objects)
-        min_object_server = self.object_servers[num_objects.index(min_num_objects)]
-        # If the difference between the max and min number of objects is greater than the average number of objects per object server
-        if max_num_objects - min_num_objects > avg_num_objects:
-            # Move objects from the max object server to the min object server
-            num_objects_to_move = (max_num_objects - min_num_objects) // 2
-            objects_to_move = max_object_server.storage_backend.get_objects(num_objects_to_move)
-            for obj in objects_to_move:
-                min_object_server.storage_backend.write_object(obj.key, obj.data)
-
-    def use_redundancy(self):
-        """
-        Replicates all objects in the cluster to maintain redundancy.
-        """
-        for object_server in self.object_servers:
-            for obj in object_server.storage_backend.objects:
-                for i in range(self.redundancy_factor - 1):
-                    object_server.storage_backend.write_object(obj.key, obj.data)
-
     def start(self):
         """
-        Starts the cluster by starting the heartbeat and rebalance threads.
+        Starts the cluster by starting the membership protocol and the hinted handoff thread.
         """
-        heartbeat_thread = threading.Thread(target=self.exchange_heartbeats)
-        heartbeat_thread.daemon = True
-        heartbeat_thread.start()
+        if self.membership is not None:
+            self.membership.start()
+
+        self._stopped.clear()
+        self._hinted_handoff_thread = threading.Thread(target=self.replay_hinted_handoffs_periodically,
+                                                       name='hinted-handoffs', daemon=True)
+        self._hinted_handoff_thread.start()
 
-        rebalance_thread = threading.Thread(target=self.rebalance_objects)
-        rebalance_thread.daemon = True
-        rebalance_thread.start()
+    def stop(self, timeout=None):
+        """
+        Stops the membership protocol and the hinted handoff thread.
+
+        Args:
+        - timeout: The maximum time (in seconds) to wait for the thread, or None to wait until it stops.
+        """
+        self._stopped.set()
+        if self.membership is not None:
+            self.membership.stop()
+        if self._hinted_handoff_thread is not None:
+            self._hinted_handoff_thread.join(timeout)
+            self._hinted_handoff_thread = None
@@ -1,19 +1,31 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
+import zlib
 from unittest.mock import MagicMock
 
+from erasure_coding import NotEnoughShardsError, shard_key
+from membership import ALIVE, DEAD, SUSPECT
+from object_metadata import ObjectMetadata
 from object_server_cluster import ObjectServerCluster
+from storage_backend import DiskStorageBackend
 
 
 class TestObjectServerCluster(unittest.TestCase):
 
     def setUp(self):
         self.object_server_cluster = ObjectServerCluster()
+        self.addCleanup(self.object_server_cluster.shutdown)
 
     def test_replicate_object(self):
         object_key = "test_key"
         object_data = b"test_data"
         self.object_server_cluster.object_servers = [MagicMock(), MagicMock()]
         self.object_server_cluster.replicate_object(object_key, object_data)
+        self.object_server_cluster.wait_for_replicas()
         for object_server in self.object_server_cluster.object_servers:
             if object_server != self.object_server_cluster:
                 object_server.storage_backend.write_object.assert_called_once_with(object_key, object_data)
@@ -26,21 +38,6 @@ class TestObjectServerCluster(unittest.TestCase):
             if object_server != self.object_server_cluster:
                 object_server.storage_backend.delete_object.assert_called_once_with(object_key)
 
-    def test_rebalance_objects(self):
-        self.object_server_cluster.rebalance_objects_using_load_balancing = MagicMock()
-        self.object_server_cluster.rebalance_interval = 1
-        self.object_server_cluster.rebalance_objects()
-        self.object_server_cluster.rebalance_objects_using_load_balancing.assert_called_once()
-        self.assertEqual(self.object_server_cluster.rebalance_objects_using_load_balancing.call_count, 1)
-
-    def test_exchange_heartbeats(self):
-        self.object_server_cluster.send_heartbeat = MagicMock()
-        self.object_server_cluster.heartbeat_interval = 1
-        self.object_server_cluster.exchange_heartbeats()
-        self.object_server_cluster.send_heartbeat.assert_called_once()
-        self.assertEqual(self.object_server_cluster.send_heartbeat.call_count,
-                         len(self.object_server_cluster.object_servers) - 1)
-
     def test_replicate_object_using_consensus(self):
         object_key = "test_key"
         object_data = b"test_data"
@@ -52,20 +49,324 @@ class TestObjectServerCluster(unittest.TestCase):
             if object_server != self.object_server_cluster:
                 object_server.storage_backend.write_object.assert_called_once_with(object_key, object_data)
 
-    def test_rebalance_objects_using_load_balancing(self):
-        self.object_server_cluster.object_servers = [MagicMock(), MagicMock()]
-        self.object_server_cluster.storage_backend.get_objects = MagicMock(return_value=[MagicMock(), MagicMock()])
-        self.object_server_cluster.rebalance_objects_using_load_balancing()
-        self.assertEqual(self.object_server_cluster.storage_backend.write_object.call_count, 1)
+    def test_replicate_object_returns_at_write_quorum(self):
+        release = threading.Event()
+        slow_object_server = MagicMock()
+        slow_object_server.storage_backend.write_object.side_effect = lambda *args: release.wait(5)
+        self.object_server_cluster.object_servers = [MagicMock(), slow_object_server]
+        self.object_server_cluster.write_quorum = 2
 
-    def test_use_redundancy(self):
-        self.object_server_cluster.object_servers = [MagicMock(), MagicMock()]
-        self.object_server_cluster.storage_backend.objects = [MagicMock(), MagicMock()]
-        self.object_server_cluster.redundancy_factor = 2
-        self.object_server_cluster.use_redundancy()
-        for object_server in self.object_server_cluster.object_servers:
-            for obj in object_server.storage_backend.objects:
-                object_server.storage_backend.write_object.assert_called_once_with(obj.key, obj.data)
+        self.assertTrue(self.object_server_cluster.replicate_object("test_key", b"test_data"))
+        self.assertEqual(len(self.object_server_cluster._pending_replicas), 1)
+
+        release.set()
+        self.object_server_cluster.wait_for_replicas()
+        slow_object_server.storage_backend.write_object.assert_called_once_with("test_key", b"test_data")
+
+    def test_replicate_object_writes_metadata(self):
+        metadata = MagicMock()
+        object_server = MagicMock()
+        self.object_server_cluster.object_servers = [object_server]
+        self.object_server_cluster.replicate_object("test_key", lambda: iter([b"test_data"]), metadata)
+        self.object_server_cluster.wait_for_replicas()
+        write_object_with_metadata = object_server.storage_backend.write_object_with_metadata
+        write_object_with_metadata.assert_called_once()
+        self.assertEqual(write_object_with_metadata.call_args[0][0], "test_key")
+        self.assertEqual(list(write_object_with_metadata.call_args[0][1]), [b"test_data"])
+        self.assertIs(write_object_with_metadata.call_args[0][2], metadata)
+
+    def test_replicate_object_below_write_quorum_keeps_hints(self):
+        down_object_server = MagicMock()
+        down_object_server.storage_backend.write_object.side_effect = ConnectionError()
+        self.object_server_cluster.object_servers = [down_object_server]
+        self.object_server_cluster.write_quorum = 2
+
+        self.assertFalse(self.object_server_cluster.replicate_object("test_key", b"test_data"))
+        self.assertEqual(self.object_server_cluster.hinted_handoffs,
+                         {down_object_server: {"test_key": (b"test_data", None)}})
+
+        down_object_server.storage_backend.write_object.side_effect = None
+        self.object_server_cluster.replay_hinted_handoffs()
+        self.assertEqual(self.object_server_cluster.hinted_handoffs, {})
+        self.assertEqual(down_object_server.storage_backend.write_object.call_count, 2)
+
+    def test_replicate_object_times_out_on_hung_replicas(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        hung_object_server = MagicMock()
+        hung_object_server.storage_backend.write_object.side_effect = lambda *args: release.wait(5)
+        self.object_server_cluster.object_servers = [hung_object_server]
+        self.object_server_cluster.write_quorum = 2
+        self.object_server_cluster.replica_timeout = 0.1
+
+        self.assertFalse(self.object_server_cluster.replicate_object("test_key", b"test_data"))
+        self.assertEqual(self.object_server_cluster.hinted_handoffs,
+                         {hung_object_server: {"test_key": (b"test_data", None)}})
+
+        # the write finishing after all makes the hint stale
+        release.set()
+        self.object_server_cluster.wait_for_replicas()
+        self.assertEqual(self.object_server_cluster.hinted_handoffs, {})
+
+    def test_delete_object_drops_hints(self):
+        down_object_server = MagicMock()
+        down_object_server.storage_backend.write_object.side_effect = ConnectionError()
+        self.object_server_cluster.object_servers = [down_object_server]
+        self.object_server_cluster.replicate_object("test_key", b"test_data")
+        self.object_server_cluster.wait_for_replicas()
+
+        self.object_server_cluster.delete_object("test_key")
+        self.object_server_cluster.replay_hinted_handoffs()
+
+        self.assertEqual(down_object_server.storage_backend.write_object.call_count, 1)
+
+    def test_failed_delete_keeps_hint(self):
+        down_object_server = MagicMock()
+        down_object_server.storage_backend.delete_object.side_effect = ConnectionError()
+        self.object_server_cluster.object_servers = [MagicMock(), down_object_server]
+
+        self.assertFalse(self.object_server_cluster.delete_object("test_key"))
+        self.assertEqual(self.object_server_cluster.hinted_handoffs,
+                         {down_object_server: {"test_key": (None, None)}})
+
+        down_object_server.storage_backend.delete_object.side_effect = None
+        self.object_server_cluster.replay_hinted_handoffs()
+        self.assertEqual(self.object_server_cluster.hinted_handoffs, {})
+        self.assertEqual(down_object_server.storage_backend.delete_object.call_count, 2)
+        down_object_server.storage_backend.write_object.assert_not_called()
+
+    def test_written_replica_drops_stale_hint(self):
+        object_server = MagicMock()
+        object_server.storage_backend.write_object_with_metadata.side_effect = ConnectionError()
+        self.object_server_cluster.write_replica(object_server, "test_key", b"old_data",
+                                                 ObjectMetadata(last_modified=1))
+
+        object_server.storage_backend.write_object_with_metadata.side_effect = None
+        self.assertTrue(self.object_server_cluster.write_replica(object_server, "test_key", b"new_data",
+                                                                 ObjectMetadata(last_modified=2)))
+        self.assertEqual(self.object_server_cluster.hinted_handoffs, {})
+
+        # a slow write finishing after a newer one failed leaves the newer hint in place
+        newer_metadata = ObjectMetadata(last_modified=4)
+        object_server.storage_backend.write_object_with_metadata.side_effect = ConnectionError()
+        self.object_server_cluster.write_replica(object_server, "test_key", b"newer_data", newer_metadata)
+        object_server.storage_backend.write_object_with_metadata.side_effect = None
+        self.object_server_cluster.write_replica(object_server, "test_key", b"new_data",
+                                                 ObjectMetadata(last_modified=3))
+        self.assertEqual(self.object_server_cluster.hinted_handoffs,
+                         {object_server: {"test_key": (b"newer_data", newer_metadata)}})
+
+    def test_start_replays_hints_until_stopped(self):
+        object_server = MagicMock()
+        object_server.storage_backend.write_object.side_effect = ConnectionError()
+        self.object_server_cluster.write_replica(object_server, "test_key", b"test_data")
+        object_server.storage_backend.write_object.side_effect = None
+        self.object_server_cluster.hint_replay_interval = 0.01
+
+        self.object_server_cluster.start()
+        self.addCleanup(self.object_server_cluster.stop)
+        for _ in range(500):
+            if not self.object_server_cluster.hinted_handoffs:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.object_server_cluster.hinted_handoffs, {})
+
+        self.object_server_cluster.stop(timeout=5)
+        self.assertFalse(any(thread.name == 'hinted-handoffs' for thread in threading.enumerate()))
+
+    def test_replicate_object_using_consensus_removes_failed_servers(self):
+        down_object_server = MagicMock()
+        down_object_server.storage_backend.write_object.side_effect = ConnectionError()
+        self.object_server_cluster.object_servers = [MagicMock(), down_object_server, down_object_server]
+        self.object_server_cluster.consensus_threshold = 0.5
+        self.object_server_cluster.replicate_object_using_consensus("test_key", b"test_data")
+        self.assertEqual(len(self.object_server_cluster.object_servers), 1)
+
+    def test_replicate_object_writes_to_ring_owners(self):
+        object_servers = [MagicMock(node_id=f'server-{i}') for i in range(5)]
+        for object_server in object_servers:
+            self.object_server_cluster.add_object_server(object_server)
+        owners = self.object_server_cluster.owners("test_key")
+        self.assertEqual(len(owners), self.object_server_cluster.redundancy_factor)
+        self.object_server_cluster.replicate_object("test_key", b"test_data")
+        self.object_server_cluster.wait_for_replicas()
+        for object_server in object_servers:
+            self.assertEqual(object_server.storage_backend.write_object.called, object_server.node_id in owners)
+
+    def test_movement_plan_after_adding_object_server(self):
+        for i in range(3):
+            self.object_server_cluster.add_object_server(MagicMock(node_id=f'server-{i}'))
+        self.object_server_cluster.finish_movement(self.object_server_cluster.previous_ring)
+        self.assertEqual(list(self.object_server_cluster.movement_plan(["a", "b"])), [])
+
+        self.object_server_cluster.add_object_server(MagicMock(node_id='server-3'))
+        previous_ring = self.object_server_cluster.previous_ring
+        object_keys = [f"key-{i}" for i in range(1000)]
+        moves = list(self.object_server_cluster.movement_plan(object_keys))
+        self.assertTrue(moves)
+        for object_key, old_owners, new_owners in moves:
+            self.assertIn('server-3', new_owners)
+            self.assertNotIn('server-3', old_owners)
+        self.object_server_cluster.finish_movement(previous_ring)
+        self.assertIsNone(self.object_server_cluster.previous_ring)
+
+    def test_write_and_read_shards(self):
+        base_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_path)
+        for i in range(6):
+            self.object_server_cluster.add_object_server(
+                MagicMock(node_id=f'server-{i}', storage_backend=DiskStorageBackend(os.path.join(base_path, str(i)))))
+        stored_data = os.urandom(2500)
+        metadata = ObjectMetadata(blocks=[[1000, 0], [1000, 0], [500, 0]], data_shards=4, parity_shards=2)
+
+        stored_ranges = []
+
+        def read_stored_range(offset, length):
+            stored_ranges.append((offset, length))
+            return [stored_data[offset:offset + length]]
+
+        metadata.shard_nodes = self.object_server_cluster.write_shards("test_key", metadata, read_stored_range)
+        self.assertEqual(sorted(metadata.shard_nodes), [f'server-{i}' for i in range(6)])
+        # every block is read once for all of the shards
+        self.assertEqual(stored_ranges, [(0, 1000), (1000, 1000), (2000, 500)])
+        self.assertEqual(b''.join(self.object_server_cluster.read_shards("test_key", metadata, 0, 2500)), stored_data)
+
+        # any two shards can be lost
+        for shard_index in [0, 3]:
+            object_server = self.object_server_cluster.get_object_server(metadata.shard_nodes[shard_index])
+            object_server.storage_backend.delete_object(shard_key("test_key", shard_index))
+        self.assertEqual(b''.join(self.object_server_cluster.read_shards("test_key", metadata, 1000, 1500)),
+                         stored_data[1000:])
+
+        object_server = self.object_server_cluster.get_object_server(metadata.shard_nodes[1])
+        object_server.storage_backend.delete_object(shard_key("test_key", 1))
+        with self.assertRaises(NotEnoughShardsError):
+            list(self.object_server_cluster.read_shards("test_key", metadata, 0, 2500))
+
+        self.object_server_cluster.delete_shards("test_key", metadata)
+        for shard_index, node_id in enumerate(metadata.shard_nodes):
+            object_server = self.object_server_cluster.get_object_server(node_id)
+            self.assertFalse(object_server.storage_backend.object_exists(shard_key("test_key", shard_index)))
+
+    def test_read_shards_rebuilds_blocks_from_healthy_shards(self):
+        base_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_path)
+        for i in range(6):
+            self.object_server_cluster.add_object_server(
+                MagicMock(node_id=f'server-{i}', storage_backend=DiskStorageBackend(os.path.join(base_path, str(i)))))
+        stored_data = os.urandom(2500)
+        blocks = [[1000, zlib.crc32(stored_data[:1000])], [1000, zlib.crc32(stored_data[1000:2000])],
+                  [500, zlib.crc32(stored_data[2000:])]]
+        metadata = ObjectMetadata(blocks=blocks, data_shards=4, parity_shards=2)
+        metadata.shard_nodes = self.object_server_cluster.write_shards(
+            "test_key", metadata, lambda offset, length: [stored_data[offset:offset + length]])
+
+        def verify_block(block_number, block):
+            if zlib.crc32(block) != blocks[block_number][1]:
+                raise ValueError("Checksum mismatch.")
+
+        storage_backend = self.object_server_cluster.get_object_server(metadata.shard_nodes[0]).storage_backend
+        shard = storage_backend.read_object(shard_key("test_key", 0))
+        storage_backend.write_object(shard_key("test_key", 0), shard[:300] + bytes([shard[300] ^ 1]) + shard[301:])
+        self.assertNotEqual(b''.join(self.object_server_cluster.read_shards("test_key", metadata, 0, 2500)),
+                            stored_data)
+
+        self.assertEqual(b''.join(self.object_server_cluster.read_shards("test_key", metadata, 0, 2500,
+                                                                         verify_block)), stored_data)
+        self.object_server_cluster.wait_for_replicas()
+        self.assertEqual(storage_backend.read_object(shard_key("test_key", 0)), shard)
+
+        # blocks no combination of shards rebuilds fail verification
+        for shard_index in range(3):
+            storage_backend = self.object_server_cluster.get_object_server(metadata.shard_nodes[shard_index]).storage_backend
+            shard = storage_backend.read_object(shard_key("test_key", shard_index))
+            storage_backend.write_object(shard_key("test_key", shard_index), bytes([shard[0] ^ 1]) + shard[1:])
+        with self.assertRaises(ValueError):
+            list(self.object_server_cluster.read_shards("test_key", metadata, 0, 1000, verify_block))
+
+    def test_rebuild_block(self):
+        base_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_path)
+        for i in range(6):
+            self.object_server_cluster.add_object_server(
+                MagicMock(node_id=f'server-{i}', storage_backend=DiskStorageBackend(os.path.join(base_path, str(i)))))
+        stored_data = os.urandom(2500)
+        blocks = [[1000, zlib.crc32(stored_data[:1000])], [1000, zlib.crc32(stored_data[1000:2000])],
+                  [500, zlib.crc32(stored_data[2000:])]]
+        metadata = ObjectMetadata(blocks=blocks, data_shards=4, parity_shards=2)
+        metadata.shard_nodes = self.object_server_cluster.write_shards(
+            "test_key", metadata, lambda offset, length: [stored_data[offset:offset + length]])
+
+        def decode_block(block_number, block):
+            if zlib.crc32(block) != blocks[block_number][1]:
+                raise ValueError("Checksum mismatch.")
+            return block.upper()
+
+        storage_backend = self.object_server_cluster.get_object_server(metadata.shard_nodes[2]).storage_backend
+        shard = storage_backend.read_object(shard_key("test_key", 2))
+        storage_backend.write_object(shard_key("test_key", 2), shard[:300] + bytes([shard[300] ^ 1]) + shard[301:])
+        self.assertEqual(self.object_server_cluster.rebuild_block("test_key", metadata, 1, decode_block),
+                         stored_data[1000:2000].upper())
+        # the corrupted shard is rewritten in the background
+        self.object_server_cluster.wait_for_replicas()
+        self.assertEqual(storage_backend.read_object(shard_key("test_key", 2)), shard)
+
+        for shard_index in range(3):
+            self.object_server_cluster.get_object_server(metadata.shard_nodes[shard_index]).storage_backend.delete_object(
+                shard_key("test_key", shard_index))
+        with self.assertRaises(NotEnoughShardsError):
+            self.object_server_cluster.rebuild_block("test_key", metadata, 0, decode_block)
+
+    def test_delete_objects_in_one_batch_per_node(self):
+        base_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_path)
+        for i in range(3):
+            self.object_server_cluster.add_object_server(
+                MagicMock(node_id=f'server-{i}', storage_backend=DiskStorageBackend(os.path.join(base_path, str(i)))))
+        down_object_server = MagicMock(node_id='down')
+        down_object_server.storage_backend.delete_objects.side_effect = ConnectionError()
+        self.object_server_cluster.add_object_server(down_object_server)
+        for object_server in self.object_server_cluster.object_servers[:3]:
+            object_server.storage_backend.write_object("a", b"data")
+        metadata = ObjectMetadata(shard_nodes=['server-0', 'server-1', '', 'down'])
+        self.object_server_cluster.get_object_server('server-1').storage_backend.write_object(shard_key("b", 1), b"shard")
+
+        errors = self.object_server_cluster.delete_objects(["a", "b"], [("b", metadata)])
+
+        self.assertEqual(list(errors), ['down'])
+        down_object_server.storage_backend.delete_objects.assert_called_once_with(["a", "b", shard_key("b", 3)])
+        for object_server in self.object_server_cluster.object_servers[:3]:
+            self.assertEqual(list(object_server.storage_backend.list_objects()), [])
+        self.assertFalse(self.object_server_cluster.get_object_server('server-1').storage_backend.object_exists(
+            shard_key("b", 1)))
+
+    def test_write_shards_below_quorum(self):
+        down_object_server = MagicMock(node_id='down')
+        down_object_server.storage_backend.write_object_stream.side_effect = ConnectionError()
+        self.object_server_cluster.object_servers = [MagicMock(node_id='up'), down_object_server]
+        metadata = ObjectMetadata(blocks=[[4, 0]])
+        self.assertIsNone(self.object_server_cluster.write_shards("test_key", metadata, lambda offset, length: [b'data']))
+
+    def test_dead_object_servers_are_left_out(self):
+        object_servers = [MagicMock(node_id='up'), MagicMock(node_id='down')]
+        self.object_server_cluster.object_servers = list(object_servers)
+        self.object_server_cluster.membership = MagicMock()
+        self.object_server_cluster.membership.state.side_effect = lambda node_id: DEAD if node_id == 'down' else ALIVE
+        self.object_server_cluster.on_membership_change('down', ('localhost', 5001), DEAD)
+
+        self.assertEqual(self.object_server_cluster.owners("test_key"), ['up'])
+        self.object_server_cluster.replicate_object("test_key", b"test_data")
+        self.object_server_cluster.wait_for_replicas()
+        object_servers[0].storage_backend.write_object.assert_called_once_with("test_key", b"test_data")
+        object_servers[1].storage_backend.write_object.assert_not_called()
+
+    def test_joined_members_become_object_servers(self):
+        self.object_server_cluster.peer_factory = lambda node_id: MagicMock(node_id=node_id)
+        self.object_server_cluster.on_membership_change('new', ('localhost', 5001), ALIVE)
+        self.object_server_cluster.on_membership_change('new', ('localhost', 5001), SUSPECT)
+        self.assertEqual([object_server.node_id for object_server in self.object_server_cluster.object_servers],
+                         ['new'])
+        self.assertEqual(self.object_server_cluster.owners("test_key"), ['new'])
 
 
 if __name__ == '__main__':
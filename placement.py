@@ -0,0 +1,117 @@
+import bisect
+import hashlib
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """
+    A consistent hash ring mapping object keys to the nodes that own them.
+
+    Every node is placed on the ring at a number of virtual node positions proportional to its
+    weight. The owners of a key are the first distinct nodes found walking the ring clockwise
+    from the hash of the key, so adding or removing a node only changes the owners of the keys
+    next to its positions, about 1/N of all keys.
+
+    Attributes:
+    - vnodes_per_weight: The number of virtual nodes placed on the ring per unit of weight.
+    - nodes: A dict mapping the IDs of the nodes on the ring to their weights.
+    """
+
+    def __init__(self, vnodes_per_weight=100):
+        """
+        Initializes a new instance of the HashRing class.
+
+        Args:
+        - vnodes_per_weight: The number of virtual nodes placed on the ring per unit of weight.
+        """
+        self.vnodes_per_weight = vnodes_per_weight
+        self.nodes = {}
+        self._positions = []
+        self._position_nodes = []
+
+    def add_node(self, node_id, weight=1):
+        """
+        Adds a node to the ring, or changes its weight if it is already on the ring.
+
+        Args:
+        - node_id: The ID of the node.
+        - weight: The share of keys the node owns relative to the other nodes.
+        """
+        if weight <= 0:
+            raise ValueError("Node weight must be positive.")
+        self.nodes[node_id] = weight
+        self._build()
+
+    def remove_node(self, node_id):
+        """
+        Removes a node from the ring.
+
+        Args:
+        - node_id: The ID of the node.
+        """
+        del self.nodes[node_id]
+        self._build()
+
+    def owners(self, object_key, num_owners):
+        """
+        Returns the nodes that own an object.
+
+        Args:
+        - object_key: The key of the object.
+        - num_owners: The number of owners to return; fewer are returned if the ring has fewer nodes.
+
+        Returns:
+        - A list of node IDs, the primary owner first.
+        """
+        num_owners = min(num_owners, len(self.nodes))
+        owners = []
+        if num_owners <= 0:
+            return owners
+        index = bisect.bisect(self._positions, _hash(object_key))
+        while len(owners) < num_owners:
+            node_id = self._position_nodes[index % len(self._position_nodes)]
+            if node_id not in owners:
+                owners.append(node_id)
+            index += 1
+        return owners
+
+    def copy(self):
+        """
+        Returns a copy of the ring that can be changed independently of this one.
+        """
+        ring = HashRing(self.vnodes_per_weight)
+        ring.nodes = dict(self.nodes)
+        ring._positions = self._positions
+        ring._position_nodes = self._position_nodes
+        return ring
+
+    def _build(self):
+        positions = sorted((_hash(f'{node_id}#{vnode}'), node_id)
+                           for node_id, weight in self.nodes.items()
+                           for vnode in range(max(1, round(weight * self.vnodes_per_weight))))
+        self._positions = [position for position, _ in positions]
+        self._position_nodes = [node_id for _, node_id in positions]
+
+
+def plan_movement(old_ring, new_ring, object_keys, num_owners):
+    """
+    Computes which objects change owners between two rings.
+
+    Args:
+    - old_ring: The ring before the membership change.
+    - new_ring: The ring after the membership change.
+    - object_keys: An iterable over the keys of the objects to plan for.
+    - num_owners: The number of owners of every object.
+
+    Returns:
+    - An iterator over (object_key, old_owners, new_owners) tuples for the objects whose owners
+      change; every other object stays where it is.
+    """
+    for object_key in object_keys:
+        old_owners = old_ring.owners(object_key, num_owners)
+        new_owners = new_ring.owners(object_key, num_owners)
+        if set(old_owners) != set(new_owners):
+            yield object_key, old_owners, new_owners
@@ -0,0 +1,48 @@
+import unittest
+from collections import Counter
+
+from placement import HashRing, plan_movement
+
+
+class TestHashRing(unittest.TestCase):
+
+    def setUp(self):
+        self.ring = HashRing()
+        for node_id in ['a', 'b', 'c']:
+            self.ring.add_node(node_id)
+        self.object_keys = [f"bucket/key-{i}" for i in range(3000)]
+
+    def test_owners_are_distinct_and_deterministic(self):
+        owners = self.ring.owners("bucket/key", 2)
+        self.assertEqual(len(set(owners)), 2)
+        self.assertEqual(self.ring.copy().owners("bucket/key", 2), owners)
+        self.assertEqual(len(self.ring.owners("bucket/key", 5)), 3)
+        self.assertEqual(HashRing().owners("bucket/key", 2), [])
+
+    def test_weights_skew_distribution(self):
+        self.ring.add_node('c', 2)
+        primaries = Counter(self.ring.owners(object_key, 1)[0] for object_key in self.object_keys)
+        self.assertGreater(primaries['c'], primaries['a'])
+        self.assertGreater(primaries['c'], primaries['b'])
+        with self.assertRaises(ValueError):
+            self.ring.add_node('d', 0)
+
+    def test_adding_node_moves_few_keys(self):
+        new_ring = self.ring.copy()
+        new_ring.add_node('d')
+        moves = list(plan_movement(self.ring, new_ring, self.object_keys, 1))
+        # about a quarter of the keys move, all of them to the new node
+        self.assertLess(len(moves), len(self.object_keys) / 3)
+        for object_key, old_owners, new_owners in moves:
+            self.assertEqual(new_owners, ['d'])
+
+    def test_removing_node_moves_only_its_keys(self):
+        new_ring = self.ring.copy()
+        new_ring.remove_node('b')
+        self.assertEqual(set(self.ring.nodes), {'a', 'b', 'c'})
+        for object_key, old_owners, new_owners in plan_movement(self.ring, new_ring, self.object_keys, 2):
+            self.assertIn('b', old_owners)
+
+
+if __name__ == '__main__':
+    unittest.main()
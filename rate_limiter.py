@@ -0,0 +1,50 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    A token bucket limiting the rate of some work, such as the bytes copied per second.
+
+    Tokens are added at a constant rate up to the size of the bucket, and taking more tokens
+    than are available waits until enough have been added. Taking more tokens than the bucket
+    holds is allowed and waits as long as the rate requires, so large items are not starved.
+
+    Attributes:
+    - rate: The number of tokens added per second, or None for no limit.
+    - capacity: The most tokens the bucket holds, bounding the size of bursts.
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        """
+        Initializes a new instance of the TokenBucket class.
+
+        Args:
+        - rate: The number of tokens added per second, or None for no limit.
+        - capacity: The most tokens the bucket holds; defaults to one second's worth.
+        - clock: A callable returning the current time in seconds.
+        - sleep: A callable waiting for a number of seconds.
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens):
+        """
+        Takes a number of tokens from the bucket, waiting until they are available.
+        """
+        if self.rate is None:
+            return
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # go into debt so that concurrent callers queue up behind this one
+            self._tokens -= tokens
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait > 0:
+            self._sleep(wait)
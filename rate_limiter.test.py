@@ -0,0 +1,48 @@
+import unittest
+
+from rate_limiter import TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestTokenBucket(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.token_bucket = TokenBucket(100, clock=self.clock, sleep=self.clock.sleep)
+
+    def test_burst_does_not_wait(self):
+        self.token_bucket.acquire(100)
+        self.assertEqual(self.clock.now, 0)
+
+    def test_waits_for_tokens(self):
+        self.token_bucket.acquire(100)
+        self.token_bucket.acquire(50)
+        self.assertEqual(self.clock.now, 0.5)
+        self.token_bucket.acquire(300)
+        self.assertEqual(self.clock.now, 3.5)
+
+    def test_refills_up_to_capacity(self):
+        self.token_bucket.acquire(100)
+        self.clock.now = 10
+        self.token_bucket.acquire(100)
+        self.assertEqual(self.clock.now, 10)
+        self.token_bucket.acquire(1)
+        self.assertEqual(self.clock.now, 10.01)
+
+    def test_no_limit(self):
+        token_bucket = TokenBucket(None, clock=self.clock, sleep=self.clock.sleep)
+        token_bucket.acquire(10 ** 12)
+        self.assertEqual(self.clock.now, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
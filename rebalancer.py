@@ -0,0 +1,278 @@
+import itertools
+import json
+import os
+import threading
+import uuid
+
+from object_pipeline import CHUNK_SIZE
+from rate_limiter import TokenBucket
+
+
+class Rebalancer:
+    """
+    Moves objects to the object servers that own them in the background.
+
+    After the membership of the cluster changes, the rebalancer walks the keys of the local
+    objects in order, a batch at a time, and copies the objects whose owners changed to their new
+    owners. Its position is saved to a checkpoint after every batch, so a restarted server resumes
+    where it stopped instead of starting over. Copies are rate limited so that rebalancing does
+    not starve requests of bandwidth. Request handlers only hint the rebalancer about the objects
+    they wrote, which it then checks are up to date on all of their owners, so requests never wait
+    for data to move. Once every owner of an object holds it, the copy of an object server that no
+    longer owns it is removed.
+
+    Attributes:
+    - object_server_cluster: The cluster whose objects are rebalanced.
+    - storage_backend: The storage backend holding the local objects.
+    - key_index: The index of the local objects, if any.
+    - object_cache: The cache of the local objects, if any.
+    - checkpoint_path: The file the position of the walk is saved to, or None to not save it.
+    - batch_size: The number of keys handled between checkpoints.
+    - interval: The interval (in seconds) at which the rebalancer checks for work when not hinted.
+    - rate_limiter: The token bucket limiting the bytes copied per second.
+    - scanned_objects: The number of keys walked since the membership last changed.
+    - moved_objects: The number of objects copied to other object servers.
+    - moved_bytes: The number of bytes copied to other object servers.
+    - failed_objects: The number of copies that failed and were kept as hinted handoffs.
+    - removed_objects: The number of local objects removed once their owners held them.
+    - last_key: The last key walked, or None if no walk is in progress.
+    """
+
+    def __init__(self, object_server_cluster, storage_backend, key_index=None, object_cache=None,
+                 checkpoint_path=None, batch_size=100, bandwidth=50 * 1024 * 1024, interval=None):
+        """
+        Initializes a new instance of the Rebalancer class.
+
+        Args:
+        - object_server_cluster: The cluster whose objects are rebalanced.
+        - storage_backend: The storage backend holding the local objects.
+        - key_index: The index of the local objects, if any, updated when objects are removed.
+        - object_cache: The cache of the local objects, if any, invalidated when objects are removed.
+        - checkpoint_path: The file the position of the walk is saved to, or None to not save it.
+        - batch_size: The number of keys handled between checkpoints.
+        - bandwidth: The most bytes copied per second, or None for no limit.
+        - interval: The interval (in seconds) at which the rebalancer checks for work when not
+          hinted; defaults to the rebalance interval of the cluster.
+        """
+        self.object_server_cluster = object_server_cluster
+        self.storage_backend = storage_backend
+        self.key_index = key_index
+        self.object_cache = object_cache
+        self.checkpoint_path = checkpoint_path
+        self.batch_size = batch_size
+        self.interval = interval if interval is not None else object_server_cluster.rebalance_interval
+        self.rate_limiter = TokenBucket(bandwidth)
+        self.scanned_objects = 0
+        self.moved_objects = 0
+        self.moved_bytes = 0
+        self.failed_objects = 0
+        self.removed_objects = 0
+        self.last_key = None
+        # the nodes and weights of the ring the walk in progress moves objects to
+        self._target = None
+        self._hints = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def add_hint(self, object_key):
+        """
+        Hints the rebalancer that an object was written, without waiting for it to be handled.
+
+        Args:
+        - object_key: The key of the object.
+        """
+        with self._lock:
+            self._hints[object_key] = None
+        self._wake.set()
+
+    def progress(self):
+        """
+        Returns the progress of the rebalancer as a dict.
+        """
+        with self._lock:
+            pending_hints = len(self._hints)
+        return {
+            'state': 'idle' if self._target is None else 'moving',
+            'scanned_objects': self.scanned_objects,
+            'moved_objects': self.moved_objects,
+            'moved_bytes': self.moved_bytes,
+            'failed_objects': self.failed_objects,
+            'removed_objects': self.removed_objects,
+            'pending_hints': pending_hints,
+            'last_key': self.last_key,
+        }
+
+    def run_once(self):
+        """
+        Handles one batch of hinted objects and one batch of the walk in progress, if any.
+
+        Returns:
+        - True if there is more work left, False otherwise.
+        """
+        return self._handle_hints() | self._walk_batch()
+
+    def start(self):
+        """
+        Starts the rebalancer thread.
+        """
+        self._thread = threading.Thread(target=self._run, name='rebalancer', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stops the rebalancer thread after the batch it is handling.
+
+        Args:
+        - timeout: The maximum time (in seconds) to wait for the thread, or None to wait until it stops.
+        """
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.clear()
+            try:
+                more_work = self.run_once()
+            except Exception as e:
+                print(f"Error rebalancing objects: {e}. Retrying in {self.interval} seconds...")
+                more_work = False
+            if not more_work:
+                self._wake.wait(self.interval)
+
+    def _handle_hints(self):
+        with self._lock:
+            object_keys = list(itertools.islice(self._hints, self.batch_size))
+            for object_key in object_keys:
+                del self._hints[object_key]
+            more_hints = bool(self._hints)
+        for object_key in object_keys:
+            self._place_object(object_key, self.object_server_cluster.owners(object_key))
+        return more_hints
+
+    def _walk_batch(self):
+        object_server_cluster = self.object_server_cluster
+        object_server_cluster.update_ring()
+        previous_ring, ring = object_server_cluster.previous_ring, object_server_cluster.ring
+        if previous_ring is None:
+            return False
+
+        target = sorted(ring.nodes.items())
+        if target != self._target:
+            # the membership changed, so the walk starts over unless it was checkpointed for this ring
+            self._target = target
+            self.scanned_objects = 0
+            self.last_key = self._read_checkpoint(target)
+
+        object_keys = list(itertools.islice(self.storage_backend.list_objects(self.last_key or ''), self.batch_size))
+        if not object_keys:
+            object_server_cluster.finish_movement(previous_ring)
+            self._target = None
+            self.last_key = None
+            self._remove_checkpoint()
+            return False
+
+        local_node_id = object_server_cluster.local_node_id
+        for object_key, old_owners, new_owners in object_server_cluster.movement_plan(object_keys):
+            if local_node_id is None or local_node_id in new_owners:
+                self._place_object(object_key, [node_id for node_id in new_owners if node_id not in old_owners])
+            else:
+                # every owner is checked, as the local copy is removed once they all hold the object
+                self._place_object(object_key, new_owners)
+        self.scanned_objects += len(object_keys)
+        self.last_key = object_keys[-1]
+        self._write_checkpoint(target, self.last_key)
+        return True
+
+    def _place_object(self, object_key, node_ids):
+        metadata = self.storage_backend.read_metadata(object_key)
+        if metadata is None:
+            # the object was deleted meanwhile
+            return
+        local_node_id = self.object_server_cluster.local_node_id
+        placed_node_ids = set()
+        for node_id in node_ids:
+            if node_id == local_node_id:
+                continue
+            object_server = self.object_server_cluster.get_object_server(node_id)
+            if object_server is None:
+                continue
+            if self._is_stale(object_server, object_key, metadata):
+                # objects completed from a multipart upload keep their data in their parts
+                copied = [self._copy_object(object_server, part_key, self.storage_backend.read_metadata(part_key))
+                          for part_key, _ in metadata.parts]
+                copied.append(self._copy_object(object_server, object_key, metadata))
+                if not all(copied):
+                    continue
+            placed_node_ids.add(node_id)
+
+        owners = self.object_server_cluster.owners(object_key)
+        if local_node_id is not None and local_node_id not in owners and placed_node_ids.issuperset(owners):
+            self._remove_object(object_key, metadata)
+
+    def _remove_object(self, object_key, metadata):
+        # the object may have been written again since it was copied, and the new version is
+        # left for the next pass to copy
+        current_metadata = self.storage_backend.read_metadata(object_key)
+        if current_metadata is None or current_metadata.hash != metadata.hash:
+            return
+        if self.key_index is not None:
+            self.key_index.delete(object_key)
+        self.storage_backend.delete_object(object_key)
+        if self.object_cache is not None:
+            self.object_cache.invalidate(object_key)
+        for part_key, _ in metadata.parts:
+            self.storage_backend.delete_object(part_key)
+        self.removed_objects += 1
+
+    def _is_stale(self, object_server, object_key, metadata):
+        try:
+            replica_metadata = object_server.storage_backend.read_metadata(object_key)
+        except Exception:
+            return True
+        return replica_metadata is None or replica_metadata.hash != metadata.hash
+
+    def _copy_object(self, object_server, object_key, metadata):
+        num_bytes = 0
+
+        def read_chunks():
+            nonlocal num_bytes
+            for chunk in self.storage_backend.read_object_stream(object_key, CHUNK_SIZE):
+                self.rate_limiter.acquire(len(chunk))
+                num_bytes += len(chunk)
+                yield chunk
+
+        if self.object_server_cluster.write_replica(object_server, object_key, read_chunks, metadata):
+            self.moved_objects += 1
+            self.moved_bytes += num_bytes
+            return True
+        self.failed_objects += 1
+        return False
+
+    def _read_checkpoint(self, target):
+        if self.checkpoint_path is None:
+            return None
+        try:
+            with open(self.checkpoint_path) as f:
+                checkpoint = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if [tuple(node) for node in checkpoint.get('target', [])] != target:
+            return None
+        return checkpoint.get('last_key')
+
+    def _write_checkpoint(self, target, last_key):
+        if self.checkpoint_path is None:
+            return
+        # replace the whole checkpoint at once so a crash never leaves a partially written one
+        tmp_path = f"{self.checkpoint_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'target': target, 'last_key': last_key}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _remove_checkpoint(self):
+        if self.checkpoint_path is not None and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
@@ -0,0 +1,135 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest.mock import MagicMock
+
+from object_metadata import ObjectMetadata
+from object_server_cluster import ObjectServerCluster
+from rebalancer import Rebalancer
+from storage_backend import DiskStorageBackend
+
+
+class TestRebalancer(unittest.TestCase):
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base_path)
+        self.storage_backend = DiskStorageBackend(os.path.join(self.base_path, 'local'))
+        self.object_server_cluster = ObjectServerCluster(local_node_id='local')
+        self.addCleanup(self.object_server_cluster.shutdown)
+        for node_id in ['a', 'b']:
+            self.object_server_cluster.add_object_server(self.create_object_server(node_id))
+        self.checkpoint_path = os.path.join(self.base_path, 'checkpoint')
+        self.rebalancer = Rebalancer(self.object_server_cluster, self.storage_backend,
+                                     checkpoint_path=self.checkpoint_path, batch_size=10, bandwidth=None)
+        self.object_keys = [f'bucket/key-{i:02}' for i in range(30)]
+        for object_key in self.object_keys:
+            self.write_object(object_key, object_key.encode())
+
+    def create_object_server(self, node_id):
+        return MagicMock(node_id=node_id, storage_backend=DiskStorageBackend(os.path.join(self.base_path, node_id)))
+
+    def write_object(self, object_key, object_data):
+        self.storage_backend.write_object(object_key, object_data)
+        self.storage_backend.write_metadata(object_key, ObjectMetadata(size=len(object_data), hash=object_data.hex()))
+
+    def run_until_done(self):
+        while self.rebalancer.run_once():
+            pass
+
+    def test_hint_copies_object_to_owners(self):
+        self.object_server_cluster.finish_movement(self.object_server_cluster.previous_ring)
+        self.rebalancer.add_hint('bucket/key-00')
+        self.assertEqual(self.rebalancer.progress()['pending_hints'], 1)
+        self.run_until_done()
+
+        for node_id in self.object_server_cluster.owners('bucket/key-00'):
+            if node_id != 'local':
+                object_server = self.object_server_cluster.get_object_server(node_id)
+                self.assertEqual(object_server.storage_backend.read_object('bucket/key-00'), b'bucket/key-00')
+        moved_objects = self.rebalancer.moved_objects
+        self.assertGreater(moved_objects, 0)
+
+        # an up-to-date replica is not copied again
+        self.rebalancer.add_hint('bucket/key-00')
+        self.run_until_done()
+        self.assertEqual(self.rebalancer.moved_objects, moved_objects)
+
+    def test_moves_objects_after_membership_change(self):
+        self.run_until_done()
+        self.assertIsNone(self.object_server_cluster.previous_ring)
+        self.assertFalse(os.path.exists(self.checkpoint_path))
+
+        local_keys = list(self.storage_backend.list_objects())
+        object_server = self.create_object_server('c')
+        self.object_server_cluster.add_object_server(object_server)
+        self.assertTrue(self.rebalancer.run_once())
+        self.assertEqual(self.rebalancer.progress()['state'], 'moving')
+        self.assertEqual(self.rebalancer.scanned_objects, 10)
+        self.run_until_done()
+
+        moved_keys = [object_key for object_key in local_keys
+                      if 'c' in self.object_server_cluster.owners(object_key)]
+        self.assertTrue(moved_keys)
+        self.assertEqual(list(object_server.storage_backend.list_objects()), moved_keys)
+        self.assertEqual(self.rebalancer.progress()['state'], 'idle')
+        self.assertIsNone(self.object_server_cluster.previous_ring)
+
+    def test_removes_objects_no_longer_owned(self):
+        self.run_until_done()
+
+        owned_keys = [object_key for object_key in self.object_keys
+                      if 'local' in self.object_server_cluster.owners(object_key)]
+        self.assertLess(len(owned_keys), len(self.object_keys))
+        self.assertEqual(list(self.storage_backend.list_objects()), owned_keys)
+        self.assertEqual(self.rebalancer.removed_objects, len(self.object_keys) - len(owned_keys))
+        for object_key in self.object_keys:
+            for node_id in self.object_server_cluster.owners(object_key):
+                if node_id != 'local':
+                    storage_backend = self.object_server_cluster.get_object_server(node_id).storage_backend
+                    self.assertEqual(storage_backend.read_object(object_key), object_key.encode())
+
+    def test_keeps_objects_until_every_owner_holds_them(self):
+        down_object_server = self.object_server_cluster.get_object_server('a')
+        down_object_server.storage_backend = MagicMock()
+        down_object_server.storage_backend.read_metadata.return_value = None
+        down_object_server.storage_backend.write_object_stream.side_effect = ConnectionError()
+        down_object_server.storage_backend.write_object_with_metadata.side_effect = ConnectionError()
+        self.run_until_done()
+
+        kept_keys = [object_key for object_key in self.object_keys
+                     if 'local' in self.object_server_cluster.owners(object_key)
+                     or 'a' in self.object_server_cluster.owners(object_key)]
+        self.assertEqual(list(self.storage_backend.list_objects()), kept_keys)
+        self.assertGreater(self.rebalancer.failed_objects, 0)
+
+    def test_resumes_from_checkpoint(self):
+        target = sorted(self.object_server_cluster.ring.nodes.items())
+        with open(self.checkpoint_path, 'w') as f:
+            json.dump({'target': target, 'last_key': 'bucket/key-19'}, f)
+
+        self.rebalancer.run_once()
+        self.assertEqual(self.rebalancer.last_key, 'bucket/key-29')
+        with open(self.checkpoint_path) as f:
+            self.assertEqual(json.load(f)['last_key'], 'bucket/key-29')
+        for object_key in self.object_keys[:20]:
+            for node_id in ['a', 'b']:
+                storage_backend = self.object_server_cluster.get_object_server(node_id).storage_backend
+                self.assertFalse(storage_backend.object_exists(object_key))
+
+    def test_background_thread_handles_hints(self):
+        self.object_server_cluster.finish_movement(self.object_server_cluster.previous_ring)
+        self.rebalancer.start()
+        self.addCleanup(self.rebalancer.stop)
+        self.rebalancer.add_hint('bucket/key-01')
+        deadline = time.monotonic() + 5
+        while self.rebalancer.moved_objects == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertGreater(self.rebalancer.moved_objects, 0)
+        self.assertEqual(self.rebalancer.progress()['pending_hints'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
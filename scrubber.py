@@ -0,0 +1,294 @@
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from erasure_coding import NotEnoughShardsError
+from key_management import InvalidKeyError
+from object_pipeline import CHUNK_SIZE, ChecksumError, ObjectDecoder
+from rate_limiter import TokenBucket
+
+
+class Scrubber:
+    """
+    Verifies the stored objects against their block checksums in the background, so that bitrot
+    in objects nobody reads is found, and repaired from a healthy replica, while the replicas are
+    still good.
+
+    The scrubber walks the keys of the local objects in order, a batch at a time, verifying the
+    objects of a batch concurrently on a pool of threads, as decrypting, decompressing and
+    checksumming blocks mostly runs without the GIL. Reads are rate limited so that scrubbing does
+    not starve requests of disk bandwidth. Its position is saved to a checkpoint after every batch,
+    so a restarted server resumes where it stopped, and a walk that completed is only started over
+    once the interval since it started has passed.
+
+    The shards of erasure-coded objects carry no checksums of their own, so they are checked
+    against the blocks rebuilt from them, which are verified against their checksums, and shards
+    that are corrupted or missing are rebuilt from the healthy ones. As every owner of such an
+    object holds its metadata, only the primary owner checks its shards.
+
+    Attributes:
+    - object_server_cluster: The cluster corrupted objects are repaired from.
+    - storage_backend: The storage backend holding the local objects.
+    - key_manager: The key manager unwrapping the data keys of objects, or None if they are not wrapped.
+    - checkpoint_path: The file the position of the walk is saved to, or None to not save it.
+    - batch_size: The number of keys verified between checkpoints.
+    - interval: The interval (in seconds) at which every object is verified.
+    - poll_interval: The time (in seconds) the scrubber thread waits when there is nothing to
+      verify, or after an error, before checking again.
+    - rate_limiter: The token bucket limiting the bytes read per second.
+    - scanned_objects: The number of objects verified in the walk in progress.
+    - scanned_bytes: The number of stored bytes verified in the walk in progress.
+    - corrupted_objects: The number of objects found not to match their checksums, or with
+      corrupted or missing shards.
+    - repaired_objects: The number of corrupted objects replaced with a healthy replica, or whose
+      shards were rebuilt.
+    - last_key: The last key walked, or None if no walk is in progress.
+    """
+
+    def __init__(self, object_server_cluster, storage_backend, key_manager=None, checkpoint_path=None,
+                 batch_size=100, bandwidth=10 * 1024 * 1024, interval=7 * 24 * 60 * 60, max_workers=4,
+                 poll_interval=60):
+        """
+        Initializes a new instance of the Scrubber class.
+
+        Args:
+        - object_server_cluster: The cluster corrupted objects are repaired from.
+        - storage_backend: The storage backend holding the local objects.
+        - key_manager: The key manager unwrapping the data keys of objects, or None if they are not wrapped.
+        - checkpoint_path: The file the position of the walk is saved to, or None to not save it.
+        - batch_size: The number of keys verified between checkpoints.
+        - bandwidth: The most bytes read per second, or None for no limit.
+        - interval: The interval (in seconds) at which every object is verified.
+        - max_workers: The number of threads verifying objects.
+        - poll_interval: The time (in seconds) the scrubber thread waits when there is nothing to
+          verify, or after an error, before checking again.
+        """
+        self.object_server_cluster = object_server_cluster
+        self.storage_backend = storage_backend
+        self.key_manager = key_manager
+        self.checkpoint_path = checkpoint_path
+        self.batch_size = batch_size
+        self.interval = interval
+        self.poll_interval = poll_interval
+        self.rate_limiter = TokenBucket(bandwidth)
+        self.scanned_objects = 0
+        self.scanned_bytes = 0
+        self.corrupted_objects = 0
+        self.repaired_objects = 0
+        self.last_key = None
+        self._walk_started = None
+        self._checkpoint_loaded = False
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='scrubber')
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def progress(self):
+        """
+        Returns the progress of the scrubber as a dict.
+        """
+        return {
+            'state': 'idle' if self.last_key is None else 'scrubbing',
+            'scanned_objects': self.scanned_objects,
+            'scanned_bytes': self.scanned_bytes,
+            'corrupted_objects': self.corrupted_objects,
+            'repaired_objects': self.repaired_objects,
+            'last_key': self.last_key,
+        }
+
+    def run_once(self):
+        """
+        Verifies one batch of the walk in progress, starting a new walk if the interval since
+        the last one started has passed.
+
+        Returns:
+        - True if there is more work left, False otherwise.
+        """
+        if not self._checkpoint_loaded:
+            self._checkpoint_loaded = True
+            self._walk_started, self.last_key = self._read_checkpoint()
+        if self.last_key is None:
+            if self._walk_started is not None and time.time() - self._walk_started < self.interval:
+                return False
+            self._walk_started = time.time()
+            self.scanned_objects = 0
+            self.scanned_bytes = 0
+            self.last_key = ''
+
+        object_keys = list(itertools.islice(self.storage_backend.list_objects(self.last_key), self.batch_size))
+        for _ in self._executor.map(self.scrub_object, object_keys):
+            pass
+        if len(object_keys) < self.batch_size:
+            # the walk is complete, and the next one starts after the interval
+            self.last_key = None
+        else:
+            self.last_key = object_keys[-1]
+        self._write_checkpoint()
+        return self.last_key is not None
+
+    def scrub_object(self, object_key):
+        """
+        Verifies a local object, and the parts it was assembled from, repairing them from a
+        healthy replica if they are corrupted. The shards of erasure-coded objects are verified,
+        and rebuilt if they are corrupted, by the primary owner of the object.
+
+        Returns:
+        - True if the object is intact or was repaired, False otherwise.
+        """
+        metadata = self.storage_backend.read_metadata(object_key)
+        if metadata is None:
+            return True
+        segments = [(part_key, self.storage_backend.read_metadata(part_key)) for part_key, _ in metadata.parts]
+        intact = True
+        for segment_key, segment_metadata in segments or [(object_key, metadata)]:
+            if segment_metadata is None:
+                continue
+            if segment_metadata.shard_nodes:
+                if self._is_primary_owner(object_key) and not self.scrub_shards(segment_key, segment_metadata):
+                    intact = False
+                continue
+            try:
+                self.verify_object(segment_key, segment_metadata)
+                continue
+            except (ChecksumError, InvalidKeyError, OSError) as e:
+                current_metadata = self.storage_backend.read_metadata(segment_key)
+                if current_metadata is None or current_metadata.hash != segment_metadata.hash:
+                    # the object was overwritten or deleted while it was read
+                    continue
+                print(f"Object {segment_key} is corrupted: {e}")
+            with self._lock:
+                self.corrupted_objects += 1
+            if self.object_server_cluster.repair_object(segment_key, segment_metadata, self.verify_object):
+                with self._lock:
+                    self.repaired_objects += 1
+            else:
+                intact = False
+        with self._lock:
+            self.scanned_objects += 1
+        return intact
+
+    def scrub_shards(self, object_key, metadata):
+        """
+        Verifies the shards of an erasure-coded object, rebuilding them from the healthy shards
+        if they are corrupted or missing.
+
+        Returns:
+        - True if the shards are intact or were rebuilt, False otherwise.
+        """
+        def verify_block(block_number, stored_block):
+            self.rate_limiter.acquire(len(stored_block))
+            with self._lock:
+                self.scanned_bytes += len(stored_block)
+            decoder.verify_block(block_number, stored_block)
+
+        try:
+            decoder = self._decoder(metadata)
+            shard_indexes = self.object_server_cluster.verify_shards(object_key, metadata, verify_block)
+        except (ChecksumError, NotEnoughShardsError, InvalidKeyError) as e:
+            shard_indexes, error = None, e
+        else:
+            if not shard_indexes:
+                return True
+            error = f"shards {', '.join(map(str, shard_indexes))} are corrupted or missing"
+        current_metadata = self.storage_backend.read_metadata(object_key)
+        if current_metadata is None or current_metadata.hash != metadata.hash:
+            # the object was overwritten or deleted while it was read, and its shards with it
+            return True
+        print(f"Object {object_key} is corrupted: {error}")
+        with self._lock:
+            self.corrupted_objects += 1
+        if shard_indexes is None:
+            # too few shards are healthy to rebuild the others
+            return False
+        if self.object_server_cluster.repair_shards(object_key, metadata, shard_indexes,
+                                                    decoder.verify_block) != shard_indexes:
+            return False
+        with self._lock:
+            self.repaired_objects += 1
+        return True
+
+    def verify_object(self, object_key, metadata):
+        """
+        Reads the stored data of a local object and checks every block against its checksum.
+
+        Raises:
+        - ChecksumError: If a block does not match its checksum or the data is truncated.
+        - InvalidKeyError: If the data key of the object cannot be unwrapped.
+        """
+        if not metadata.blocks:
+            # objects stored before blocks had checksums cannot be verified
+            return
+        decoder = self._decoder(metadata)
+
+        def read_stored_range(offset, length):
+            for chunk in self.storage_backend.read_object_stream(object_key, CHUNK_SIZE, offset, length):
+                self.rate_limiter.acquire(len(chunk))
+                with self._lock:
+                    self.scanned_bytes += len(chunk)
+                yield chunk
+
+        for _ in decoder.decode(read_stored_range):
+            pass
+
+    def _decoder(self, metadata):
+        encryption_key = metadata.encryption_key
+        if self.key_manager is not None:
+            encryption_key = self.key_manager.data_key(encryption_key)
+        return ObjectDecoder(encryption_key, metadata.nonce, metadata.size, metadata.block_size,
+                             metadata.blocks, metadata.block_codecs, metadata.checksum_algorithm)
+
+    def _is_primary_owner(self, object_key):
+        local_node_id = self.object_server_cluster.local_node_id
+        return local_node_id is None or self.object_server_cluster.owners(object_key)[:1] == [local_node_id]
+
+    def start(self):
+        """
+        Starts the scrubber thread.
+        """
+        self._thread = threading.Thread(target=self._run, name='scrubber', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stops the scrubber thread after the batch it is verifying.
+
+        Args:
+        - timeout: The maximum time (in seconds) to wait for the thread, or None to wait until it stops.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._executor.shutdown(wait=True)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                more_work = self.run_once()
+            except Exception as e:
+                print(f"Error scrubbing objects: {e}. Retrying in {self.poll_interval} seconds...")
+                more_work = False
+            if not more_work:
+                self._stopped.wait(self.poll_interval)
+
+    def _read_checkpoint(self):
+        if self.checkpoint_path is None:
+            return None, None
+        try:
+            with open(self.checkpoint_path) as f:
+                checkpoint = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None, None
+        return checkpoint.get('walk_started'), checkpoint.get('last_key')
+
+    def _write_checkpoint(self):
+        if self.checkpoint_path is None:
+            return
+        # replace the whole checkpoint at once so a crash never leaves a partially written one
+        tmp_path = f"{self.checkpoint_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'walk_started': self._walk_started, 'last_key': self.last_key}, f)
+        os.replace(tmp_path, self.checkpoint_path)
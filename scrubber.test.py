@@ -0,0 +1,140 @@
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from erasure_coding import shard_key
+from object_metadata import ObjectMetadata
+from object_pipeline import ObjectEncoder
+from object_server_cluster import ObjectServerCluster
+from scrubber import Scrubber
+from storage_backend import DiskStorageBackend
+
+
+class TestScrubber(unittest.TestCase):
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base_path)
+        self.storage_backend = DiskStorageBackend(os.path.join(self.base_path, 'local'))
+        self.object_server_cluster = ObjectServerCluster(local_node_id='local', storage_backend=self.storage_backend)
+        self.addCleanup(self.object_server_cluster.shutdown)
+        self.replica = MagicMock(node_id='a', storage_backend=DiskStorageBackend(os.path.join(self.base_path, 'a')))
+        self.object_server_cluster.add_object_server(self.replica)
+        self.checkpoint_path = os.path.join(self.base_path, 'checkpoint')
+        self.scrubber = Scrubber(self.object_server_cluster, self.storage_backend,
+                                 checkpoint_path=self.checkpoint_path, batch_size=10, bandwidth=None)
+        self.addCleanup(self.scrubber.stop)
+        self.object_keys = [f'bucket/key-{i:02}' for i in range(25)]
+        for object_key in self.object_keys:
+            self.write_object(object_key, object_key.encode() * 100)
+
+    def write_object(self, object_key, object_data):
+        encryption_key, nonce = os.urandom(32), os.urandom(8)
+        encoder = ObjectEncoder(encryption_key, nonce, block_size=256)
+        stored_data = b''.join(encoder.encode([object_data]))
+        metadata = ObjectMetadata(size=encoder.size, hash=encoder.hash, encryption_key=encryption_key, nonce=nonce,
+                                  block_size=encoder.block_size, blocks=encoder.blocks,
+                                  block_codecs=bytes(encoder.block_codecs))
+        for storage_backend in (self.storage_backend, self.replica.storage_backend):
+            storage_backend.write_object(object_key, stored_data)
+            storage_backend.write_metadata(object_key, metadata)
+
+    def corrupt(self, storage_backend, object_key):
+        stored_data = bytearray(storage_backend.read_object(object_key))
+        stored_data[len(stored_data) // 2] ^= 0xff
+        storage_backend.write_object(object_key, bytes(stored_data))
+
+    def run_walk(self):
+        while self.scrubber.run_once():
+            pass
+
+    def test_walk_verifies_every_object(self):
+        self.assertTrue(self.scrubber.run_once())
+        self.assertEqual(self.scrubber.progress()['state'], 'scrubbing')
+        self.run_walk()
+
+        self.assertEqual(self.scrubber.scanned_objects, 25)
+        self.assertEqual(self.scrubber.corrupted_objects, 0)
+        self.assertEqual(self.scrubber.progress()['state'], 'idle')
+        # the next walk waits for the interval
+        self.assertFalse(self.scrubber.run_once())
+        self.assertEqual(self.scrubber.scanned_objects, 25)
+
+    def test_repairs_corrupted_object_from_replica(self):
+        self.corrupt(self.storage_backend, 'bucket/key-03')
+        self.run_walk()
+
+        self.assertEqual((self.scrubber.corrupted_objects, self.scrubber.repaired_objects), (1, 1))
+        self.assertEqual(self.storage_backend.read_object('bucket/key-03'),
+                         self.replica.storage_backend.read_object('bucket/key-03'))
+
+    def test_corrupted_replica_is_not_used(self):
+        self.corrupt(self.storage_backend, 'bucket/key-03')
+        self.corrupt(self.replica.storage_backend, 'bucket/key-03')
+
+        self.assertFalse(self.scrubber.scrub_object('bucket/key-03'))
+        self.assertEqual((self.scrubber.corrupted_objects, self.scrubber.repaired_objects), (1, 0))
+
+    def test_rebuilds_corrupted_and_missing_shards(self):
+        for i in range(6):
+            self.object_server_cluster.add_object_server(
+                MagicMock(node_id=f'shards-{i}', storage_backend=DiskStorageBackend(os.path.join(self.base_path, str(i)))))
+        # only the primary owner of an erasure-coded object verifies its shards
+        object_key = next(f'cold/key-{i}' for i in itertools.count()
+                          if self.object_server_cluster.owners(f'cold/key-{i}')[0] == 'local')
+        self.write_object(object_key, os.urandom(2000))
+        metadata = self.storage_backend.read_metadata(object_key)
+        stored_data = self.storage_backend.read_object(object_key)
+        metadata.data_shards, metadata.parity_shards = 4, 2
+        metadata.shard_nodes = self.object_server_cluster.write_shards(
+            object_key, metadata, lambda offset, length: [stored_data[offset:offset + length]])
+        self.storage_backend.write_metadata(object_key, metadata)
+        shards = [self.shard_backend(metadata, shard_index).read_object(shard_key(object_key, shard_index))
+                  for shard_index in range(6)]
+        self.corrupt(self.shard_backend(metadata, 1), shard_key(object_key, 1))
+        self.shard_backend(metadata, 4).delete_object(shard_key(object_key, 4))
+
+        self.assertTrue(self.scrubber.scrub_object(object_key))
+        self.assertEqual((self.scrubber.corrupted_objects, self.scrubber.repaired_objects), (1, 1))
+        for shard_index in range(6):
+            self.assertEqual(self.shard_backend(metadata, shard_index).read_object(shard_key(object_key, shard_index)),
+                             shards[shard_index])
+
+        for shard_index in range(3):
+            self.corrupt(self.shard_backend(metadata, shard_index), shard_key(object_key, shard_index))
+        self.assertFalse(self.scrubber.scrub_object(object_key))
+        self.assertEqual((self.scrubber.corrupted_objects, self.scrubber.repaired_objects), (2, 1))
+
+    def shard_backend(self, metadata, shard_index):
+        node_id = metadata.shard_nodes[shard_index]
+        if node_id == 'local':
+            return self.storage_backend
+        return self.object_server_cluster.get_object_server(node_id).storage_backend
+
+    def test_resumes_from_checkpoint(self):
+        with open(self.checkpoint_path, 'w') as f:
+            json.dump({'walk_started': 1000.0, 'last_key': 'bucket/key-19'}, f)
+
+        self.assertFalse(self.scrubber.run_once())
+        self.assertEqual(self.scrubber.scanned_objects, 5)
+        with open(self.checkpoint_path) as f:
+            self.assertEqual(json.load(f), {'walk_started': 1000.0, 'last_key': None})
+
+    def test_thread_polls_at_poll_interval(self):
+        scrubber = Scrubber(self.object_server_cluster, self.storage_backend, bandwidth=None, poll_interval=0.01)
+        self.addCleanup(scrubber.stop)
+        with patch.object(scrubber, 'run_once', return_value=False) as run_once:
+            scrubber.start()
+            deadline = time.monotonic() + 5
+            while run_once.call_count < 3 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            scrubber.stop()
+        self.assertGreaterEqual(run_once.call_count, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,321 @@
+import contextlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import ObjectCache
+from checksums import CHECKSUMS
+from compression import CompressionPolicy
+from erasure_coding import ErasureCoder
+from identity_layer import IdentityLayer
+from key_index import KeyIndex
+from key_management import KeyManager
+from membership import Membership
+from metrics import Counter, Gauge, MetricsServer, ServerMetrics
+from multipart_upload import MultipartUploadManager
+from object_server_cluster import ObjectServerCluster
+from rebalancer import Rebalancer
+from scrubber import Scrubber
+from storage_backend import DiskStorageBackend, PackedStorageBackend
+from transport import SECRET_PURPOSE, RemoteObjectServer, TransportServer
+
+
+class KeyLocks:
+    """
+    A lock for every key in use, created when first acquired and dropped when last released.
+    """
+
+    def __init__(self):
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def hold(self, key):
+        """
+        Returns a context manager holding the lock of a key.
+        """
+        with self._lock:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+
+
+class ServerContext:
+    """
+    The state shared by every request handler of one object server process.
+
+    Attributes:
+    - db_file: The SQLite database holding access keys.
+    - storage_path: The directory objects are stored in.
+    - storage_engine: 'disk' to store every object in a file of its own, or 'packed' to pack
+      small objects into append-only segment files.
+    - compression_policy: The policy choosing the codec objects are stored with.
+    - block_checksum: The algorithm new objects are checksummed with, block by block.
+    - block_workers: The number of threads large objects are encoded and decoded on, or 0.
+    - block_executor: The executor large objects are encoded and decoded on, or None.
+    - node_id: The ID of this object server within its cluster.
+    - read_cache_size: The most bytes of decoded objects cached in memory, or 0 to not cache objects.
+    - read_cache_max_object_size: The largest object cached, or None for an eighth of the cache size.
+    - rebalance_bandwidth: The most bytes per second the rebalancer copies, or None for no limit.
+    - scrub_bandwidth: The most bytes per second the scrubber reads, or None for no limit.
+    - scrub_interval: The interval (in seconds) at which the scrubber verifies every object.
+    - scrub_poll_interval: The time (in seconds) the scrubber waits when idle before checking for work again.
+    - erasure_coded_buckets: The buckets whose objects are stored as erasure-coded shards.
+    - erasure_coder: The erasure code objects in erasure-coded buckets are split with.
+    - unencrypted_buckets: The buckets whose objects are stored unencrypted, so that they can be
+      sent with sendfile when they are not compressed either.
+    - keyfile: The file holding the master key the data keys of objects are wrapped with.
+    - gossip_address: The (host, port) address the membership protocol runs on over UDP and the
+      transport server over TCP, or None to run without failure detection.
+    - seed_addresses: The gossip addresses of the members to join the cluster through.
+    - metrics_address: The (host, port) address metrics are served on at /metrics, or None to
+      not serve them.
+    - metrics: The metrics of the requests served and of the time spent in every stage of them.
+    - identity_layer: The identity layer used to authenticate requests.
+    - key_manager: The key manager wrapping and unwrapping the data keys of objects.
+    - object_server_cluster: The cluster this server is a member of.
+    - storage_backend: The storage backend objects are read from and written to.
+    - key_index: The sorted index of the keys of the objects stored through this server.
+    - object_cache: The cache of decoded objects read through this server, or None.
+    - object_locks: The locks serializing conditional writes of the same object.
+    - multipart_upload_manager: The manager of in-progress multipart uploads.
+    - rebalancer: The rebalancer moving objects to the object servers that own them.
+    - scrubber: The scrubber verifying stored objects against their checksums.
+    - membership: The membership protocol detecting members joining and failing, if any.
+    - transport_server: The server other object servers call the storage backend through, if
+      there is a membership protocol.
+    - metrics_server: The server metrics are served by, if there is a metrics address.
+    """
+
+    def __init__(self, db_file='kriya.db', storage_path='data', compression_policy=None, node_id=None,
+                 storage_engine='disk', read_cache_size=256 * 1024 * 1024, read_cache_max_object_size=None,
+                 rebalance_bandwidth=50 * 1024 * 1024, scrub_bandwidth=10 * 1024 * 1024,
+                 scrub_interval=7 * 24 * 60 * 60, scrub_poll_interval=60, erasure_coded_buckets=(), erasure_coder=None,
+                 unencrypted_buckets=(), gossip_address=None, seed_addresses=(), block_checksum='crc32',
+                 block_workers=None, keyfile=None, metrics_address=None):
+        """
+        Initializes a new instance of the ServerContext class.
+
+        Args:
+        - db_file: The SQLite database holding access keys.
+        - storage_path: The directory objects are stored in.
+        - storage_engine: 'disk' to store every object in a file of its own, or 'packed' to pack
+          small objects into append-only segment files.
+        - compression_policy: The policy choosing the codec objects are stored with.
+        - block_checksum: The name of the algorithm new objects are checksummed with, block by block.
+        - block_workers: The number of threads large objects are encoded and decoded on, several blocks
+          at a time, or 0 to encode and decode them on the request threads; defaults to one per CPU.
+        - node_id: The ID of this object server within its cluster.
+        - read_cache_size: The most bytes of decoded objects cached in memory, or 0 to not cache objects.
+        - read_cache_max_object_size: The largest object cached, or None for an eighth of the cache size.
+        - rebalance_bandwidth: The most bytes per second the rebalancer copies, or None for no limit.
+        - scrub_bandwidth: The most bytes per second the scrubber reads, or None for no limit.
+        - scrub_interval: The interval (in seconds) at which the scrubber verifies every object.
+        - scrub_poll_interval: The time (in seconds) the scrubber waits when idle before checking for work again.
+        - erasure_coded_buckets: The buckets whose objects are stored as erasure-coded shards.
+        - erasure_coder: The erasure code objects in erasure-coded buckets are split with.
+        - unencrypted_buckets: The buckets whose objects are stored unencrypted.
+        - keyfile: The file holding the master key the data keys of objects are wrapped with, created
+          if it does not exist; defaults to a file in the storage path. Every object server of a
+          cluster must use the same master key, as the secret they authenticate to each other's
+          transport servers with is derived from it.
+        - gossip_address: The (host, port) address the membership protocol and the transport
+          server run on, or None to run without failure detection. Its host should be on the
+          private network the object servers share, as the traffic between them is not encrypted.
+        - seed_addresses: The gossip addresses of the members to join the cluster through.
+        - metrics_address: The (host, port) address metrics are served on at /metrics, or None to
+          not serve them.
+
+        Raises:
+        - ValueError: If the checksum algorithm is not available.
+        """
+        if block_checksum not in CHECKSUMS:
+            raise ValueError(f"Checksum algorithm {block_checksum} is not available.")
+        self.block_checksum = CHECKSUMS[block_checksum]
+        self.block_workers = (os.cpu_count() or 1) if block_workers is None else block_workers
+        self.block_executor = None
+        self.node_id = node_id
+        self.read_cache_size = read_cache_size
+        self.read_cache_max_object_size = read_cache_max_object_size
+        self.rebalance_bandwidth = rebalance_bandwidth
+        self.scrub_bandwidth = scrub_bandwidth
+        self.scrub_interval = scrub_interval
+        self.scrub_poll_interval = scrub_poll_interval
+        self.erasure_coded_buckets = set(erasure_coded_buckets)
+        self.erasure_coder = erasure_coder or ErasureCoder()
+        self.unencrypted_buckets = set(unencrypted_buckets)
+        self.keyfile = keyfile if keyfile is not None else os.path.join(storage_path, '.master.key')
+        self.gossip_address = gossip_address
+        self.seed_addresses = list(seed_addresses)
+        self.metrics_address = metrics_address
+        self.metrics = ServerMetrics()
+        self.db_file = db_file
+        self.storage_path = storage_path
+        self.storage_engine = storage_engine
+        self.compression_policy = compression_policy or CompressionPolicy()
+        self.identity_layer = None
+        self.key_manager = None
+        self.object_server_cluster = None
+        self.storage_backend = None
+        self.key_index = None
+        self.object_cache = None
+        self.object_locks = KeyLocks()
+        self.multipart_upload_manager = None
+        self.rebalancer = None
+        self.scrubber = None
+        self.membership = None
+        self.transport_server = None
+        self.metrics_server = None
+        self.started = False
+        self._startup_hooks = []
+        self._shutdown_hooks = []
+        self._lock = threading.Lock()
+        self.metrics.add_collector(self._collect_metrics)
+
+    def add_startup_hook(self, hook):
+        """
+        Registers a callable run with the context once it has started.
+
+        Args:
+        - hook: A callable taking the context as its only argument.
+        """
+        with self._lock:
+            self._startup_hooks.append(hook)
+
+    def add_shutdown_hook(self, hook):
+        """
+        Registers a callable run with the context when it shuts down. Shutdown hooks run in
+        reverse registration order.
+
+        Args:
+        - hook: A callable taking the context as its only argument.
+        """
+        with self._lock:
+            self._shutdown_hooks.append(hook)
+
+    def startup(self):
+        """
+        Builds the shared components and runs the startup hooks. Calling it again is a no-op.
+        """
+        with self._lock:
+            if self.started:
+                return
+            os.makedirs(self.storage_path, exist_ok=True)
+            self.identity_layer = IdentityLayer(self.db_file)
+            self.key_manager = KeyManager(self.keyfile)
+            if self.storage_engine == 'packed':
+                self.storage_backend = PackedStorageBackend(self.storage_path)
+            else:
+                self.storage_backend = DiskStorageBackend(self.storage_path)
+            if self.block_workers:
+                self.block_executor = ThreadPoolExecutor(max_workers=self.block_workers, thread_name_prefix='blocks')
+            self.key_index = KeyIndex(os.path.join(self.storage_path, '.keys.db'))
+            if self.key_index.is_empty():
+                self.key_index.rebuild(self.storage_backend)
+            if self.read_cache_size:
+                self.object_cache = ObjectCache(self.read_cache_size, self.read_cache_max_object_size)
+            self.object_server_cluster = ObjectServerCluster(local_node_id=self.node_id,
+                                                             storage_backend=self.storage_backend)
+            self.object_server_cluster.erasure_coded_buckets = self.erasure_coded_buckets
+            self.object_server_cluster.erasure_coder = self.erasure_coder
+            if self.gossip_address is not None:
+                self.membership = Membership(self.node_id, self.gossip_address)
+                # other object servers reach the storage backend over TCP on the gossip port
+                self.transport_server = TransportServer((self.gossip_address[0], self.membership.address[1]),
+                                                        self.storage_backend,
+                                                        self.key_manager.derive_key(SECRET_PURPOSE))
+                self.transport_server.start()
+                self.object_server_cluster.peer_factory = self._create_peer
+                self.membership.add_listener(self.object_server_cluster.on_membership_change)
+                self.object_server_cluster.membership = self.membership
+            self.object_server_cluster.start()
+            if self.membership is not None:
+                self.membership.join(self.seed_addresses)
+            self.multipart_upload_manager = MultipartUploadManager(self.storage_backend)
+            self.rebalancer = Rebalancer(self.object_server_cluster, self.storage_backend, self.key_index,
+                                         self.object_cache, checkpoint_path=os.path.join(self.storage_path, '.rebalance'),
+                                         bandwidth=self.rebalance_bandwidth)
+            self.rebalancer.start()
+            self.scrubber = Scrubber(self.object_server_cluster, self.storage_backend, self.key_manager,
+                                     checkpoint_path=os.path.join(self.storage_path, '.scrub'),
+                                     bandwidth=self.scrub_bandwidth, interval=self.scrub_interval,
+                                     poll_interval=self.scrub_poll_interval)
+            self.scrubber.start()
+            if self.metrics_address is not None:
+                self.metrics_server = MetricsServer(self.metrics_address, self.metrics)
+                self.metrics_server.start()
+            for hook in self._startup_hooks:
+                hook(self)
+            self.started = True
+
+    def shutdown(self):
+        """
+        Runs the shutdown hooks. Calling it on a context that is not started is a no-op.
+        """
+        with self._lock:
+            if not self.started:
+                return
+            for hook in reversed(self._shutdown_hooks):
+                hook(self)
+            if self.metrics_server is not None:
+                self.metrics_server.stop()
+                self.metrics_server = None
+            self.scrubber.stop()
+            self.rebalancer.stop()
+            self.object_server_cluster.stop()
+            self.object_server_cluster.shutdown()
+            if self.transport_server is not None:
+                self.transport_server.stop()
+            for object_server in self.object_server_cluster.object_servers:
+                if isinstance(object_server, RemoteObjectServer):
+                    object_server.close()
+            self.storage_backend.close()
+            self.key_index.close()
+            if self.block_executor is not None:
+                self.block_executor.shutdown(wait=True)
+                self.block_executor = None
+            self.identity_layer.close()
+            self.started = False
+
+    def _create_peer(self, node_id):
+        host, port = self.membership.members[node_id].address
+        return RemoteObjectServer(node_id, (host, port), self.key_manager.derive_key(SECRET_PURPOSE))
+
+    def _collect_metrics(self):
+        # reports the statistics the components keep on their own, as of the scrape
+        if not self.started:
+            return []
+        cache_hits = Counter('kriya_cache_hits_total', 'The number of cache lookups that found a value.', ('cache',))
+        cache_misses = Counter('kriya_cache_misses_total', 'The number of cache lookups that found no value.',
+                               ('cache',))
+        caches = [('metadata', getattr(self.storage_backend, 'metadata_cache', None)),
+                  ('data_key', self.key_manager.key_cache), ('object', self.object_cache)]
+        for name, cache in caches:
+            if cache is not None:
+                cache_hits.inc(name, amount=cache.hits)
+                cache_misses.inc(name, amount=cache.misses)
+        metrics = [cache_hits, cache_misses]
+        torn_records = getattr(self.storage_backend, 'torn_records', None)
+        if torn_records is not None:
+            counter = Counter('kriya_storage_torn_records_total',
+                              'The number of records torn by a crash that were dropped from the segments.')
+            counter.inc(amount=torn_records)
+            metrics.append(counter)
+        for component, progress in (('rebalancer', self.rebalancer.progress()),
+                                    ('scrubber', self.scrubber.progress())):
+            active = Gauge(f'kriya_{component}_active', f'Whether the {component} is working through a walk.')
+            active.set(int(progress['state'] != 'idle'))
+            metrics.append(active)
+            for name, value in progress.items():
+                if isinstance(value, int):
+                    gauge = Gauge(f'kriya_{component}_{name}', f'The {name.replace("_", " ")} of the {component}.')
+                    gauge.set(value)
+                    metrics.append(gauge)
+        return metrics
@@ -0,0 +1,93 @@
+import http.client
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock
+
+from server_context import ServerContext
+
+
+class TestServerContext(unittest.TestCase):
+    def setUp(self):
+        self.storage_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.storage_path)
+        self.context = ServerContext(db_file=':memory:', storage_path=self.storage_path)
+        # stop the background threads before the storage path is removed
+        self.addCleanup(self.context.shutdown)
+
+    def test_startup_builds_shared_components(self):
+        self.context.startup()
+        self.assertTrue(self.context.started)
+        self.assertIsNotNone(self.context.identity_layer)
+        self.assertIsNotNone(self.context.object_server_cluster)
+        self.assertIsNotNone(self.context.storage_backend)
+
+    def test_master_key_is_kept_across_restarts(self):
+        self.context.startup()
+        _, wrapped_key = self.context.key_manager.generate_data_key()
+        self.context.shutdown()
+        context = ServerContext(db_file=':memory:', storage_path=self.storage_path)
+        context.startup()
+        self.addCleanup(context.shutdown)
+        self.assertEqual(context.key_manager.keyfile, os.path.join(self.storage_path, '.master.key'))
+        self.assertEqual(len(context.key_manager.unwrap(wrapped_key)), 32)
+
+    def test_startup_runs_hooks_once(self):
+        hook = MagicMock()
+        self.context.add_startup_hook(hook)
+        threads = [threading.Thread(target=self.context.startup) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        hook.assert_called_once_with(self.context)
+
+    def test_startup_keeps_components(self):
+        self.context.startup()
+        storage_backend = self.context.storage_backend
+        self.context.startup()
+        self.assertIs(self.context.storage_backend, storage_backend)
+
+    def test_shutdown_runs_hooks_in_reverse_order(self):
+        calls = []
+        self.context.add_shutdown_hook(lambda context: calls.append('first'))
+        self.context.add_shutdown_hook(lambda context: calls.append('second'))
+        self.context.startup()
+        self.context.shutdown()
+        self.context.shutdown()
+        self.assertEqual(calls, ['second', 'first'])
+        self.assertFalse(self.context.started)
+
+    def test_shutdown_before_startup(self):
+        hook = MagicMock()
+        self.context.add_shutdown_hook(hook)
+        self.context.shutdown()
+        hook.assert_not_called()
+
+    def test_metrics_are_served_with_metrics_address(self):
+        context = ServerContext(db_file=':memory:', storage_path=self.storage_path, metrics_address=('localhost', 0))
+        context.startup()
+        self.addCleanup(context.shutdown)
+        conn = http.client.HTTPConnection(*context.metrics_server.address, timeout=10)
+        self.addCleanup(conn.close)
+        conn.request('GET', '/metrics')
+        body = conn.getresponse().read().decode()
+        self.assertIn('# TYPE kriya_requests_total counter\n', body)
+        self.assertIn('kriya_scrubber_active ', body)
+        self.assertIn('kriya_rebalancer_moved_objects 0\n', body)
+
+    def test_membership_runs_with_gossip_address(self):
+        context = ServerContext(db_file=':memory:', storage_path=self.storage_path, node_id='localhost:8080',
+                                gossip_address=('localhost', 0))
+        context.startup()
+        self.assertIs(context.object_server_cluster.membership, context.membership)
+        self.assertEqual(context.transport_server.address[1], context.membership.address[1])
+        context.shutdown()
+        self.assertTrue(context.membership._socket._closed)
+        self.assertIsNone(self.context.membership)
+
+
+if __name__ == '__main__':
+    unittest.main()
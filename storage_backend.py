@@ -1,6 +1,24 @@
-import json
+import bisect
+import hashlib
+import mmap
 import os
+import struct
+import threading
+import uuid
+import zlib
 from abc import ABC, abstractmethod
+from typing import BinaryIO, Dict, Iterable, Iterator, Optional, Tuple
+
+from cache import LRUCache
+from object_metadata import ObjectMetadata
+
+# DiskStorageBackend keeps the metadata record of an object, and objects being written, in files
+# named after the object with these suffixes, so no object key may end with them
+RESERVED_SUFFIXES = ('.metadata', '.tmp')
+
+
+class InvalidObjectKeyError(ValueError):
+    pass
 
 
 class StorageBackend(ABC):
@@ -12,6 +30,15 @@ class StorageBackend(ABC):
     def write_object(self, object_key: str, object_data: bytes) -> None:
         pass
 
+    @abstractmethod
+    def read_object_stream(self, object_key: str, chunk_size: int, offset: int = 0,
+                           length: Optional[int] = None) -> Iterator[bytes]:
+        pass
+
+    @abstractmethod
+    def write_object_stream(self, object_key: str, chunks: Iterable[bytes]) -> None:
+        pass
+
     @abstractmethod
     def delete_object(self, object_key: str) -> None:
         pass
@@ -21,47 +48,584 @@ class StorageBackend(ABC):
         pass
 
     @abstractmethod
-    def read_metadata(self, object_key: str, metadata_key: str) -> str:
+    def get_object_size(self, object_key: str) -> int:
+        pass
+
+    @abstractmethod
+    def read_metadata(self, object_key: str) -> Optional[ObjectMetadata]:
+        pass
+
+    @abstractmethod
+    def write_metadata(self, object_key: str, metadata: ObjectMetadata) -> None:
+        pass
+
+    @abstractmethod
+    def list_objects(self, start_after: str = '') -> Iterator[str]:
+        pass
+
+    def delete_objects(self, object_keys: Iterable[str]) -> Dict[str, Exception]:
+        # deletes objects one at a time, returning the errors of the keys that could not be
+        # deleted; backends that can batch deletes override it
+        errors = {}
+        for object_key in object_keys:
+            try:
+                self.delete_object(object_key)
+            except OSError as e:
+                errors[object_key] = e
+        return errors
+
+    def write_object_with_metadata(self, object_key: str, chunks: Iterable[bytes], metadata: ObjectMetadata) -> None:
+        # writes an object and then, if that succeeded, its metadata record; backends reached
+        # over the network override it to send both in a single request
+        self.write_object_stream(object_key, chunks)
+        self.write_metadata(object_key, metadata)
+
+    def open_object_file(self, object_key: str) -> Optional[Tuple[BinaryIO, int, int]]:
+        # returns the open file holding the object, with the offset and size of the object in it,
+        # so it can be sent with sendfile, or None if the backend cannot hand out files
+        return None
+
+    def close(self) -> None:
         pass
 
 
 class DiskStorageBackend(StorageBackend):
-    def __init__(self, base_path: str):
+    def __init__(self, base_path: str, metadata_cache_size: int = 100000):
         self.base_path = base_path
+        self._real_base_path = os.path.realpath(base_path)
+        # parsed metadata records, so that hot objects do not re-read their metadata file;
+        # callers must treat the records they read as read-only
+        self.metadata_cache = LRUCache(metadata_cache_size)
+        # guards the cache only, never file I/O; the generation counts the records written and
+        # deleted, so a record read from its file is cached only if none was meanwhile
+        self._metadata_lock = threading.Lock()
+        self._metadata_generation = 0
 
     def read_object(self, object_key: str) -> bytes:
         with open(self._get_path(object_key), "rb") as f:
             return f.read()
 
     def write_object(self, object_key: str, object_data: bytes) -> None:
-        with open(self._get_path(object_key), "wb") as f:
-            f.write(object_data)
+        self.write_object_stream(object_key, [object_data])
+
+    def read_object_stream(self, object_key: str, chunk_size: int, offset: int = 0,
+                           length: Optional[int] = None) -> Iterator[bytes]:
+        with open(self._get_path(object_key), "rb") as f:
+            f.seek(offset)
+            remaining = length
+            while remaining is None or remaining > 0:
+                chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+                if not chunk:
+                    return
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def write_object_stream(self, object_key: str, chunks: Iterable[bytes]) -> None:
+        # write to a temporary file first so readers never see a partially written object
+        path = self._get_path(object_key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
 
     def delete_object(self, object_key: str) -> None:
         path = self._get_path(object_key)
         if os.path.exists(path):
             os.remove(path)
+        if os.path.exists(path + ".metadata"):
+            os.remove(path + ".metadata")
+        self._replaced_metadata(object_key, None)
 
     def object_exists(self, object_key: str) -> bool:
         return os.path.exists(self._get_path(object_key))
 
-    def read_metadata(self, object_key: str, metadata_key: str) -> str:
+    def get_object_size(self, object_key: str) -> int:
+        return os.path.getsize(self._get_path(object_key))
+
+    def read_metadata(self, object_key: str) -> Optional[ObjectMetadata]:
+        metadata = self.metadata_cache.get(object_key)
+        if metadata is not None:
+            return metadata
+        with self._metadata_lock:
+            generation = self._metadata_generation
+        try:
+            with open(self._get_path(object_key) + ".metadata", "rb") as f:
+                metadata = ObjectMetadata.from_bytes(f.read())
+        except (FileNotFoundError, NotADirectoryError):
+            # no object is stored below the file of another object
+            return None
+        with self._metadata_lock:
+            # a record written while this one was read may be newer, so this one is not cached
+            if self._metadata_generation == generation:
+                self.metadata_cache.put(object_key, metadata)
+        return metadata
+
+    def write_metadata(self, object_key: str, metadata: ObjectMetadata) -> None:
+        # replace the whole record at once so readers never see a partially written one
         path = self._get_path(object_key) + ".metadata"
-        if os.path.exists(path):
-            with open(path, "r") as f:
-                metadata = json.load(f)
-                return metadata.get(metadata_key, "")
-        else:
-            return ""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(metadata.to_bytes())
+        with self._metadata_lock:
+            generation = self._metadata_generation
+        os.replace(tmp_path, path)
+        self._replaced_metadata(object_key, metadata, generation)
+
+    def _replaced_metadata(self, object_key, metadata, generation=None):
+        # caches a record just written, unless another record was written or deleted since the
+        # generation, which may have replaced the file before this one did
+        with self._metadata_lock:
+            self._metadata_generation += 1
+            if metadata is not None and self._metadata_generation == generation + 1:
+                self.metadata_cache.put(object_key, metadata)
+            else:
+                self.metadata_cache.invalidate(object_key)
+
+    def open_object_file(self, object_key: str) -> Optional[Tuple[BinaryIO, int, int]]:
+        f = open(self._get_path(object_key), "rb")
+        return f, 0, os.fstat(f.fileno()).st_size
+
+    def list_objects(self, start_after: str = '') -> Iterator[str]:
+        # buckets cannot start with a dot, so top-level dot entries such as in-progress multipart
+        # uploads are internal
+        return self._list_directory(self.base_path, '', start_after)
+
+    def _list_directory(self, path, prefix, start_after):
+        # every key below a directory starts with its name and a slash, so sorting directories by
+        # that prefix yields keys in lexicographic order without reading the whole tree first
+        entries = []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if not prefix and entry.name.startswith('.'):
+                        continue
+                    if entry.is_dir():
+                        entries.append((prefix + entry.name + '/', True))
+                    elif not entry.name.endswith(RESERVED_SUFFIXES):
+                        entries.append((prefix + entry.name, False))
+        except FileNotFoundError:
+            # the directory was removed while listing
+            return
+        for name, is_dir in sorted(entries):
+            if is_dir:
+                # skip directories whose keys all sort before start_after
+                if name < start_after and not start_after.startswith(name):
+                    continue
+                yield from self._list_directory(os.path.join(self.base_path, name), name, start_after)
+            elif name > start_after:
+                yield name
 
     def _get_path(self, object_key: str) -> str:
-        return os.path.join(self.base_path, object_key)
+        # keys reach here from clients and other object servers, so no key may resolve to a path
+        # outside the base path, whether through '..' segments, an absolute path or a symlink
+        if not object_key or os.path.isabs(object_key) or '..' in object_key.split('/') or '\0' in object_key \
+                or object_key.endswith(RESERVED_SUFFIXES):
+            raise InvalidObjectKeyError(f"Invalid object key: {object_key!r}")
+        path = os.path.join(self.base_path, object_key)
+        if os.path.commonpath([self._real_base_path, os.path.realpath(path)]) != self._real_base_path:
+            raise InvalidObjectKeyError(f"Object key {object_key!r} resolves outside the storage path.")
+        return path
+
+
+# the kinds of records in the segments of a PackedStorageBackend
+_OBJECT_RECORD = 1
+_METADATA_RECORD = 2
+_DELETE_RECORD = 3
+# marks an object as stored in a file of its own because it is too large to pack
+_LARGE_OBJECT_RECORD = 4
+
+# record type, key length, value length and CRC32 of the key and value
+_RECORD_HEADER = struct.Struct('<BHQI')
+
+
+class PackedStorageBackend(StorageBackend):
+    def __init__(self, base_path: str, segment_size: int = 256 * 1024 * 1024,
+                 max_packed_size: int = 1024 * 1024, compaction_threshold: float = 0.5,
+                 compaction_interval: Optional[float] = 60, metadata_cache_size: int = 100000):
+        # objects and their metadata are appended as records to a few large segment files, so that
+        # small objects cost no inode, open or rename of their own; an in-memory index maps every
+        # key to the segment, offset and length of its latest record
+        self.base_path = base_path
+        self.segment_size = segment_size
+        self.max_packed_size = max_packed_size
+        self.compaction_threshold = compaction_threshold
+        self.metadata_cache = LRUCache(metadata_cache_size)
+        self._object_index = {}
+        self._metadata_index = {}
+        # the segment and value offset of the record marking every large object as stored in a file
+        self._large_object_records = {}
+        self._sorted_keys = None
+        self._segment_sizes = {}
+        self._live_bytes = {}
+        self._maps = {}
+        # the number of records torn by a crash that were dropped when the segments were loaded
+        self.torn_records = 0
+        self._lock = threading.Lock()
+        self._compaction_lock = threading.Lock()
+        self._stopped = threading.Event()
+        os.makedirs(os.path.join(base_path, 'large'), exist_ok=True)
+        for segment_id in sorted(self._segment_ids()):
+            self._load_segment(segment_id)
+        self._active_segment_id = max(self._segment_sizes, default=0)
+        self._active_file = None
+        if not self._segment_sizes or self._segment_sizes[self._active_segment_id] >= segment_size:
+            self._start_segment()
+        else:
+            self._active_file = open(self._segment_path(self._active_segment_id), 'ab', buffering=0)
+        self._compaction_thread = None
+        if compaction_interval is not None:
+            self._compaction_thread = threading.Thread(target=self._compact_periodically, args=(compaction_interval,),
+                                                       name='compaction', daemon=True)
+            self._compaction_thread.start()
+
+    def read_object(self, object_key: str) -> bytes:
+        return b''.join(self.read_object_stream(object_key, 1024 * 1024))
+
+    def write_object(self, object_key: str, object_data: bytes) -> None:
+        self.write_object_stream(object_key, [object_data])
+
+    def read_object_stream(self, object_key: str, chunk_size: int, offset: int = 0,
+                           length: Optional[int] = None) -> Iterator[bytes]:
+        with self._lock:
+            location = self._object_index.get(object_key)
+        if location is None:
+            raise FileNotFoundError(object_key)
+        if location == _LARGE_OBJECT_RECORD:
+            yield from self._read_large_object(object_key, chunk_size, offset, length)
+            return
+        segment_id, value_offset, value_length = location
+        end = value_length if length is None else min(offset + length, value_length)
+        while offset < end:
+            chunk_end = min(offset + chunk_size, end)
+            chunk = self._read_segment(segment_id, value_offset + offset, value_offset + chunk_end)
+            if chunk is None:
+                # the record was moved by a compaction, so read it from its new location
+                yield from self.read_object_stream(object_key, chunk_size, offset, end - offset)
+                return
+            yield chunk
+            offset = chunk_end
+
+    def write_object_stream(self, object_key: str, chunks: Iterable[bytes]) -> None:
+        # pack objects up to max_packed_size, and store larger ones in files of their own rather
+        # than holding the log while they stream in
+        buffer = bytearray()
+        chunks = iter(chunks)
+        for chunk in chunks:
+            buffer += chunk
+            if len(buffer) > self.max_packed_size:
+                self._write_large_object(object_key, buffer, chunks)
+                return
+        self._append(_OBJECT_RECORD, object_key, bytes(buffer))
+
+    def delete_object(self, object_key: str) -> None:
+        with self._lock:
+            if object_key not in self._object_index and object_key not in self._metadata_index:
+                return
+        self._append(_DELETE_RECORD, object_key, b'')
+
+    def delete_objects(self, object_keys: Iterable[str]) -> Dict[str, Exception]:
+        # append the deletions of the whole batch while holding the lock once
+        removed_large_objects = []
+        with self._lock:
+            for object_key in object_keys:
+                if object_key not in self._object_index and object_key not in self._metadata_index:
+                    continue
+                segment_id, value_offset = self._write_record(_DELETE_RECORD, object_key, b'')
+                if self._apply(_DELETE_RECORD, object_key, segment_id, value_offset, 0):
+                    removed_large_objects.append(object_key)
+                self.metadata_cache.invalidate(object_key)
+        for object_key in removed_large_objects:
+            os.remove(self._large_object_path(object_key))
+        return {}
+
+    def object_exists(self, object_key: str) -> bool:
+        with self._lock:
+            return object_key in self._object_index
+
+    def get_object_size(self, object_key: str) -> int:
+        with self._lock:
+            location = self._object_index.get(object_key)
+        if location is None:
+            raise FileNotFoundError(object_key)
+        if location == _LARGE_OBJECT_RECORD:
+            return os.path.getsize(self._large_object_path(object_key))
+        return location[2]
+
+    def read_metadata(self, object_key: str) -> Optional[ObjectMetadata]:
+        metadata = self.metadata_cache.get(object_key)
+        if metadata is not None:
+            return metadata
+        while True:
+            with self._lock:
+                location = self._metadata_index.get(object_key)
+            if location is None:
+                return None
+            segment_id, value_offset, value_length = location
+            data = self._read_segment(segment_id, value_offset, value_offset + value_length)
+            if data is None:
+                continue
+            metadata = ObjectMetadata.from_bytes(data)
+            with self._lock:
+                # only cache the record if it was not replaced meanwhile
+                if self._metadata_index.get(object_key) == location:
+                    self.metadata_cache.put(object_key, metadata)
+            return metadata
+
+    def write_metadata(self, object_key: str, metadata: ObjectMetadata) -> None:
+        self._append(_METADATA_RECORD, object_key, metadata.to_bytes(), metadata)
+
+    def list_objects(self, start_after: str = '') -> Iterator[str]:
+        with self._lock:
+            if self._sorted_keys is None:
+                # keys starting with a dot are internal, as for DiskStorageBackend
+                self._sorted_keys = sorted(object_key for object_key in self._object_index
+                                           if not object_key.startswith('.'))
+            sorted_keys = self._sorted_keys
+        return (sorted_keys[i] for i in range(bisect.bisect_right(sorted_keys, start_after), len(sorted_keys)))
+
+    def open_object_file(self, object_key: str) -> Optional[Tuple[BinaryIO, int, int]]:
+        # open the segment while holding the lock, so a compaction cannot delete it in between;
+        # it stays readable through the open file even if it is deleted afterwards
+        with self._lock:
+            location = self._object_index.get(object_key)
+            if location is None:
+                raise FileNotFoundError(object_key)
+            if location != _LARGE_OBJECT_RECORD:
+                segment_id, value_offset, value_length = location
+                return open(self._segment_path(segment_id), 'rb'), value_offset, value_length
+        f = open(self._large_object_path(object_key), 'rb')
+        return f, 0, os.fstat(f.fileno()).st_size
+
+    def compact(self) -> None:
+        """
+        Rewrites the live records of sealed segments that are mostly garbage and deletes the segments.
+        """
+        with self._compaction_lock:
+            with self._lock:
+                segment_ids = [segment_id for segment_id, segment_size in self._segment_sizes.items()
+                               if segment_id != self._active_segment_id and segment_size > 0
+                               and self._live_bytes[segment_id] < (1 - self.compaction_threshold) * segment_size]
+            for segment_id in segment_ids:
+                self._compact_segment(segment_id)
+
+    def close(self) -> None:
+        self._stopped.set()
+        if self._compaction_thread is not None:
+            self._compaction_thread.join()
+        with self._lock:
+            self._active_file.close()
+            for segment_map in self._maps.values():
+                segment_map.close()
+            self._maps.clear()
+
+    def _segment_ids(self):
+        return [int(name[len('segment-'):-len('.log')]) for name in os.listdir(self.base_path)
+                if name.startswith('segment-') and name.endswith('.log')]
+
+    def _segment_path(self, segment_id):
+        return os.path.join(self.base_path, f'segment-{segment_id:08d}.log')
+
+    def _large_object_path(self, object_key):
+        return os.path.join(self.base_path, 'large', hashlib.sha256(object_key.encode('utf-8')).hexdigest())
+
+    def _load_segment(self, segment_id):
+        # rebuild the index by replaying the records of the segment, dropping a torn record at its end
+        path = self._segment_path(segment_id)
+        self._segment_sizes[segment_id] = 0
+        self._live_bytes[segment_id] = 0
+        with open(path, 'rb') as f:
+            offset = 0
+            while True:
+                header = f.read(_RECORD_HEADER.size)
+                if len(header) < _RECORD_HEADER.size:
+                    break
+                record_type, key_length, value_length, checksum = _RECORD_HEADER.unpack(header)
+                key = f.read(key_length)
+                value = f.read(value_length)
+                if len(key) < key_length or len(value) < value_length or zlib.crc32(key + value) != checksum:
+                    break
+                record_length = _RECORD_HEADER.size + key_length + value_length
+                self._segment_sizes[segment_id] += record_length
+                self._apply(record_type, key.decode('utf-8'), segment_id, offset + record_length - value_length,
+                            value_length)
+                offset += record_length
+        if offset < os.path.getsize(path):
+            self.torn_records += 1
+            os.truncate(path, offset)
+
+    def _start_segment(self):
+        if self._active_file is not None:
+            self._active_file.close()
+        self._active_segment_id += 1
+        self._segment_sizes[self._active_segment_id] = 0
+        self._live_bytes[self._active_segment_id] = 0
+        self._active_file = open(self._segment_path(self._active_segment_id), 'ab', buffering=0)
+
+    def _write_record(self, record_type, object_key, value):
+        # appends a record to the active segment, returning the segment and offset of its value;
+        # the caller must hold the lock
+        encoded_key = object_key.encode('utf-8')
+        record = (_RECORD_HEADER.pack(record_type, len(encoded_key), len(value), zlib.crc32(encoded_key + value))
+                  + encoded_key + value)
+        segment_size = self._segment_sizes[self._active_segment_id]
+        if segment_size > 0 and segment_size + len(record) > self.segment_size:
+            self._start_segment()
+        segment_id = self._active_segment_id
+        view = memoryview(record)
+        while view:
+            view = view[self._active_file.write(view):]
+        self._segment_sizes[segment_id] += len(record)
+        return segment_id, self._segment_sizes[segment_id] - len(value)
+
+    def _append(self, record_type, object_key, value, metadata=None):
+        with self._lock:
+            segment_id, value_offset = self._write_record(record_type, object_key, value)
+            removed_large_object = self._apply(record_type, object_key, segment_id, value_offset, len(value))
+            if record_type == _METADATA_RECORD:
+                self.metadata_cache.put(object_key, metadata)
+            elif record_type == _DELETE_RECORD:
+                self.metadata_cache.invalidate(object_key)
+        if removed_large_object:
+            os.remove(self._large_object_path(object_key))
+
+    def _apply(self, record_type, object_key, segment_id, value_offset, value_length):
+        # updates the index for a record, returning whether a large object file is not needed anymore
+        record_length = _RECORD_HEADER.size + len(object_key.encode('utf-8')) + value_length
+        previous_object = self._object_index.get(object_key)
+        if record_type in (_OBJECT_RECORD, _LARGE_OBJECT_RECORD, _DELETE_RECORD) and previous_object is not None:
+            self._release(previous_object, object_key)
+        if record_type in (_METADATA_RECORD, _DELETE_RECORD) and object_key in self._metadata_index:
+            self._release(self._metadata_index.pop(object_key), object_key)
+
+        if record_type == _OBJECT_RECORD:
+            self._object_index[object_key] = (segment_id, value_offset, value_length)
+        elif record_type == _LARGE_OBJECT_RECORD:
+            self._object_index[object_key] = _LARGE_OBJECT_RECORD
+            self._large_object_records[object_key] = (segment_id, value_offset)
+        elif record_type == _METADATA_RECORD:
+            self._metadata_index[object_key] = (segment_id, value_offset, value_length)
+        else:
+            self._object_index.pop(object_key, None)
+        if record_type != _DELETE_RECORD:
+            self._live_bytes[segment_id] += record_length
+        if (previous_object is None) != (object_key not in self._object_index):
+            self._sorted_keys = None
+        return previous_object == _LARGE_OBJECT_RECORD and record_type in (_OBJECT_RECORD, _DELETE_RECORD)
+
+    def _release(self, location, object_key):
+        if location == _LARGE_OBJECT_RECORD:
+            # a large object keeps only the record marking it in the segments
+            (segment_id, _), value_length = self._large_object_records.pop(object_key), 0
+        else:
+            segment_id, _, value_length = location
+        self._live_bytes[segment_id] -= _RECORD_HEADER.size + len(object_key.encode('utf-8')) + value_length
+
+    def _read_segment(self, segment_id, start, end):
+        # returns None if the segment was deleted by a compaction meanwhile
+        with self._lock:
+            if segment_id not in self._segment_sizes:
+                return None
+            segment_map = self._maps.get(segment_id)
+            if segment_map is None or len(segment_map) < end:
+                # the active segment grows, so map it again once it outgrew its mapping
+                if segment_map is not None:
+                    segment_map.close()
+                with open(self._segment_path(segment_id), 'rb') as f:
+                    segment_map = self._maps[segment_id] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return segment_map[start:end]
+
+    def _read_large_object(self, object_key, chunk_size, offset, length):
+        with open(self._large_object_path(object_key), 'rb') as f:
+            f.seek(offset)
+            remaining = length
+            while remaining is None or remaining > 0:
+                chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+                if not chunk:
+                    return
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def _write_large_object(self, object_key, buffer, chunks):
+        path = self._large_object_path(object_key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(buffer)
+                for chunk in chunks:
+                    f.write(chunk)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._append(_LARGE_OBJECT_RECORD, object_key, b'')
+
+    def _compact_segment(self, segment_id):
+        # copy the records the index still points to into the active segment; the index is
+        # checked again while holding the lock, so a record replaced meanwhile is not copied
+        path = self._segment_path(segment_id)
+        with open(path, 'rb') as f:
+            offset = 0
+            while True:
+                header = f.read(_RECORD_HEADER.size)
+                if len(header) < _RECORD_HEADER.size:
+                    break
+                record_type, key_length, value_length, _ = _RECORD_HEADER.unpack(header)
+                object_key = f.read(key_length).decode('utf-8')
+                value = f.read(value_length)
+                value_offset = offset + _RECORD_HEADER.size + key_length
+                offset = value_offset + value_length
+                location = (segment_id, value_offset, value_length)
+                with self._lock:
+                    if record_type == _OBJECT_RECORD or record_type == _METADATA_RECORD:
+                        index = self._object_index if record_type == _OBJECT_RECORD else self._metadata_index
+                        if index.get(object_key) != location:
+                            continue
+                        self._release(location, object_key)
+                        new_segment_id, new_value_offset = self._write_record(record_type, object_key, value)
+                        index[object_key] = (new_segment_id, new_value_offset, value_length)
+                        self._live_bytes[new_segment_id] += _RECORD_HEADER.size + key_length + value_length
+                    elif record_type == _LARGE_OBJECT_RECORD:
+                        if self._large_object_records.get(object_key) != (segment_id, value_offset):
+                            continue
+                        self._release(_LARGE_OBJECT_RECORD, object_key)
+                        new_segment_id, new_value_offset = self._write_record(record_type, object_key, value)
+                        self._large_object_records[object_key] = (new_segment_id, new_value_offset)
+                        self._live_bytes[new_segment_id] += _RECORD_HEADER.size + key_length
+                    elif object_key not in self._object_index and object_key not in self._metadata_index \
+                            and min(self._segment_sizes) < segment_id:
+                        # keep the deletion while an older segment may still hold the deleted object
+                        self._write_record(record_type, object_key, value)
+        with self._lock:
+            del self._segment_sizes[segment_id]
+            del self._live_bytes[segment_id]
+            segment_map = self._maps.pop(segment_id, None)
+            if segment_map is not None:
+                segment_map.close()
+        os.remove(path)
+
+    def _compact_periodically(self, interval):
+        while not self._stopped.wait(interval):
+            try:
+                self.compact()
+            except OSError as e:
+                print(f"Error compacting segments: {e}")
 
 
 class StorageManager:
     def __init__(self, backend: str, base_path: str):
         if backend == "disk":
             self.storage_backend = DiskStorageBackend(base_path)
+        elif backend == "packed":
+            self.storage_backend = PackedStorageBackend(base_path)
         else:
             raise ValueError("Unsupported backend")
 
@@ -71,8 +635,33 @@ class StorageManager:
     def write_object(self, object_key: str, object_data: bytes) -> None:
         self.storage_backend.write_object(object_key, object_data)
 
+    def read_object_stream(self, object_key: str, chunk_size: int, offset: int = 0,
+                           length: Optional[int] = None) -> Iterator[bytes]:
+        return self.storage_backend.read_object_stream(object_key, chunk_size, offset, length)
+
+    def write_object_stream(self, object_key: str, chunks: Iterable[bytes]) -> None:
+        self.storage_backend.write_object_stream(object_key, chunks)
+
     def delete_object(self, object_key: str) -> None:
         self.storage_backend.delete_object(object_key)
 
+    def delete_objects(self, object_keys: Iterable[str]) -> Dict[str, Exception]:
+        return self.storage_backend.delete_objects(object_keys)
+
     def object_exists(self, object_key: str) -> bool:
         return self.storage_backend.object_exists(object_key)
+
+    def read_metadata(self, object_key: str) -> Optional[ObjectMetadata]:
+        return self.storage_backend.read_metadata(object_key)
+
+    def write_metadata(self, object_key: str, metadata: ObjectMetadata) -> None:
+        self.storage_backend.write_metadata(object_key, metadata)
+
+    def write_object_with_metadata(self, object_key: str, chunks: Iterable[bytes], metadata: ObjectMetadata) -> None:
+        self.storage_backend.write_object_with_metadata(object_key, chunks, metadata)
+
+    def list_objects(self, start_after: str = '') -> Iterator[str]:
+        return self.storage_backend.list_objects(start_after)
+
+    def open_object_file(self, object_key: str) -> Optional[Tuple[BinaryIO, int, int]]:
+        return self.storage_backend.open_object_file(object_key)
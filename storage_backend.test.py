@@ -0,0 +1,231 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from object_metadata import ObjectMetadata
+from storage_backend import DiskStorageBackend, InvalidObjectKeyError, PackedStorageBackend
+
+
+class TestDiskStorageBackend(unittest.TestCase):
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base_path)
+        self.storage_backend = DiskStorageBackend(self.base_path)
+
+    def test_write_and_read_object(self):
+        self.storage_backend.write_object_stream('bucket/object', [b'abc', b'def'])
+
+        self.assertTrue(self.storage_backend.object_exists('bucket/object'))
+        self.assertEqual(self.storage_backend.read_object('bucket/object'), b'abcdef')
+        self.assertEqual(list(self.storage_backend.read_object_stream('bucket/object', 2, 1, 4)), [b'bc', b'de'])
+        self.assertEqual(os.listdir(os.path.join(self.base_path, 'bucket')), ['object'])
+
+    def test_metadata_is_read_once(self):
+        metadata = ObjectMetadata(size=5, hash='ab' * 32)
+        self.storage_backend.write_metadata('bucket/object', metadata)
+
+        storage_backend = DiskStorageBackend(self.base_path)
+        self.assertEqual(storage_backend.read_metadata('bucket/object'), metadata)
+        os.remove(os.path.join(self.base_path, 'bucket', 'object.metadata'))
+        self.assertEqual(storage_backend.read_metadata('bucket/object'), metadata)
+
+    def test_record_read_during_a_write_is_not_cached(self):
+        old_metadata = ObjectMetadata(size=4)
+        new_metadata = ObjectMetadata(size=5)
+        self.storage_backend.write_metadata('bucket/object', old_metadata)
+        storage_backend = DiskStorageBackend(self.base_path)
+        from_bytes = ObjectMetadata.from_bytes
+
+        def write_while_reading(data):
+            # the file is read without holding the lock, and another thread writes meanwhile
+            self.assertFalse(storage_backend._metadata_lock.locked())
+            storage_backend.write_metadata('bucket/object', new_metadata)
+            return from_bytes(data)
+
+        with mock.patch.object(ObjectMetadata, 'from_bytes', side_effect=write_while_reading):
+            self.assertEqual(storage_backend.read_metadata('bucket/object'), old_metadata)
+        self.assertEqual(storage_backend.read_metadata('bucket/object'), new_metadata)
+
+    def test_list_objects_in_key_order(self):
+        for object_key in ['bucket/b', 'bucket/a/c', 'bucket/a-b', 'other/a', '.multipart/upload/1']:
+            self.storage_backend.write_object(object_key, b'data')
+        self.storage_backend.write_metadata('bucket/b', ObjectMetadata(size=4))
+
+        self.assertEqual(list(self.storage_backend.list_objects()), ['bucket/a-b', 'bucket/a/c', 'bucket/b', 'other/a'])
+        self.assertEqual(list(self.storage_backend.list_objects('bucket/a-b')), ['bucket/a/c', 'bucket/b', 'other/a'])
+        self.assertEqual(list(self.storage_backend.list_objects('bucket/b')), ['other/a'])
+
+    def test_missing_metadata(self):
+        self.assertIsNone(self.storage_backend.read_metadata('bucket/object'))
+
+    def test_delete_object_invalidates_metadata(self):
+        self.storage_backend.write_object('bucket/object', b'data')
+        self.storage_backend.write_metadata('bucket/object', ObjectMetadata(size=4))
+
+        self.storage_backend.delete_object('bucket/object')
+
+        self.assertFalse(self.storage_backend.object_exists('bucket/object'))
+        self.assertIsNone(self.storage_backend.read_metadata('bucket/object'))
+
+    def test_delete_objects(self):
+        for object_key in ['bucket/a', 'bucket/b']:
+            self.storage_backend.write_object(object_key, b'data')
+
+        self.assertEqual(self.storage_backend.delete_objects(['bucket/a', 'bucket/b', 'bucket/missing']), {})
+        self.assertEqual(list(self.storage_backend.list_objects()), [])
+
+    def test_keys_cannot_escape_base_path(self):
+        storage_backend = DiskStorageBackend(os.path.join(self.base_path, 'data'))
+        os.symlink(self.base_path, os.path.join(self.base_path, 'data-link'))
+        os.makedirs(os.path.join(self.base_path, 'data', 'bucket'))
+        os.symlink(self.base_path, os.path.join(self.base_path, 'data', 'bucket', 'link'))
+        for object_key in ['../escaped', 'bucket/../../escaped', '/tmp/escaped', 'bucket/link/escaped', '',
+                           'bucket/x.metadata', 'bucket/x.tmp']:
+            with self.assertRaises(InvalidObjectKeyError, msg=object_key):
+                storage_backend.write_object(object_key, b'data')
+            with self.assertRaises(InvalidObjectKeyError, msg=object_key):
+                storage_backend.delete_object(object_key)
+        self.assertEqual(sorted(os.listdir(self.base_path)), ['data', 'data-link'])
+
+
+class TestPackedStorageBackend(unittest.TestCase):
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base_path)
+        self.storage_backend = self.open()
+
+    def open(self):
+        storage_backend = PackedStorageBackend(self.base_path, segment_size=4096, max_packed_size=1000,
+                                               compaction_interval=None)
+        self.addCleanup(storage_backend.close)
+        return storage_backend
+
+    def test_write_and_read_object(self):
+        self.storage_backend.write_object_stream('bucket/object', [b'abc', b'def'])
+        self.storage_backend.write_metadata('bucket/object', ObjectMetadata(size=6))
+
+        self.assertTrue(self.storage_backend.object_exists('bucket/object'))
+        self.assertEqual(self.storage_backend.get_object_size('bucket/object'), 6)
+        self.assertEqual(self.storage_backend.read_object('bucket/object'), b'abcdef')
+        self.assertEqual(list(self.storage_backend.read_object_stream('bucket/object', 2, 1, 4)), [b'bc', b'de'])
+        self.assertEqual(self.storage_backend.read_metadata('bucket/object'), ObjectMetadata(size=6))
+        with self.assertRaises(FileNotFoundError):
+            self.storage_backend.read_object('bucket/missing')
+
+    def test_objects_are_packed_into_segments(self):
+        for i in range(100):
+            self.storage_backend.write_object(f'bucket/object-{i}', b'x' * 100)
+        self.assertEqual(len([name for name in os.listdir(self.base_path) if name.endswith('.log')]), 4)
+
+    def test_large_objects_are_stored_in_files(self):
+        object_data = os.urandom(5000)
+        self.storage_backend.write_object_stream('bucket/large', [object_data[:600], object_data[600:]])
+        self.assertEqual(len(os.listdir(os.path.join(self.base_path, 'large'))), 1)
+        self.assertEqual(self.storage_backend.read_object('bucket/large'), object_data)
+        self.assertEqual(self.storage_backend.get_object_size('bucket/large'), 5000)
+
+        self.storage_backend.write_object('bucket/large', b'small')
+        self.assertEqual(os.listdir(os.path.join(self.base_path, 'large')), [])
+        self.assertEqual(self.storage_backend.read_object('bucket/large'), b'small')
+
+    def test_index_is_rebuilt_on_open(self):
+        self.storage_backend.write_object('bucket/a', b'first')
+        self.storage_backend.write_object('bucket/a', b'second')
+        self.storage_backend.write_object('bucket/b', b'data')
+        self.storage_backend.write_metadata('bucket/b', ObjectMetadata(size=4))
+        self.storage_backend.delete_object('bucket/b')
+        self.storage_backend.close()
+        # a record torn by a crash is dropped
+        segment_path = os.path.join(self.base_path, 'segment-00000001.log')
+        with open(segment_path, 'ab') as f:
+            f.write(b'\x01\x05\x00')
+
+        storage_backend = self.open()
+        self.assertEqual(storage_backend.torn_records, 1)
+        self.assertEqual(storage_backend.read_object('bucket/a'), b'second')
+        self.assertFalse(storage_backend.object_exists('bucket/b'))
+        self.assertIsNone(storage_backend.read_metadata('bucket/b'))
+        storage_backend.write_object('bucket/c', b'data')
+        self.assertEqual(list(storage_backend.list_objects()), ['bucket/a', 'bucket/c'])
+
+    def test_compaction_keeps_live_records(self):
+        for i in range(40):
+            self.storage_backend.write_object(f'bucket/object-{i:02}', bytes([i]) * 200)
+            self.storage_backend.write_metadata(f'bucket/object-{i:02}', ObjectMetadata(size=i))
+        for i in range(0, 40, 4):
+            self.storage_backend.write_object(f'bucket/object-{i:02}', b'new')
+        for i in range(1, 40, 4):
+            self.storage_backend.delete_object(f'bucket/object-{i:02}')
+        segment_sizes = sum(os.path.getsize(os.path.join(self.base_path, name))
+                            for name in os.listdir(self.base_path) if name.endswith('.log'))
+
+        self.storage_backend.compact()
+
+        self.assertLess(sum(os.path.getsize(os.path.join(self.base_path, name))
+                            for name in os.listdir(self.base_path) if name.endswith('.log')), segment_sizes)
+        for storage_backend in [self.storage_backend, self.open()]:
+            for i in range(40):
+                object_key = f'bucket/object-{i:02}'
+                if i % 4 == 1:
+                    self.assertFalse(storage_backend.object_exists(object_key))
+                    self.assertIsNone(storage_backend.read_metadata(object_key))
+                else:
+                    self.assertEqual(storage_backend.read_object(object_key), b'new' if i % 4 == 0 else bytes([i]) * 200)
+                    self.assertEqual(storage_backend.read_metadata(object_key), ObjectMetadata(size=i))
+
+    def test_large_objects_keep_their_segments_live(self):
+        for i in range(200):
+            self.storage_backend.write_object(f'bucket/large-{i:03}', b'x' * 1001)
+        segment_names = sorted(name for name in os.listdir(self.base_path) if name.endswith('.log'))
+        self.assertGreater(len(segment_names), 1)
+
+        # segments holding only the records marking large objects are live, so they are not compacted
+        self.storage_backend.compact()
+        self.assertEqual(sorted(name for name in os.listdir(self.base_path) if name.endswith('.log')), segment_names)
+
+        for i in range(200):
+            self.storage_backend.write_object(f'bucket/large-{i:03}', b'small')
+        self.storage_backend.compact()
+        # the records marking the objects as large are garbage now, and compacted away
+        self.assertEqual(sum(self.storage_backend._live_bytes.values()), 200 * (15 + len('bucket/large-000') + 5))
+        self.assertFalse(set(segment_names[:-1]) & set(os.listdir(self.base_path)))
+        for storage_backend in [self.storage_backend, self.open()]:
+            self.assertEqual(storage_backend.read_object('bucket/large-150'), b'small')
+
+    def test_list_objects_in_key_order(self):
+        for object_key in ['bucket/b', 'bucket/a/c', 'bucket/a-b', '.multipart/upload/1']:
+            self.storage_backend.write_object(object_key, b'data')
+
+        self.assertEqual(list(self.storage_backend.list_objects()), ['bucket/a-b', 'bucket/a/c', 'bucket/b'])
+        self.assertEqual(list(self.storage_backend.list_objects('bucket/a-b')), ['bucket/a/c', 'bucket/b'])
+
+    def test_open_object_file(self):
+        self.storage_backend.write_object('bucket/a', b'first')
+        self.storage_backend.write_object('bucket/b', b'second')
+        self.storage_backend.write_object('bucket/large', b'x' * 5000)
+
+        for object_key, object_data in [('bucket/b', b'second'), ('bucket/large', b'x' * 5000)]:
+            f, offset, size = self.storage_backend.open_object_file(object_key)
+            with f:
+                f.seek(offset)
+                self.assertEqual(f.read(size), object_data)
+        with self.assertRaises(FileNotFoundError):
+            self.storage_backend.open_object_file('bucket/missing')
+
+    def test_delete_objects(self):
+        self.storage_backend.write_object('bucket/a', b'data')
+        self.storage_backend.write_metadata('bucket/a', ObjectMetadata(size=4))
+        self.storage_backend.write_object('bucket/large', b'x' * 5000)
+        self.storage_backend.write_object('bucket/kept', b'data')
+
+        self.assertEqual(self.storage_backend.delete_objects(['bucket/a', 'bucket/large', 'bucket/missing']), {})
+
+        self.assertIsNone(self.storage_backend.read_metadata('bucket/a'))
+        self.assertEqual(os.listdir(os.path.join(self.base_path, 'large')), [])
+        self.assertEqual(list(self.open().list_objects()), ['bucket/kept'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,534 @@
+import contextlib
+import hashlib
+import hmac
+import itertools
+import os
+import socket
+import socketserver
+import struct
+import threading
+from typing import Dict, Iterable, Iterator, Optional
+
+from object_metadata import ObjectMetadata
+from object_pipeline import CHUNK_SIZE
+from storage_backend import StorageBackend
+
+# the operations object servers call on each other's storage backends
+READ_OBJECT = 1
+WRITE_OBJECT = 2
+DELETE_OBJECT = 3
+DELETE_OBJECTS = 4
+OBJECT_EXISTS = 5
+GET_OBJECT_SIZE = 6
+READ_METADATA = 7
+WRITE_METADATA = 8
+LIST_OBJECTS = 9
+WRITE_OBJECT_WITH_METADATA = 10
+
+# the status of every response
+OK = 0
+NOT_FOUND = 1
+ERROR = 2
+
+# the most keys sent in a single request
+BATCH_SIZE = 1000
+
+# what the cluster secret object servers authenticate to each other with is derived from the
+# master key they share for
+SECRET_PURPOSE = b'transport'
+
+_REQUEST = struct.Struct('<BIQ')
+_RESPONSE = struct.Struct('<BQ')
+_CHUNK = struct.Struct('<I')
+_STRING = struct.Struct('<I')
+_READ_RANGE = struct.Struct('<QQI')
+_UINT64 = struct.Struct('<Q')
+_UINT32 = struct.Struct('<I')
+_NO_LENGTH = 2 ** 64 - 1
+# the size of the random challenge a connecting client answers to prove it holds the cluster secret
+_CHALLENGE_SIZE = 16
+_PROOF_SIZE = hashlib.sha256().digest_size
+_HANDSHAKE_TIMEOUT = 10
+
+
+class RemoteError(OSError):
+    pass
+
+
+def _read_exactly(f, size):
+    data = f.read(size)
+    if len(data) < size:
+        raise ConnectionError("Connection closed in the middle of a message.")
+    return data
+
+
+def _proof(secret, challenge):
+    return hmac.new(secret, b'kriya-transport/' + challenge, hashlib.sha256).digest()
+
+
+def _read_chunks(f):
+    while True:
+        (length,) = _CHUNK.unpack(_read_exactly(f, _CHUNK.size))
+        if not length:
+            return
+        yield _read_exactly(f, length)
+
+
+def _encode_strings(strings):
+    encoded_strings = []
+    for string in strings:
+        encoded_string = string.encode('utf-8')
+        encoded_strings.append(_STRING.pack(len(encoded_string)) + encoded_string)
+    return b''.join(encoded_strings)
+
+
+def _decode_strings(data):
+    strings = []
+    offset = 0
+    while offset < len(data):
+        (length,) = _STRING.unpack_from(data, offset)
+        offset += _STRING.size
+        strings.append(data[offset:offset + length].decode('utf-8'))
+        offset += length
+    return strings
+
+
+class Connection:
+    """
+    One persistent connection to the transport server of another object server.
+
+    On connecting, the server sends a random challenge, and the client answers it with an HMAC of
+    the challenge keyed with the cluster secret; the server closes connections that answer wrong.
+    Every request is a header holding the operation and the lengths of the key and argument that
+    follow it, then, for writes, the object data as a sequence of length-prefixed chunks ending
+    with an empty chunk. Every response is a header holding the status and the length of the body
+    that follows it, then, for reads, the object data as chunks the same way. The server answers
+    the requests of a connection in order, so several requests can be sent before reading any
+    response.
+    """
+
+    def __init__(self, address, secret, timeout=None):
+        self._socket = socket.create_connection(address, timeout)
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._rfile = self._socket.makefile('rb')
+        self._wfile = self._socket.makefile('wb')
+        try:
+            # the proof goes out with the first request, so authenticating costs no round trip of its own
+            self._wfile.write(_proof(secret, _read_exactly(self._rfile, _CHALLENGE_SIZE)))
+        except BaseException:
+            self.close()
+            raise
+
+    def send_request(self, operation, key='', argument=b'', chunks=None):
+        """
+        Buffers a request; it is sent by the next flush.
+        """
+        encoded_key = key.encode('utf-8')
+        self._wfile.write(_REQUEST.pack(operation, len(encoded_key), len(argument)))
+        self._wfile.write(encoded_key)
+        self._wfile.write(argument)
+        if chunks is not None:
+            for chunk in chunks:
+                if chunk:
+                    self._wfile.write(_CHUNK.pack(len(chunk)))
+                    self._wfile.write(chunk)
+            self._wfile.write(_CHUNK.pack(0))
+
+    def flush(self):
+        self._wfile.flush()
+
+    def read_response(self):
+        """
+        Returns the status and body of the next response.
+        """
+        status, length = _RESPONSE.unpack(_read_exactly(self._rfile, _RESPONSE.size))
+        return status, _read_exactly(self._rfile, length)
+
+    def read_chunks(self):
+        """
+        Returns an iterator over the chunks of object data following a response.
+        """
+        return _read_chunks(self._rfile)
+
+    def close(self):
+        for f in (self._rfile, self._wfile, self._socket):
+            try:
+                f.close()
+            except OSError:
+                pass
+
+
+class ConnectionPool:
+    """
+    A pool of persistent connections to one transport server, so requests do not pay for
+    connecting. Connections are reused as long as every request on them completed; a connection
+    left in the middle of a request is closed instead.
+
+    Attributes:
+    - address: The (host, port) address of the transport server.
+    - max_idle_connections: The most connections kept open while not in use.
+    - timeout: The time (in seconds) to wait for connecting and for every read and write.
+    """
+
+    def __init__(self, address, secret, max_idle_connections=8, timeout=10):
+        """
+        Initializes a new instance of the ConnectionPool class.
+
+        Args:
+        - address: The (host, port) address of the transport server.
+        - secret: The cluster secret connections authenticate with.
+        - max_idle_connections: The most connections kept open while not in use.
+        - timeout: The time (in seconds) to wait for connecting and for every read and write.
+        """
+        self.address = tuple(address)
+        self._secret = secret
+        self.max_idle_connections = max_idle_connections
+        self.timeout = timeout
+        self._idle_connections = []
+        self._closed = False
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """
+        Returns a context manager lending a connection, which is returned to the pool afterwards
+        unless an exception interrupted it.
+        """
+        with self._lock:
+            connection = self._idle_connections.pop() if self._idle_connections else None
+        if connection is None:
+            connection = Connection(self.address, self._secret, self.timeout)
+        try:
+            yield connection
+        except BaseException:
+            connection.close()
+            raise
+        with self._lock:
+            if not self._closed and len(self._idle_connections) < self.max_idle_connections:
+                self._idle_connections.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        """
+        Closes the idle connections; connections in use are closed when they are returned.
+        """
+        with self._lock:
+            self._closed = True
+            connections, self._idle_connections = self._idle_connections, []
+        for connection in connections:
+            connection.close()
+
+
+class RemoteStorageBackend(StorageBackend):
+    """
+    The storage backend of another object server, called through its transport server.
+
+    Requests without object data are idempotent, so they are retried once on a new connection if
+    a pooled connection turns out to have been closed by the server meanwhile.
+
+    Attributes:
+    - pool: The pool of connections to the transport server.
+    """
+
+    def __init__(self, address, secret, max_idle_connections=8, timeout=10):
+        """
+        Initializes a new instance of the RemoteStorageBackend class.
+
+        Args:
+        - address: The (host, port) address of the transport server.
+        - secret: The cluster secret the transport server accepts.
+        - max_idle_connections: The most connections kept open while not in use.
+        - timeout: The time (in seconds) to wait for connecting and for every read and write.
+        """
+        self.pool = ConnectionPool(address, secret, max_idle_connections, timeout)
+
+    def read_object(self, object_key: str) -> bytes:
+        return b''.join(self.read_object_stream(object_key, CHUNK_SIZE))
+
+    def write_object(self, object_key: str, object_data: bytes) -> None:
+        self.write_object_stream(object_key, [object_data])
+
+    def read_object_stream(self, object_key: str, chunk_size: int, offset: int = 0,
+                           length: Optional[int] = None) -> Iterator[bytes]:
+        with self.pool.connection() as connection:
+            connection.send_request(READ_OBJECT, object_key,
+                                    _READ_RANGE.pack(offset, _NO_LENGTH if length is None else length, chunk_size))
+            connection.flush()
+            status, body = connection.read_response()
+            if status == OK:
+                yield from connection.read_chunks()
+        self._check_status(object_key, status, body)
+
+    def write_object_stream(self, object_key: str, chunks: Iterable[bytes]) -> None:
+        # the chunks are streamed without waiting for the server between them
+        with self.pool.connection() as connection:
+            connection.send_request(WRITE_OBJECT, object_key, chunks=chunks)
+            connection.flush()
+            status, body = connection.read_response()
+        self._check_status(object_key, status, body)
+
+    def write_object_with_metadata(self, object_key: str, chunks: Iterable[bytes], metadata: ObjectMetadata) -> None:
+        # the metadata record rides along with the object data, so a replica costs one round trip
+        with self.pool.connection() as connection:
+            connection.send_request(WRITE_OBJECT_WITH_METADATA, object_key, metadata.to_bytes(), chunks)
+            connection.flush()
+            status, body = connection.read_response()
+        self._check_status(object_key, status, body)
+
+    def delete_object(self, object_key: str) -> None:
+        self._call(DELETE_OBJECT, object_key)
+
+    def delete_objects(self, object_keys: Iterable[str]) -> Dict[str, Exception]:
+        # send every batch before reading any response, so a large delete costs one round trip
+        object_keys = list(object_keys)
+        batches = [object_keys[i:i + BATCH_SIZE] for i in range(0, len(object_keys), BATCH_SIZE)]
+        with self.pool.connection() as connection:
+            for batch in batches:
+                connection.send_request(DELETE_OBJECTS, argument=_encode_strings(batch))
+            connection.flush()
+            responses = [connection.read_response() for _ in batches]
+        errors = {}
+        for status, body in responses:
+            self._check_status('', status, body)
+            failures = _decode_strings(body)
+            for object_key, message in zip(failures[::2], failures[1::2]):
+                errors[object_key] = RemoteError(message)
+        return errors
+
+    def object_exists(self, object_key: str) -> bool:
+        return self._call(OBJECT_EXISTS, object_key) == b'\x01'
+
+    def get_object_size(self, object_key: str) -> int:
+        return _UINT64.unpack(self._call(GET_OBJECT_SIZE, object_key))[0]
+
+    def read_metadata(self, object_key: str) -> Optional[ObjectMetadata]:
+        try:
+            return ObjectMetadata.from_bytes(self._call(READ_METADATA, object_key))
+        except FileNotFoundError:
+            return None
+
+    def write_metadata(self, object_key: str, metadata: ObjectMetadata) -> None:
+        self._call(WRITE_METADATA, object_key, metadata.to_bytes())
+
+    def list_objects(self, start_after: str = '') -> Iterator[str]:
+        while True:
+            object_keys = _decode_strings(self._call(LIST_OBJECTS, start_after, _UINT32.pack(BATCH_SIZE)))
+            yield from object_keys
+            if len(object_keys) < BATCH_SIZE:
+                return
+            start_after = object_keys[-1]
+
+    def close(self) -> None:
+        self.pool.close()
+
+    def _call(self, operation, object_key, argument=b''):
+        for attempt in range(2):
+            try:
+                with self.pool.connection() as connection:
+                    connection.send_request(operation, object_key, argument)
+                    connection.flush()
+                    status, body = connection.read_response()
+                break
+            except ConnectionError:
+                if attempt:
+                    raise
+        self._check_status(object_key, status, body)
+        return body
+
+    def _check_status(self, object_key, status, body):
+        if status == NOT_FOUND:
+            raise FileNotFoundError(object_key)
+        if status != OK:
+            raise RemoteError(body.decode('utf-8', 'replace'))
+
+
+class RemoteObjectServer:
+    """
+    The object server of another node, as a member of the local object server cluster.
+
+    Attributes:
+    - node_id: The ID of the node.
+    - address: The (host, port) address of its transport server.
+    - storage_backend: Its storage backend, called through the transport server.
+    """
+
+    def __init__(self, node_id, address, secret, max_idle_connections=8, timeout=10):
+        self.node_id = node_id
+        self.address = tuple(address)
+        self.storage_backend = RemoteStorageBackend(address, secret, max_idle_connections, timeout)
+
+    def close(self):
+        self.storage_backend.close()
+
+
+class _TransportHandler(socketserver.StreamRequestHandler):
+    # buffer responses so that a response and its chunks go out in as few writes as possible
+    wbufsize = 64 * 1024
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        challenge = os.urandom(_CHALLENGE_SIZE)
+        try:
+            # a client that never answers does not hold on to its thread for long
+            self.connection.settimeout(_HANDSHAKE_TIMEOUT)
+            self.wfile.write(challenge)
+            self.wfile.flush()
+            proof = self.rfile.read(_PROOF_SIZE)
+            self.connection.settimeout(None)
+        except OSError:
+            return
+        if not hmac.compare_digest(proof, _proof(self.server.secret, challenge)):
+            # closing without a response leaves clients without the secret nothing to learn from
+            return
+        storage_backend = self.server.storage_backend
+        while True:
+            header = self.rfile.read(_REQUEST.size)
+            if len(header) < _REQUEST.size:
+                return
+            operation, key_length, argument_length = _REQUEST.unpack(header)
+            object_key = _read_exactly(self.rfile, key_length).decode('utf-8')
+            argument = _read_exactly(self.rfile, argument_length)
+            if operation == READ_OBJECT:
+                self._read_object(storage_backend, object_key, argument)
+            elif operation in (WRITE_OBJECT, WRITE_OBJECT_WITH_METADATA):
+                self._write_object(storage_backend, object_key,
+                                   argument if operation == WRITE_OBJECT_WITH_METADATA else None)
+            else:
+                try:
+                    self._respond(OK, self._dispatch(storage_backend, operation, object_key, argument))
+                except FileNotFoundError:
+                    self._respond(NOT_FOUND)
+                except Exception as e:
+                    self._respond(ERROR, str(e).encode('utf-8'))
+            self.wfile.flush()
+
+    def _dispatch(self, storage_backend, operation, object_key, argument):
+        if operation == DELETE_OBJECT:
+            storage_backend.delete_object(object_key)
+            return b''
+        if operation == DELETE_OBJECTS:
+            errors = storage_backend.delete_objects(_decode_strings(argument))
+            return _encode_strings(value for object_key, error in errors.items() for value in (object_key, str(error)))
+        if operation == OBJECT_EXISTS:
+            return b'\x01' if storage_backend.object_exists(object_key) else b'\x00'
+        if operation == GET_OBJECT_SIZE:
+            return _UINT64.pack(storage_backend.get_object_size(object_key))
+        if operation == READ_METADATA:
+            metadata = storage_backend.read_metadata(object_key)
+            if metadata is None:
+                raise FileNotFoundError(object_key)
+            return metadata.to_bytes()
+        if operation == WRITE_METADATA:
+            storage_backend.write_metadata(object_key, ObjectMetadata.from_bytes(argument))
+            return b''
+        if operation == LIST_OBJECTS:
+            (limit,) = _UINT32.unpack(argument)
+            object_keys = []
+            for listed_key in storage_backend.list_objects(object_key):
+                if len(object_keys) == limit:
+                    break
+                object_keys.append(listed_key)
+            return _encode_strings(object_keys)
+        raise ValueError(f"Unknown operation {operation}.")
+
+    def _read_object(self, storage_backend, object_key, argument):
+        offset, length, chunk_size = _READ_RANGE.unpack(argument)
+        try:
+            chunks = iter(storage_backend.read_object_stream(object_key, chunk_size or CHUNK_SIZE, offset,
+                                                             None if length == _NO_LENGTH else length))
+            # a missing object only shows when the first chunk is read
+            first_chunk = next(chunks, b'')
+        except FileNotFoundError:
+            self._respond(NOT_FOUND)
+            return
+        except Exception as e:
+            self._respond(ERROR, str(e).encode('utf-8'))
+            return
+        self._respond(OK)
+        # an error past this point leaves the client with a truncated stream, so it propagates
+        # and closes the connection
+        for chunk in itertools.chain([first_chunk], chunks):
+            if chunk:
+                self.wfile.write(_CHUNK.pack(len(chunk)))
+                self.wfile.write(chunk)
+        self.wfile.write(_CHUNK.pack(0))
+
+    def _write_object(self, storage_backend, object_key, metadata_bytes=None):
+        chunks = _read_chunks(self.rfile)
+        try:
+            if metadata_bytes is None:
+                storage_backend.write_object_stream(object_key, chunks)
+            else:
+                storage_backend.write_object_with_metadata(object_key, chunks, ObjectMetadata.from_bytes(metadata_bytes))
+        except ConnectionError:
+            raise
+        except Exception as e:
+            # read the rest of the chunks so the next request is found where it starts
+            for _ in chunks:
+                pass
+            self._respond(ERROR, str(e).encode('utf-8'))
+            return
+        self._respond(OK)
+
+    def _respond(self, status, body=b''):
+        self.wfile.write(_RESPONSE.pack(status, len(body)))
+        self.wfile.write(body)
+
+
+class TransportServer(socketserver.ThreadingTCPServer):
+    """
+    Serves the storage backend of the local object server to the other object servers in the
+    cluster over persistent connections, with a thread per connection.
+
+    Only clients proving they hold the cluster secret are served. The traffic itself is neither
+    encrypted nor authenticated past the handshake, so the server should listen on an interface
+    of the private network the object servers share, never on a public one.
+
+    Attributes:
+    - storage_backend: The storage backend served.
+    - secret: The cluster secret clients must prove they hold.
+    - address: The (host, port) address the server listens on.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, storage_backend, secret):
+        """
+        Initializes a new instance of the TransportServer class, binding its socket.
+
+        Args:
+        - address: The (host, port) address to listen on; port 0 picks a free port.
+        - storage_backend: The storage backend to serve.
+        - secret: The cluster secret clients must prove they hold.
+
+        Raises:
+        - ValueError: If the secret is empty.
+        """
+        if not secret:
+            raise ValueError("The transport server needs a cluster secret.")
+        self.storage_backend = storage_backend
+        self.secret = secret
+        super().__init__(tuple(address), _TransportHandler)
+        self.address = self.server_address
+        self._thread = None
+
+    def start(self):
+        """
+        Starts serving in a background thread.
+        """
+        self._thread = threading.Thread(target=self.serve_forever, name='transport-server', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops serving and closes the listening socket.
+        """
+        if self._thread is not None:
+            self.shutdown()
+            self._thread.join()
+        self.server_close()
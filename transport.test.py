@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import transport
+from object_metadata import ObjectMetadata
+from storage_backend import DiskStorageBackend
+from transport import RemoteStorageBackend, TransportServer
+
+
+class TestTransport(unittest.TestCase):
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base_path)
+        self.storage_backend = DiskStorageBackend(self.base_path)
+        self.secret = os.urandom(32)
+        self.server = TransportServer(('localhost', 0), self.storage_backend, self.secret)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        self.remote = RemoteStorageBackend(self.server.address, self.secret)
+        self.addCleanup(self.remote.close)
+
+    def test_write_and_read_object(self):
+        self.remote.write_object_stream('bucket/object', [b'abc', b'', b'def'])
+
+        self.assertEqual(self.storage_backend.read_object('bucket/object'), b'abcdef')
+        self.assertTrue(self.remote.object_exists('bucket/object'))
+        self.assertEqual(self.remote.get_object_size('bucket/object'), 6)
+        self.assertEqual(self.remote.read_object('bucket/object'), b'abcdef')
+        self.assertEqual(list(self.remote.read_object_stream('bucket/object', 2, 1, 4)), [b'bc', b'de'])
+
+    def test_metadata(self):
+        metadata = ObjectMetadata(size=5, hash='ab' * 32, last_modified=1000.0)
+
+        self.assertIsNone(self.remote.read_metadata('bucket/object'))
+        self.remote.write_metadata('bucket/object', metadata)
+        self.assertEqual(self.remote.read_metadata('bucket/object'), metadata)
+
+    def test_write_object_with_metadata(self):
+        metadata = ObjectMetadata(size=6, hash='ab' * 32, last_modified=1000.0)
+
+        self.remote.write_object_with_metadata('bucket/object', [b'abc', b'def'], metadata)
+        self.assertEqual(self.storage_backend.read_object('bucket/object'), b'abcdef')
+        self.assertEqual(self.storage_backend.read_metadata('bucket/object'), metadata)
+
+        # the metadata record is not written along with an object that failed to be written
+        with self.assertRaises(transport.RemoteError):
+            self.remote.write_object_with_metadata('bucket/object/nested', [b'data'], metadata)
+        self.assertIsNone(self.storage_backend.read_metadata('bucket/object/nested'))
+
+    def test_missing_object(self):
+        self.assertFalse(self.remote.object_exists('bucket/missing'))
+        with self.assertRaises(FileNotFoundError):
+            self.remote.read_object('bucket/missing')
+        # the connection is still usable after an error
+        self.remote.write_object('bucket/object', b'data')
+        self.assertEqual(self.remote.read_object('bucket/object'), b'data')
+
+    def test_delete_objects_in_pipelined_batches(self):
+        object_keys = [f'bucket/{i:02}' for i in range(5)]
+        for object_key in object_keys:
+            self.storage_backend.write_object(object_key, b'data')
+
+        with mock.patch.object(transport, 'BATCH_SIZE', 2):
+            self.assertEqual(self.remote.delete_objects(object_keys), {})
+        self.assertEqual(list(self.storage_backend.list_objects()), [])
+
+    def test_list_objects_in_pages(self):
+        for i in range(5):
+            self.storage_backend.write_object(f'bucket/{i}', b'data')
+
+        with mock.patch.object(transport, 'BATCH_SIZE', 2):
+            self.assertEqual(list(self.remote.list_objects()), [f'bucket/{i}' for i in range(5)])
+            self.assertEqual(list(self.remote.list_objects('bucket/2')), ['bucket/3', 'bucket/4'])
+
+    def test_connections_are_reused(self):
+        self.remote.write_object('bucket/object', b'data')
+        for _ in range(3):
+            self.remote.read_metadata('bucket/object')
+            self.remote.read_object('bucket/object')
+
+        self.assertEqual(len(self.remote.pool._idle_connections), 1)
+
+    def test_stale_connection_is_replaced(self):
+        self.remote.object_exists('bucket/object')
+        self.remote.pool._idle_connections[0]._socket.shutdown(2)
+
+        self.assertFalse(self.remote.object_exists('bucket/object'))
+
+
+    def test_clients_without_the_secret_are_refused(self):
+        for secret in [os.urandom(32), b'']:
+            intruder = RemoteStorageBackend(self.server.address, secret)
+            self.addCleanup(intruder.close)
+            with self.assertRaises(ConnectionError):
+                intruder.write_object('bucket/object', b'data')
+            with self.assertRaises(ConnectionError):
+                intruder.object_exists('bucket/object')
+        self.assertFalse(self.storage_backend.object_exists('bucket/object'))
+
+    def test_server_needs_a_secret(self):
+        with self.assertRaises(ValueError):
+            TransportServer(('localhost', 0), self.storage_backend, b'')
+
+
+if __name__ == '__main__':
+    unittest.main()